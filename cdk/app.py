@@ -6,6 +6,7 @@ from aws_cdk import (
 
 from cdk.lambda_api_stack import LambdaApiStack
 from cdk.lambda_rollup_stack import LambdaRollupStack
+from cdk.lambda_tiles_stack import LambdaTileSeedStack
 
 from settings import settings
 
@@ -63,4 +64,20 @@ Tags.of(rollup).add("project", settings.PROJECT)
 Tags.of(rollup).add("product", "api")
 Tags.of(rollup).add("env", settings.ENV)
 
+# seeding only makes sense with a tile store shared by the api functions
+if lambda_env.API_TILE_CACHE_STORE:
+    tile_seed = LambdaTileSeedStack(
+        app,
+        f"openaq-tile-seed-{settings.ENV}",
+        env_name=settings.ENV,
+        lambda_env=lambda_env,
+        lambda_timeout=settings.TILE_SEED_LAMBDA_TIMEOUT,
+        lambda_memory_size=settings.TILE_SEED_LAMBDA_MEMORY_SIZE,
+        rate_minutes=settings.TILE_SEED_RATE_MINUTES,
+    )
+
+    Tags.of(tile_seed).add("project", settings.PROJECT)
+    Tags.of(tile_seed).add("product", "api")
+    Tags.of(tile_seed).add("env", settings.ENV)
+
 app.synth()
@@ -34,6 +34,7 @@ from constructs import Construct
 from cdk.utils import (
     stringify_settings,
     create_dependencies_layer,
+    tile_store_policies,
 )
 
 
@@ -108,6 +109,7 @@ class LambdaApiStack(Stack):
             )
             redis_cluster.add_depends_on(redis_subnet_group)
 
+        tile_store = lambda_env.API_TILE_CACHE_STORE
         lambda_env = stringify_settings(lambda_env)
         lambda_env["REDIS_HOST"] = redis_cluster.attr_configuration_end_point_address
         lambda_env["REDIS_PORT"] = redis_cluster.attr_configuration_end_point_port
@@ -149,6 +151,9 @@ class LambdaApiStack(Stack):
             )
         )
 
+        for statement in tile_store_policies(tile_store):
+            openaq_api.add_to_role_policy(statement)
+
         api = HttpApi(
             self,
             f"{id}-endpoint",
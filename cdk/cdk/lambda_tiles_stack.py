@@ -0,0 +1,72 @@
+from pathlib import Path
+from typing import Dict
+
+from aws_cdk import (
+    aws_lambda,
+    Stack,
+    Duration,
+    aws_events,
+    aws_events_targets,
+)
+from constructs import Construct
+
+from cdk.utils import (
+    stringify_settings,
+    create_dependencies_layer,
+    tile_store_policies,
+)
+
+
+class LambdaTileSeedStack(Stack):
+    def __init__(
+        self,
+        scope: Construct,
+        id: str,
+        env_name: str,
+        lambda_env: Dict,
+        lambda_timeout: int = 900,
+        lambda_memory_size: int = 1536,
+        rate_minutes: int = 60,
+        **kwargs,
+    ) -> None:
+        """Lambda plus cronjob to seed the low zoom tiles of the tile store"""
+        super().__init__(scope, id, **kwargs)
+
+        seed_function = aws_lambda.Function(
+            self,
+            f"{id}-tile-seed-lambda",
+            code=aws_lambda.Code.from_asset(
+                path="../openaq_fastapi",
+                exclude=[
+                    "venv",
+                    "__pycache__",
+                    "pytest_cache",
+                ],
+            ),
+            handler="openaq_fastapi.tilecache.seed_handler",
+            runtime=aws_lambda.Runtime.PYTHON_3_9,
+            allow_public_subnet=True,
+            memory_size=lambda_memory_size,
+            timeout=Duration.seconds(lambda_timeout),
+            environment=stringify_settings(lambda_env),
+            layers=[
+                create_dependencies_layer(
+                    self,
+                    f"{env_name}",
+                    "api",  # just use the same layer for now
+                    Path("../openaq_fastapi/requirements.txt"),
+                ),
+            ],
+        )
+
+        for statement in tile_store_policies(lambda_env.API_TILE_CACHE_STORE):
+            seed_function.add_to_role_policy(statement)
+
+        aws_events.Rule(
+            self,
+            f"{id}-tile-seed-event-rule",
+            schedule=aws_events.Schedule.rate(Duration.minutes(rate_minutes)),
+            targets=[
+                aws_events_targets.LambdaFunction(seed_function),
+            ],
+        )
@@ -1,8 +1,10 @@
 from os import environ
 from pathlib import Path
 import subprocess
+from typing import List, Union
+from urllib.parse import urlparse
 
-from aws_cdk import aws_lambda
+from aws_cdk import aws_iam, aws_lambda
 
 
 def dictstr(item):
@@ -13,6 +15,37 @@ def stringify_settings(data):
     return dict(map(dictstr, data.dict().items()))
 
 
+def tile_store_policies(store: Union[str, None]) -> List[aws_iam.PolicyStatement]:
+    """
+    read and write on the prefix of an s3://bucket/prefix tile store,
+    along with listing it so that a missing tile is a NoSuchKey and not
+    an AccessDenied. Nothing for other stores.
+    """
+    if not store:
+        return []
+    parsed = urlparse(store)
+    if parsed.scheme != "s3":
+        return []
+    bucket = parsed.netloc
+    prefix = parsed.path.strip("/")
+    objects = f"{prefix}/*" if prefix else "*"
+    list_bucket = aws_iam.PolicyStatement(
+        actions=["s3:ListBucket"],
+        resources=[f"arn:aws:s3:::{bucket}"],
+        effect=aws_iam.Effect.ALLOW,
+    )
+    if prefix:
+        list_bucket.add_condition("StringLike", {"s3:prefix": [objects]})
+    return [
+        aws_iam.PolicyStatement(
+            actions=["s3:GetObject", "s3:PutObject"],
+            resources=[f"arn:aws:s3:::{bucket}/{objects}"],
+            effect=aws_iam.Effect.ALLOW,
+        ),
+        list_bucket,
+    ]
+
+
 def create_dependencies_layer(
     self, env_name: str, function_name: str, requirements_path: Path
 ) -> aws_lambda.LayerVersion:
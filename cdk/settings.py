@@ -1,4 +1,3 @@
-from typing import List
 from pydantic import BaseSettings
 from pathlib import Path
 from os import environ
@@ -13,6 +12,9 @@ class Settings(BaseSettings):
     API_CACHE_TIMEOUT: int = 900
     ROLLUP_LAMBDA_TIMEOUT: int = 900
     ROLLUP_LAMBDA_MEMORY_SIZE: int = 1536
+    TILE_SEED_LAMBDA_TIMEOUT: int = 900
+    TILE_SEED_LAMBDA_MEMORY_SIZE: int = 1536
+    TILE_SEED_RATE_MINUTES: int = 60
     LOG_LEVEL: str = "INFO"
     HOSTED_ZONE_ID: str = None
     HOSTED_ZONE_NAME: str = None
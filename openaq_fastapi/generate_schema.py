@@ -4,7 +4,10 @@ from typing import Dict
 
 from fastapi.openapi.utils import get_openapi
 
-from openaq_fastapi.main import app
+from openaq_fastapi.main import app, routers
+
+# the routers are otherwise only imported when first requested
+routers.load_all()
 
 
 def convert_to_3_1(schema: Dict) -> Dict:
@@ -0,0 +1,95 @@
+"""
+Reports how long importing the api takes, per module, to keep an eye on
+lambda cold starts. Pass the paths of the first requests to include the
+routers they would load.
+
+    python import_profile.py --path /v3/locations/1 --top 20
+    python import_profile.py --all --json > import_times.json
+"""
+import argparse
+import json
+import re
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Dict, List
+
+line_re = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+
+def profile(paths: List[str], load_all: bool = False) -> List[Dict]:
+    code = ["from openaq_fastapi.main import routers"]
+    if load_all:
+        code.append("routers.load_all()")
+    for path in paths:
+        code.append(f"routers.load_for({path!r})")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "\n".join(code)],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        sys.exit(result.stderr)
+    modules = []
+    for line in result.stderr.splitlines():
+        match = line_re.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            modules.append(
+                {
+                    "module": module,
+                    "self_ms": int(self_us) / 1000,
+                    "cumulative_ms": int(cumulative_us) / 1000,
+                    # nesting level of the import, 0 for imports done directly
+                    "depth": (len(indent) - 1) // 2,
+                }
+            )
+    return modules
+
+
+def summarize(modules: List[Dict], top: int) -> Dict:
+    packages: Dict[str, float] = defaultdict(float)
+    for m in modules:
+        packages[m["module"].split(".")[0]] += m["self_ms"]
+    return {
+        "total_ms": round(sum(m["cumulative_ms"] for m in modules if m["depth"] == 0), 1),
+        "modules": len(modules),
+        "packages": dict(
+            sorted(
+                ((k, round(v, 1)) for k, v in packages.items()),
+                key=lambda kv: kv[1],
+                reverse=True,
+            )[:top]
+        ),
+        "slowest": sorted(modules, key=lambda m: m["cumulative_ms"], reverse=True)[:top],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--path",
+        action="append",
+        default=[],
+        help="request path to load routers for, can be repeated",
+    )
+    parser.add_argument("--all", action="store_true", help="load every router")
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--json", action="store_true", help="print json")
+    args = parser.parse_args()
+
+    summary = summarize(profile(args.path, args.all), args.top)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    print(f"total import time: {summary['total_ms']}ms ({summary['modules']} modules)\n")
+    print("self time by package")
+    for package, ms in summary["packages"].items():
+        print(f"  {ms:9.1f}ms  {package}")
+    print("\nslowest modules (cumulative)")
+    for m in summary["slowest"]:
+        print(f"  {m['cumulative_ms']:9.1f}ms  {m['self_ms']:8.1f}ms  {m['module']}")
+
+
+if __name__ == "__main__":
+    main()
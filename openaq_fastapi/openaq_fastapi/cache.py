@@ -0,0 +1,634 @@
+import asyncio
+import base64
+import hashlib
+import logging
+import sys
+import time
+import uuid
+from collections import OrderedDict
+from contextvars import ContextVar
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Tuple, Union
+
+import orjson
+from aiocache import cached
+from aiocache.base import BaseCache
+from aiocache.plugins import HitMissRatioPlugin
+from aiocache.serializers import NullSerializer
+
+logger = logging.getLogger("cache")
+
+# set by DB.fetch so that plugins can attribute cache hits and misses
+# to the route that triggered them
+current_endpoint: ContextVar[str] = ContextVar("current_endpoint", default="unknown")
+
+
+def cache_key(*parts: Union[str, bytes], prefix: str = "openaq") -> str:
+    """
+    builds a key that is stable across processes, unlike the builtin
+    hash() which is salted per interpreter
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else part.encode())
+        h.update(b"\x00")
+    return f"{prefix}:{h.hexdigest()}"
+
+
+def sizeof(obj: Any) -> int:
+    """
+    rough recursive size estimate used to keep the in-process
+    tier inside of its byte budget
+    """
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+        return size
+    if isinstance(obj, dict):
+        return size + sum(sizeof(k) + sizeof(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return size + sum(sizeof(v) for v in obj)
+    if hasattr(obj, "values"):
+        # asyncpg.Record and CachedRecord
+        return size + sum(sizeof(v) for v in obj.values())
+    return size
+
+
+class CachedRecord:
+    """
+    Read only stand in for asyncpg.Record used for values that come
+    back from the shared tier. Supports lookup by column name and by
+    position the same way a Record does.
+    """
+
+    __slots__ = ("_columns", "_values")
+
+    def __init__(self, columns: Dict[str, int], values: tuple):
+        self._columns = columns
+        self._values = values
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, slice)):
+            return self._values[key]
+        return self._values[self._columns[key]]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        items = " ".join(f"{k}={v!r}" for k, v in self.items())
+        return f"<CachedRecord {items}>"
+
+    def get(self, key, default=None):
+        if key in self._columns:
+            return self[key]
+        return default
+
+    def keys(self):
+        return self._columns.keys()
+
+    def values(self):
+        return iter(self._values)
+
+    def items(self):
+        return ((k, self._values[i]) for k, i in self._columns.items())
+
+
+class Stamped(NamedTuple):
+    """cached value together with the (wall clock) time it was stored"""
+
+    stored_at: float
+    value: Any
+
+
+def _pack(value: Any) -> tuple:
+    # lists of records are stored as column names plus plain rows
+    if isinstance(value, list) and len(value) > 0 and hasattr(value[0], "keys"):
+        columns = list(value[0].keys())
+        return ("records", columns, [tuple(r) for r in value])
+    return ("value", value)
+
+
+def _unpack(packed: tuple) -> Any:
+    kind, *rest = packed
+    if kind == "records":
+        columns, rows = rest
+        index = {}
+        for i, column in enumerate(columns):
+            index.setdefault(column, i)
+        return [CachedRecord(index, tuple(row)) for row in rows]
+    return rest[0]
+
+
+# the types json has no equivalent for are stored as single key objects
+# and restored on load, anything else that is not json fails to store
+_encoders = {
+    datetime: ("__datetime__", datetime.isoformat),
+    date: ("__date__", date.isoformat),
+    timedelta: ("__timedelta__", timedelta.total_seconds),
+    Decimal: ("__decimal__", str),
+    bytes: ("__bytes__", lambda b: base64.b64encode(b).decode()),
+}
+_decoders = {
+    "__datetime__": datetime.fromisoformat,
+    "__date__": date.fromisoformat,
+    "__timedelta__": lambda s: timedelta(seconds=s),
+    "__decimal__": Decimal,
+    "__bytes__": base64.b64decode,
+}
+
+
+def _default(obj: Any) -> Dict[str, Any]:
+    encoder = _encoders.get(type(obj))
+    if encoder is None:
+        raise TypeError(f"{type(obj).__name__} cannot be cached")
+    tag, encode = encoder
+    return {tag: encode(obj)}
+
+
+def _restore(obj: Any) -> Any:
+    if isinstance(obj, list):
+        return [_restore(v) for v in obj]
+    if isinstance(obj, dict):
+        if len(obj) == 1:
+            tag, value = next(iter(obj.items()))
+            decode = _decoders.get(tag)
+            if decode is not None:
+                return decode(value)
+        return {k: _restore(v) for k, v in obj.items()}
+    return obj
+
+
+def dumps(value: Any) -> bytes:
+    """
+    json for the shared tier, which unlike pickle can not run code when
+    read back by the api
+    """
+    if isinstance(value, Stamped):
+        packed = ("stamped", value.stored_at, _pack(value.value))
+    else:
+        packed = _pack(value)
+    return orjson.dumps(packed, default=_default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+
+
+def loads(payload: bytes) -> Any:
+    packed = _restore(orjson.loads(payload))
+    if packed[0] == "stamped":
+        return Stamped(packed[1], _unpack(packed[2]))
+    return _unpack(packed)
+
+
+class LRUStore:
+    """
+    In-process LRU store bounded by an (estimated) byte budget
+    with a per entry ttl
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions: Dict[str, int] = {}
+        self._entries: OrderedDict = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, size, endpoint, value = entry
+        if expires is not None and expires <= time.monotonic():
+            self.delete(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: Union[float, None], endpoint: str):
+        size = sizeof(value)
+        self.delete(key)
+        if size > self.max_bytes:
+            logger.debug(f"not caching {key}, {size} bytes is over budget")
+            return False
+        expires = time.monotonic() + ttl if ttl else None
+        self._entries[key] = (expires, size, endpoint, value)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, evicted_size, evicted_endpoint, _) = self._entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions[evicted_endpoint] = self.evictions.get(evicted_endpoint, 0) + 1
+        return True
+
+    def delete(self, key: str) -> int:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return 0
+        self.bytes -= entry[1]
+        return 1
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+
+class TieredCache(BaseCache):
+    """
+    aiocache backend with a bounded in-process LRU in front of an
+    optional shared redis tier. Values that are only found in redis
+    are promoted into the local tier on read.
+
+    :param max_bytes: byte budget for the in-process tier
+    :param redis_host: redis (cluster) host for the shared tier,
+        None to keep everything in process
+    :param redis_port: redis port
+    """
+
+    NAME = "tiered"
+
+    def __init__(
+        self,
+        max_bytes: int = 64 * 1024 * 1024,
+        redis_host: Union[str, None] = None,
+        redis_port: int = 6379,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.serializer = NullSerializer()
+        self.local = LRUStore(max_bytes)
+        self.redis_host = redis_host
+        self.redis_port = redis_port
+        self._redis = None
+        self.endpoint_stats: Dict[str, Dict[str, Union[int, float]]] = {}
+
+    @property
+    def redis(self):
+        # created lazily so that the client is bound to the running loop
+        # and so that processes without redis never import it
+        if self._redis is None and self.redis_host:
+            from redis.asyncio import RedisCluster
+
+            self._redis = RedisCluster(
+                host=self.redis_host,
+                port=self.redis_port,
+                skip_full_coverage_check=True,
+                socket_timeout=1,
+            )
+        return self._redis
+
+    async def _redis_call(self, command: str, *args, **kwargs):
+        if self.redis is None:
+            return None
+        try:
+            return await getattr(self.redis, command)(*args, **kwargs)
+        except Exception as e:
+            logger.warning(f"shared cache {command} failed: {e}")
+            return None
+
+    async def _get(self, key, encoding="utf-8", _conn=None):
+        value = self.local.get(key)
+        if value is not None:
+            return value
+        payload = await self._redis_call("get", key)
+        if payload is None:
+            return None
+        try:
+            value = loads(payload)
+        except ValueError as e:
+            # e.g. written by an older version in another format
+            logger.warning(f"could not read shared cache entry {key}: {e}")
+            return None
+        ttl = await self._redis_call("ttl", key)
+        self.local.set(
+            key, value, ttl if ttl and ttl > 0 else None, current_endpoint.get()
+        )
+        return value
+
+    async def _multi_get(self, keys, encoding="utf-8", _conn=None):
+        return [await self._get(key) for key in keys]
+
+    async def _set(self, key, value, ttl=None, _cas_token=None, _conn=None):
+        self.local.set(key, value, ttl, current_endpoint.get())
+        if self.redis is not None:
+            try:
+                payload = dumps(value)
+            except TypeError as e:
+                # still cached in process
+                logger.warning(f"not sharing {key}: {e}")
+                return True
+            await self._redis_call("set", key, payload, ex=int(ttl) if ttl else None)
+        return True
+
+    async def _multi_set(self, pairs, ttl=None, _conn=None):
+        for key, value in pairs:
+            await self._set(key, value, ttl=ttl)
+        return True
+
+    async def _add(self, key, value, ttl=None, _conn=None):
+        if await self._exists(key):
+            raise ValueError(f"Key {key} already exists, use .set to update the value")
+        return await self._set(key, value, ttl=ttl)
+
+    async def _exists(self, key, _conn=None):
+        if key in self.local:
+            return True
+        return bool(await self._redis_call("exists", key))
+
+    async def _increment(self, key, delta, _conn=None):
+        raise NotImplementedError("increment is not supported by the tiered cache")
+
+    async def _expire(self, key, ttl, _conn=None):
+        value = self.local.get(key)
+        if value is not None:
+            self.local.set(key, value, ttl, current_endpoint.get())
+        await self._redis_call("expire", key, int(ttl))
+        return value is not None
+
+    async def _delete(self, key, _conn=None):
+        deleted = self.local.delete(key)
+        deleted += await self._redis_call("delete", key) or 0
+        return deleted
+
+    async def _clear(self, namespace=None, _conn=None):
+        # only the local tier is cleared, the shared tier
+        # is left to expire on its own
+        self.local.clear()
+        return True
+
+    async def peek(self, key: str):
+        """get without touching the plugins, used while polling"""
+        return await self._get(key)
+
+    async def lock(self, key: str, lease: float) -> Union[str, None]:
+        """
+        tries to take a short lived lock in the shared tier. Returns the
+        lock token when acquired and None when someone else holds it.
+        Without a shared tier the lock is always acquired.
+        """
+        token = uuid.uuid4().hex
+        if self.redis is None:
+            return token
+        acquired = await self._redis_call(
+            "set", f"{key}:lock", token, nx=True, px=int(lease * 1000)
+        )
+        if acquired is None and not await self._redis_call("exists", f"{key}:lock"):
+            # redis is unavailable, behave as if there was no shared tier
+            return token
+        return token if acquired else None
+
+    async def locked(self, key: str) -> bool:
+        return bool(await self._redis_call("exists", f"{key}:lock"))
+
+    async def unlock(self, key: str, token: str):
+        # only delete the lock if it is still ours
+        await self._redis_call(
+            "eval",
+            "if redis.call('get', KEYS[1]) == ARGV[1] then "
+            "return redis.call('del', KEYS[1]) else return 0 end",
+            1,
+            f"{key}:lock",
+            token,
+        )
+
+    async def _close(self, *args, _conn=None, **kwargs):
+        if self._redis is not None:
+            await self._redis.close()
+            self._redis = None
+
+    def stats(self) -> Dict[str, Any]:
+        endpoints = {}
+        for endpoint, stats in self.endpoint_stats.items():
+            endpoints[endpoint] = {
+                **stats,
+                "evictions": self.local.evictions.get(endpoint, 0),
+            }
+        return {
+            "entries": len(self.local),
+            "bytes": self.local.bytes,
+            "max_bytes": self.local.max_bytes,
+            "shared": self.redis_host is not None,
+            "hit_miss_ratio": getattr(self, "hit_miss_ratio", {}),
+            "endpoints": endpoints,
+        }
+
+
+class EndpointHitMissRatioPlugin(HitMissRatioPlugin):
+    """
+    HitMissRatioPlugin that also keeps the totals per endpoint
+    in ``client.endpoint_stats``
+    """
+
+    async def post_get(self, client, key, took=0, ret=None, **kwargs):
+        await super().post_get(client, key, took=took, ret=ret)
+        if not hasattr(client, "endpoint_stats"):
+            client.endpoint_stats = {}
+        stats = client.endpoint_stats.setdefault(
+            current_endpoint.get(), {"total": 0, "hits": 0}
+        )
+        stats["total"] += 1
+        if ret is not None:
+            stats["hits"] += 1
+        stats["hit_ratio"] = stats["hits"] / stats["total"]
+
+    async def post_multi_get(self, client, keys, took=0, ret=None, **kwargs):
+        for key, value in zip(keys, ret or []):
+            await self.post_get(client, key, took=took, ret=value)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into one call whose
+    result is shared by every waiter.
+
+    With a ``shared`` cache the leader also takes a short lock in the
+    shared tier so that other processes wait for its result to show up
+    in the cache instead of running the same query.
+
+    :param shared: cache with a shared tier to coordinate through
+    :param lease: seconds a shared lock is held for at most
+    :param poll: seconds between cache checks while waiting on another process
+    """
+
+    def __init__(
+        self,
+        shared: Union[TieredCache, None] = None,
+        lease: float = 6,
+        poll: float = 0.05,
+    ):
+        self.shared = shared
+        self.lease = lease
+        self.poll = poll
+        self.coalesced: Dict[str, int] = {}
+        self.coalesced_shared: Dict[str, int] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def __len__(self):
+        return len(self._inflight)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        endpoint = current_endpoint.get()
+        task = self._inflight.get(key)
+        if task is None:
+            # run in its own task so that a cancelled leader
+            # (e.g. client disconnect) does not fail the waiters
+            task = asyncio.ensure_future(self._lead(key, fn))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.coalesced[endpoint] = self.coalesced.get(endpoint, 0) + 1
+        return await asyncio.shield(task)
+
+    def _done(self, key: str, task: asyncio.Future):
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            # mark the exception as retrieved when nobody is left waiting
+            task.exception()
+
+    async def _lead(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        if self.shared is None:
+            return await fn()
+        token = await self.shared.lock(key, self.lease)
+        if token is None:
+            value = await self._wait(key)
+            if value is not None:
+                endpoint = current_endpoint.get()
+                self.coalesced_shared[endpoint] = (
+                    self.coalesced_shared.get(endpoint, 0) + 1
+                )
+                return value
+            token = await self.shared.lock(key, self.lease)
+        try:
+            # the lock is left to expire on success so that other processes
+            # keep waiting until the result has been written to the cache
+            return await fn()
+        except BaseException:
+            if token is not None:
+                await self.shared.unlock(key, token)
+            raise
+
+    async def _wait(self, key: str) -> Any:
+        since = time.time()
+        deadline = time.monotonic() + self.lease
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.poll)
+            value = self._fresh(await self.shared.peek(key), since)
+            if value is not None:
+                return value
+            if not await self.shared.locked(key):
+                return self._fresh(await self.shared.peek(key), since)
+        return None
+
+    @staticmethod
+    def _fresh(value: Any, since: float) -> Any:
+        # a stale entry that is being revalidated is not the result
+        # we are waiting for
+        if isinstance(value, Stamped):
+            return value.value if value.stored_at >= since else None
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "inflight": len(self._inflight),
+            "coalesced": dict(self.coalesced),
+            "coalesced_shared": dict(self.coalesced_shared),
+        }
+
+
+class cached_swr(cached):
+    """
+    ``cached`` with stale-while-revalidate semantics. Values are stored
+    with the time they were written and kept for the hard ttl. Once a
+    value is older than the soft ttl it is still returned right away but
+    a background task refreshes it, so callers only block on a miss or
+    after the hard ttl.
+
+    :param ttls: callable that receives the current endpoint and returns
+        the (soft, hard) ttls in seconds for it
+    """
+
+    def __init__(self, ttls: Callable[[str], Tuple[float, float]], **kwargs):
+        super().__init__(**kwargs)
+        self.ttls = ttls
+        self.stale: Dict[str, int] = {}
+        self.refreshes: Dict[str, int] = {}
+        self.refresh_errors: Dict[str, int] = {}
+        self._refreshing: Dict[str, asyncio.Future] = {}
+
+    def __call__(self, f):
+        wrapper = super().__call__(f)
+        wrapper.swr = self
+        return wrapper
+
+    async def decorator(
+        self,
+        f,
+        *args,
+        cache_read=True,
+        cache_write=True,
+        aiocache_wait_for_write=True,
+        **kwargs,
+    ):
+        key = self.get_cache_key(f, args, kwargs)
+        endpoint = current_endpoint.get()
+        soft, hard = self.ttls(endpoint)
+
+        if cache_read:
+            entry = await self.get_from_cache(key)
+            if entry is not None:
+                if not isinstance(entry, Stamped):
+                    return entry
+                if time.time() - entry.stored_at > soft:
+                    self.stale[endpoint] = self.stale.get(endpoint, 0) + 1
+                    self.revalidate(key, f, args, kwargs, hard)
+                return entry.value
+
+        result = await f(*args, **kwargs)
+
+        if cache_write:
+            if aiocache_wait_for_write:
+                await self.set_in_cache(key, result, hard)
+            else:
+                asyncio.ensure_future(self.set_in_cache(key, result, hard))
+
+        return result
+
+    def revalidate(self, key: str, f, args, kwargs, ttl: float):
+        """starts a background refresh unless one is already running"""
+        if key in self._refreshing:
+            return
+        task = asyncio.ensure_future(self._refresh(key, f, args, kwargs, ttl))
+        self._refreshing[key] = task
+        task.add_done_callback(lambda _: self._refreshing.pop(key, None))
+
+    async def _refresh(self, key: str, f, args, kwargs, ttl: float):
+        endpoint = current_endpoint.get()
+        try:
+            result = await f(*args, **kwargs)
+        except Exception as e:
+            # keep serving the stale value until the hard ttl
+            logger.warning(f"refreshing {key} for {endpoint} failed: {e}")
+            self.refresh_errors[endpoint] = self.refresh_errors.get(endpoint, 0) + 1
+            return
+        self.refreshes[endpoint] = self.refreshes.get(endpoint, 0) + 1
+        await self.set_in_cache(key, result, ttl)
+
+    async def set_in_cache(self, key, value, ttl=None):
+        try:
+            await self.cache.set(
+                key, Stamped(time.time(), value), ttl=ttl or self.ttl
+            )
+        except Exception:
+            logger.exception(f"Couldn't set {key}, unexpected error")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "refreshing": len(self._refreshing),
+            "stale": dict(self.stale),
+            "refreshes": dict(self.refreshes),
+            "refresh_errors": dict(self.refresh_errors),
+        }
@@ -0,0 +1,71 @@
+"""
+Ways of filling in Meta.found for a page of results.
+
+exact
+    ``COUNT(1) OVER()`` in the page query, which makes postgres build the
+    whole result before it can return the first page
+estimate
+    the planner row estimate from ``EXPLAIN``, reported as
+    ``">{API_COUNT_ESTIMATE_THRESHOLD}"`` when it is above the threshold
+    and counted exactly otherwise
+cached
+    an exact count of the filtered rows, cached on the filters with a
+    long ttl
+
+The mode is picked per endpoint with ``API_COUNT_MODES``.
+"""
+import re
+from enum import Enum
+from typing import Optional
+
+import orjson
+
+from openaq_fastapi.settings import settings
+
+
+class CountMode(str, Enum):
+    exact = "exact"
+    estimate = "estimate"
+    cached = "cached"
+
+
+_total = re.compile(r"\s*,\s*COUNT\(1\)\s+OVER\s*\(\)\s+AS\s+found\b", re.I)
+_pagination = re.compile(r"(?:\s+(?:LIMIT\s+:limit|OFFSET\s+:offset))+\s*;?\s*$", re.I)
+# only a trailing order by with nothing that could nest a subquery
+_order = re.compile(r"\s+ORDER\s+BY\s+[^()]*$", re.I)
+
+
+def count_mode(endpoint: str) -> CountMode:
+    return CountMode(settings.API_COUNT_MODES.get(endpoint, CountMode.exact))
+
+
+def without_total(sql: str) -> Optional[str]:
+    """
+    the page query without its window count, None when it does not
+    have exactly one or is not paginated with :limit and :offset
+    """
+    stripped, n = _total.subn("", sql)
+    if n != 1 or not _pagination.search(stripped):
+        return None
+    return stripped
+
+
+def unpaged(sql: str) -> str:
+    """the rows the page is taken from, without paging or ordering"""
+    sql = _pagination.sub("", sql)
+    return _order.sub("", sql)
+
+
+def count_sql(sql: str) -> str:
+    return f"SELECT COUNT(1) AS found FROM ({unpaged(sql)}) AS counted"
+
+
+def estimate_sql(sql: str) -> str:
+    return f"EXPLAIN (FORMAT JSON) {unpaged(sql)}"
+
+
+def plan_rows(plan) -> int:
+    """the row estimate from the output of EXPLAIN (FORMAT JSON)"""
+    if isinstance(plan, str):
+        plan = orjson.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
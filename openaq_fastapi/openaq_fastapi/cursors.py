@@ -0,0 +1,42 @@
+"""
+Opaque continuation tokens for keyset pagination. A token carries the
+(datetime, sensors_id) key of the last row of a page, the next page
+starts right after it instead of scanning past an offset.
+"""
+import base64
+import binascii
+from datetime import datetime
+from typing import Tuple
+
+import orjson
+
+
+def encode_cursor(dt: datetime, sensors_id: int) -> str:
+    raw = orjson.dumps([dt.isoformat(), sensors_id])
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(token: str) -> Tuple[datetime, int]:
+    """raises ValueError for anything that is not a cursor we issued"""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        dt, sensors_id = orjson.loads(raw)
+        dt = datetime.fromisoformat(dt)
+    except (binascii.Error, orjson.JSONDecodeError, TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(sensors_id, int) or dt.tzinfo is None:
+        raise ValueError("Invalid cursor")
+    return dt, sensors_id
+
+
+def next_cursor(last, count: int, limit: int):
+    """
+    the cursor for the page after one of count rows ending with last,
+    None on the last page or when the query does not select the
+    cursor_datetime/cursor_sensors_id keys
+    """
+    if count == 0 or count < limit:
+        return None
+    if "cursor_datetime" not in last.keys():
+        return None
+    return encode_cursor(last["cursor_datetime"], last["cursor_sensors_id"])
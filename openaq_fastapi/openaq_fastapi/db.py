@@ -1,19 +1,38 @@
+import asyncio
 import logging
 import time
 import os
+from typing import Tuple, Union
 
 import asyncpg
 from .models.auth import User
 import orjson
-from aiocache import SimpleMemoryCache, cached
-from aiocache.plugins import HitMissRatioPlugin, TimingPlugin
+from aiocache.plugins import TimingPlugin
 from buildpg import render
 from fastapi import HTTPException, Request
 from asyncio.exceptions import TimeoutError
 
+from openaq_fastapi.cache import (
+    EndpointHitMissRatioPlugin,
+    SingleFlight,
+    TieredCache,
+    cache_key,
+    cached_swr,
+    current_endpoint,
+)
+from openaq_fastapi.counts import (
+    CountMode,
+    count_mode,
+    count_sql,
+    estimate_sql,
+    plan_rows,
+    without_total,
+)
+from openaq_fastapi.cursors import next_cursor
 from openaq_fastapi.settings import settings
+from openaq_fastapi.statements import StatementConnection, registry
 
-from .models.responses import Meta, OpenAQResult
+from .models.responses import CursorMeta, Meta, OpenAQResult
 
 logger = logging.getLogger("db")
 
@@ -22,22 +41,50 @@ def default(obj):
     return str(obj)
 
 
-def dbkey(m, f, query, args):
+def dbkey(m, f, rquery, rargs):
+    # keyed on the already rendered query and its positional args
     j = orjson.dumps(
-        args, option=orjson.OPT_OMIT_MICROSECONDS, default=default
-    ).decode()
-    dbkey = f"{query}{j}"
-    h = hash(dbkey)
-    # logger.debug(f"dbkey: {dbkey} h: {h}")
+        rargs, option=orjson.OPT_OMIT_MICROSECONDS, default=default
+    )
+    h = cache_key(rquery, j, prefix="openaq:db")
+    # logger.debug(f"dbkey: {rquery}{j} h: {h}")
     return h
 
 
+def endpoint_path(request: Request) -> str:
+    """
+    returns the path template of the route that is handling the request
+    e.g. /v3/locations/{locations_id} so that stats and settings can be
+    grouped by endpoint instead of by url
+    """
+    endpoint = request.scope.get("endpoint")
+    path = request.scope.get("path", "")
+    for route in request.app.routes:
+        if getattr(route, "endpoint", None) is endpoint and route.path_regex.match(
+            path
+        ):
+            return route.path
+    return path
+
+
+def cache_ttls(endpoint: str) -> Tuple[int, int]:
+    """(soft, hard) ttls for the query cache of an endpoint"""
+    ttls = settings.API_CACHE_ENDPOINT_TIMEOUTS.get(endpoint)
+    if ttls is None:
+        return settings.API_CACHE_TIMEOUT, settings.API_CACHE_HARD_TIMEOUT
+    return ttls
+
+
 cache_config = {
+    "ttls": cache_ttls,
     "key_builder": dbkey,
-    "cache": SimpleMemoryCache,
+    "cache": TieredCache,
     "noself": True,
+    "max_bytes": settings.API_CACHE_MAX_BYTES,
+    "redis_host": settings.REDIS_HOST if settings.API_CACHE_USE_REDIS else None,
+    "redis_port": settings.REDIS_PORT,
     "plugins": [
-        HitMissRatioPlugin(),
+        EndpointHitMissRatioPlugin(),
         TimingPlugin(),
     ],
 }
@@ -53,21 +100,160 @@ async def db_pool(pool):
         await con.set_type_codec(
             "json", encoder=orjson.dumps, decoder=orjson.loads, schema="pg_catalog"
         )
+        # connections replacing ones that went idle start
+        # with the hottest query shapes already prepared
+        shapes = registry.top(settings.DATABASE_POOL_PREPARE_SHAPES)
+        try:
+            await con.prepare_shapes([shape["sql"] for shape in shapes])
+        except Exception as e:
+            logger.warning(f"Could not prepare query shapes: {e}")
 
     logger.debug(f"Checking for existing pool: {pool}")
     if pool is None:
         logger.debug("Creating a new pool")
+        StatementConnection.max_prepared = settings.API_STATEMENT_CACHE_SIZE
         pool = await asyncpg.create_pool(
             settings.DATABASE_READ_URL,
-            command_timeout=6,
-            max_inactive_connection_lifetime=15,
-            min_size=1,
-            max_size=10,
+            connection_class=StatementConnection,
+            command_timeout=settings.DATABASE_COMMAND_TIMEOUT,
+            max_inactive_connection_lifetime=settings.DATABASE_POOL_MAX_INACTIVE_LIFETIME,
+            min_size=settings.DATABASE_POOL_MIN_SIZE,
+            max_size=settings.DATABASE_POOL_MAX_SIZE,
             init=init,
         )
+        await warm_pool(pool, settings.DATABASE_POOL_WARM_SIZE)
     return pool
 
 
+async def db_write_pool(pool):
+    """
+    small pool on the write database for the auth flows, only
+    created the first time a user registers or verifies
+    """
+    if pool is None:
+        logger.debug("Creating a new write pool")
+        pool = await asyncpg.create_pool(
+            settings.DATABASE_WRITE_URL,
+            command_timeout=settings.DATABASE_WRITE_COMMAND_TIMEOUT,
+            max_inactive_connection_lifetime=settings.DATABASE_WRITE_POOL_MAX_INACTIVE_LIFETIME,
+            min_size=settings.DATABASE_WRITE_POOL_MIN_SIZE,
+            max_size=settings.DATABASE_WRITE_POOL_MAX_SIZE,
+        )
+    return pool
+
+
+async def ping(pool, size: int) -> int:
+    """
+    checks out up to size connections at once, opening new ones as
+    needed, and runs a cheap query on each. Returns how many are healthy.
+    """
+
+    async def check():
+        async with pool.acquire() as con:
+            return await con.fetchval("SELECT 1")
+
+    results = await asyncio.gather(
+        *[check() for _ in range(size)], return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            logger.warning(f"Connection health check failed: {result}")
+    return sum(1 for result in results if result == 1)
+
+
+async def warm_pool(pool, size: int):
+    """
+    opens size connections on startup so the first burst of requests
+    does not pay for connecting, registering codecs and preparing
+    """
+    size = min(size, pool.get_max_size())
+    if size <= 0:
+        return
+    start = time.time()
+    healthy = await ping(pool, size)
+    logger.debug(
+        f"Warmed {healthy}/{size} connections in {time.time() - start:.3f}s"
+    )
+
+
+def start_keepalive(pool) -> Union[asyncio.Future, None]:
+    """
+    runs keepalive on the pool in the background, the caller keeps the
+    task and cancels it before closing the pool
+    """
+    if settings.DATABASE_POOL_KEEPALIVE <= 0:
+        return None
+    return asyncio.ensure_future(
+        keepalive(
+            pool,
+            settings.DATABASE_POOL_WARM_SIZE,
+            settings.DATABASE_POOL_KEEPALIVE,
+        )
+    )
+
+
+async def keepalive(pool, size: int, interval: float):
+    """
+    touches idle connections before they reach the inactive lifetime so
+    that the pool does not collapse between bursts of traffic
+    """
+    while not pool.is_closing():
+        await asyncio.sleep(interval)
+        if pool.is_closing():
+            break
+        idle = min(size, pool.get_idle_size())
+        if idle > 0:
+            try:
+                await ping(pool, idle)
+            except asyncpg.exceptions.InterfaceError:
+                # the pool was closed while we were checking
+                break
+
+
+def page_meta(kwargs, first, last, count: int, found=None) -> Meta:
+    """
+    meta for a page of count rows, found comes from a found column
+    when the query has one and it is not passed in
+    """
+    limit = kwargs.get("limit")
+    if found is not None:
+        kwargs["found"] = found
+    elif count > 0:
+        if "found" in first.keys():
+            kwargs["found"] = first["found"]
+        elif count == limit:
+            kwargs["found"] = f">{limit}"
+        else:
+            kwargs["found"] = count
+    else:
+        kwargs["found"] = 0
+    if "cursor" in kwargs:
+        # only queries that take a cursor have one in their meta
+        kwargs["cursor"] = next_cursor(last, count, limit)
+        return CursorMeta.parse_obj(kwargs)
+    return Meta.parse_obj(kwargs)
+
+
+def count_ttls(endpoint: str) -> Tuple[int, int]:
+    # counts are refreshed in the background after half their ttl
+    return settings.API_COUNT_CACHE_TIMEOUT // 2, settings.API_COUNT_CACHE_TIMEOUT
+
+
+def cache_stats() -> dict:
+    """
+    hit/miss/eviction stats for the query cache, the number of
+    coalesced queries and stale reads, grouped by endpoint, and the
+    prepared statement hit ratio per query shape
+    """
+    return {
+        **DB._fetch.cache.stats(),
+        **singleflight.stats(),
+        **DB._fetch.swr.stats(),
+        "counts": DB._count.cache.stats(),
+        "statements": registry.stats(),
+    }
+
+
 class DB:
     def __init__(self, request: Request):
         self.request = request
@@ -83,20 +269,48 @@ class DB:
         )
         return self.request.app.state.pool
 
-    @cached(settings.API_CACHE_TIMEOUT, **cache_config)
+    async def write_pool(self):
+        state = self.request.app.state
+        # concurrent signups share the one pool being created
+        if getattr(state, "write_pool", None) is None:
+            state.write_pool = asyncio.ensure_future(db_write_pool(None))
+        try:
+            return await state.write_pool
+        except Exception:
+            state.write_pool = None
+            raise
+
+    @property
+    def endpoint(self) -> str:
+        return endpoint_path(self.request)
+
     async def fetch(self, query, kwargs):
+        token = current_endpoint.set(self.endpoint)
+        try:
+            # rendered once, for the cache key and the query itself
+            rquery, args = render(query, **kwargs)
+            return await self._fetch(rquery, args)
+        finally:
+            current_endpoint.reset(token)
+
+    @cached_swr(ttl=settings.API_CACHE_HARD_TIMEOUT, **cache_config)
+    async def _fetch(self, rquery, args):
+        # concurrent misses for the same query share one database call
+        key = dbkey(None, self, rquery, args)
+        return await singleflight.do(key, lambda: self._query(rquery, args))
+
+    async def _query(self, rquery, args):
         pool = await self.pool()
         start = time.time()
-        logger.debug("Start time: %s\nQuery: %s \nArgs:%s\n", start, query, kwargs)
-        rquery, args = render(query, **kwargs)
+        logger.debug("Start time: %s\nQuery: %s \nArgs:%s\n", start, rquery, args)
         async with pool.acquire() as con:
             try:
-                r = await con.fetch(rquery, *args)
+                r = await con.fetch_prepared(rquery, *args)
             except asyncpg.exceptions.UndefinedColumnError as e:
-                logger.error(f"Undefined Column Error: {e}\n{rquery}\n{kwargs}")
+                logger.error(f"Undefined Column Error: {e}\n{rquery}\n{args}")
                 raise ValueError(f"{e}") from e
             except asyncpg.exceptions.DataError as e:
-                logger.error(f"Data Error: {e}\n{rquery}\n{kwargs}")
+                logger.error(f"Data Error: {e}\n{rquery}\n{args}")
                 raise ValueError(f"{e}") from e
             except asyncpg.exceptions.CharacterNotInRepertoireError as e:
                 raise ValueError(f"{e}") from e
@@ -106,7 +320,7 @@ class DB:
                     detail="Connection timed out",
                 )
             except Exception as e:
-                logger.error(f"Unknown database error: {e}\n{rquery}\n{kwargs}")
+                logger.error(f"Unknown database error: {e}\n{rquery}\n{args}")
                 if str(e).startswith("ST_TileEnvelope"):
                     raise HTTPException(status_code=422, detail=f"{e}")
                 raise HTTPException(status_code=500, detail=f"{e}")
@@ -118,6 +332,30 @@ class DB:
         )
         return r
 
+    async def iterate(self, query, kwargs):
+        """
+        yields rows from a server side cursor as they come off the
+        database, only DATABASE_CURSOR_PREFETCH rows are held at a time.
+        Nothing is cached and the connection is held until the caller
+        is done, so it is meant for exports rather than pages
+        """
+        if "limit" in kwargs.keys():
+            page = kwargs.get("page", 1)
+            kwargs["offset"] = abs((page - 1) * kwargs["limit"])
+        pool = await self.pool()
+        start = time.time()
+        rquery, args = render(query, **kwargs)
+        rows = 0
+        async with pool.acquire() as con:
+            # cursors only live inside a transaction
+            async with con.transaction(readonly=True):
+                async for row in con.cursor(
+                    rquery, *args, prefetch=settings.DATABASE_CURSOR_PREFETCH
+                ):
+                    rows += 1
+                    yield row
+        logger.debug("cursor took: %s and returned:%s", time.time() - start, rows)
+
     async def fetchrow(self, query, kwargs):
         r = await self.fetch(query, kwargs)
         if len(r) > 0:
@@ -136,20 +374,55 @@ class DB:
             limit = kwargs.get("limit")
             kwargs["offset"] = abs((page - 1) * limit)
 
-        data = await self.fetch(query, kwargs)
-        if len(data) > 0:
-            if "found" in data[0].keys():
-                kwargs["found"] = data[0]["found"]
-            elif len(data) == limit:
-                kwargs["found"] = f">{limit}"
-            else:
-                kwargs["found"] = len(data)
+        mode = count_mode(self.endpoint)
+        page_query = None
+        if mode != CountMode.exact and "limit" in kwargs.keys():
+            page_query = without_total(query)
+        if page_query is None:
+            data = await self.fetch(query, kwargs)
+            found = None
         else:
-            kwargs["found"] = 0
-
-        output = OpenAQResult(meta=Meta.parse_obj(kwargs), results=data)
+            data = await self.fetch(page_query, kwargs)
+            found = await self.count(page_query, kwargs, mode, len(data))
+        meta = page_meta(
+            kwargs,
+            data[0] if data else None,
+            data[-1] if data else None,
+            len(data),
+            found,
+        )
+        output = OpenAQResult(meta=meta, results=data)
         return output
 
+    async def count(self, query, kwargs, mode: CountMode, rows: int):
+        """found for a page of rows from query, without the window count"""
+        offset = kwargs.get("offset", 0)
+        if rows < kwargs["limit"] and (rows > 0 or offset == 0):
+            # the last page, everything before it was full
+            return offset + rows
+        if mode == CountMode.estimate:
+            threshold = settings.API_COUNT_ESTIMATE_THRESHOLD
+            plan = await self.fetchrow(estimate_sql(query), kwargs)
+            if plan_rows(plan[0]) > threshold:
+                return f">{threshold}"
+            # small enough that counting is cheap
+            row = await self.fetchrow(count_sql(query), kwargs)
+            return row[0]
+        token = current_endpoint.set(self.endpoint)
+        try:
+            counted = await self._count(*render(count_sql(query), **kwargs))
+        finally:
+            current_endpoint.reset(token)
+        return counted[0][0]
+
+    @cached_swr(
+        ttl=settings.API_COUNT_CACHE_TIMEOUT, **{**cache_config, "ttls": count_ttls}
+    )
+    async def _count(self, rquery, args):
+        # keyed on the rendered count query, which only has the filters
+        key = dbkey(None, self, rquery, args)
+        return await singleflight.do(key, lambda: self._query(rquery, args))
+
     async def create_user(self, user: User) -> str:
         """
         calls the create_user plpgsql function to create a new user and entity records
@@ -157,10 +430,9 @@ class DB:
         query = """
         SELECT * FROM create_user(:full_name, :email_address, :password_hash, :ip_address, :entity_type)
         """
-        conn = await asyncpg.connect(settings.DATABASE_WRITE_URL)
+        pool = await self.write_pool()
         rquery, args = render(query, **user.dict())
-        verification_token = await conn.fetch(rquery, *args)
-        await conn.close()
+        verification_token = await pool.fetch(rquery, *args)
         return verification_token[0][0]
 
     async def get_user_token(self, users_id: int) -> str:
@@ -170,10 +442,9 @@ class DB:
         query = """
         SELECT * FROM get_user_token(:users_id)
         """
-        conn = await asyncpg.connect(settings.DATABASE_WRITE_URL)
+        pool = await self.write_pool()
         rquery, args = render(query, **{"users_id": users_id})
-        api_token = await conn.fetch(rquery, *args)
-        await conn.close()
+        api_token = await pool.fetch(rquery, *args)
         return api_token[0][0]
 
     async def fetchOpenAQResult(self, query, kwargs):
@@ -201,3 +472,9 @@ class DB:
         )
         output = OpenAQResult(meta=meta, results=results)
         return output
+
+
+singleflight = SingleFlight(
+    shared=DB._fetch.cache if settings.API_CACHE_SHARED_LOCK else None,
+    lease=settings.API_CACHE_LOCK_LEASE,
+)
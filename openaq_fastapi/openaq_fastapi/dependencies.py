@@ -0,0 +1,136 @@
+import functools
+import inspect
+import logging
+from typing import Any, Callable, Dict, List, Tuple
+
+from fastapi import Query, Request
+from fastapi.exceptions import HTTPException, RequestValidationError
+from pydantic import BaseConfig, BaseModel, ValidationError
+from pydantic.error_wrappers import ErrorWrapper
+from pydantic.fields import SHAPE_SINGLETON, ModelField
+from pydantic.schema import (
+    field_schema,
+    get_flat_models_from_field,
+    get_model_name_map,
+)
+
+logger = logging.getLogger("dependencies")
+
+
+class RawValue:
+    """
+    Parameter type that passes the raw query value through untouched so
+    that the query model is the only place a request gets validated.
+    Subclasses carry the json schema of the model field they stand in
+    for so the docs still show the real type.
+    """
+
+    schema: Dict[str, Any] = {}
+
+    @classmethod
+    def __get_validators__(cls):
+        yield cls.validate
+
+    @classmethod
+    def validate(cls, v):
+        return v
+
+    @classmethod
+    def __modify_schema__(cls, field_schema: Dict[str, Any]):
+        field_schema.update(cls.schema)
+
+
+def _resolve(node: Any, definitions: Dict[str, Any]) -> Any:
+    """inlines $refs to model definitions (e.g. enums)"""
+    if isinstance(node, dict):
+        if "$ref" in node:
+            ref = definitions[node["$ref"].split("/")[-1]]
+            node = {**ref, **{k: v for k, v in node.items() if k != "$ref"}}
+        return {k: _resolve(v, definitions) for k, v in node.items()}
+    if isinstance(node, list):
+        return [_resolve(v, definitions) for v in node]
+    return node
+
+
+def _schema(field: ModelField) -> Dict[str, Any]:
+    # only the type is documented, defaults and descriptions
+    # are set on the parameter itself
+    field = ModelField(
+        name=field.name,
+        type_=field.outer_type_,
+        class_validators=None,
+        model_config=BaseConfig,
+    )
+    models = get_flat_models_from_field(field, known_models=set())
+    schema, definitions, _ = field_schema(
+        field, model_name_map=get_model_name_map(models)
+    )
+    return _resolve(schema, definitions)
+
+
+def _param_type(field: ModelField) -> type:
+    schema = _schema(field)
+    schema.pop("title", None)
+    schema.pop("description", None)
+    if field.shape != SHAPE_SINGLETON:
+        # sequences have to stay sequences so fastapi reads every
+        # occurrence of the parameter
+        schema = schema.get("items", {})
+        return List[type(field.name, (RawValue,), {"schema": schema})]
+    return type(field.name, (RawValue,), {"schema": schema})
+
+
+def _relocate(errors: List[Dict[str, Any]], path_params: Dict[str, Any]):
+    for error in errors:
+        loc = tuple(error["loc"])
+        if len(loc) > 1 and loc[0] == "query" and loc[1] in path_params:
+            error["loc"] = ("path",) + loc[1:]
+    return errors
+
+
+@functools.lru_cache(maxsize=None)
+def dependency_from_model(
+    name: str, model_cls: BaseModel, ignore: Tuple[str, ...] = ()
+) -> Callable:
+    """
+    Builds (once per model class) a dependency with a query parameter for
+    each field of the model. The parameters are not validated by fastapi,
+    the model validates the request once when it is created.
+
+    Arguments:
+        name: Name for the dependency function.
+        model_cls: A ``BaseModel`` inheriting model class as input.
+        ignore: field names to leave out of the parameters.
+    """
+    parameters = [
+        inspect.Parameter(
+            "request", inspect.Parameter.POSITIONAL_OR_KEYWORD, annotation=Request
+        )
+    ]
+    for field in model_cls.__fields__.values():
+        if field.name in ignore or field.name == "self":
+            continue
+        parameters.append(
+            inspect.Parameter(
+                field.name,
+                inspect.Parameter.KEYWORD_ONLY,
+                default=Query(field.default, description=field.field_info.description),
+                annotation=_param_type(field),
+            )
+        )
+
+    async def dependency(request: Request, **params):
+        try:
+            return model_cls(**params)
+        except ValidationError as e:
+            # models without their own error handling (v2) report errors
+            # the same way fastapi reports invalid parameters
+            raise RequestValidationError([ErrorWrapper(e, ("query",))])
+        except HTTPException as e:
+            if e.status_code == 422 and isinstance(e.detail, list):
+                _relocate(e.detail, request.path_params)
+            raise
+
+    dependency.__name__ = dependency.__qualname__ = name
+    dependency.__signature__ = inspect.Signature(parameters)
+    return dependency
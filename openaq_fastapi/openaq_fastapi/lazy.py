@@ -0,0 +1,108 @@
+import importlib
+import logging
+import time
+from typing import Dict, List, Sequence, Tuple
+
+from fastapi import FastAPI
+from starlette.routing import BaseRoute, Mount, compile_path
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+logger = logging.getLogger("lazy")
+
+
+class LazyRouters:
+    """
+    Router modules that are only imported, along with their dependencies,
+    the first time a request matches one of their declared paths.
+
+    The paths are declared up front as route templates so that routing
+    ends up exactly as if every router had been included eagerly, in the
+    order they are declared and ahead of any catch all mount.
+
+    :param app: the app to include the routers in
+    :param routers: (module, route paths) pairs, each module exposing a
+        ``router`` attribute
+    """
+
+    def __init__(self, app: FastAPI, routers: Sequence[Tuple[str, Sequence[str]]]):
+        self.app = app
+        self.modules = [module for module, _ in routers]
+        self.paths = {module: list(paths) for module, paths in routers}
+        self.regexes = {
+            module: [compile_path(path)[0] for path in paths] for module, paths in routers
+        }
+        self.pending = set(self.modules)
+        self.loaded: Dict[str, List[BaseRoute]] = {}
+        self.load_times: Dict[str, float] = {}
+
+    def match(self, path: str) -> List[str]:
+        """pending modules with a route matching path"""
+        return [
+            module
+            for module in self.modules
+            if module in self.pending
+            and any(regex.match(path) for regex in self.regexes[module])
+        ]
+
+    def load(self, module: str):
+        if module not in self.pending:
+            return
+        start = time.perf_counter()
+        router = importlib.import_module(module).router
+        self.pending.discard(module)
+        self.loaded[module] = list(router.routes)
+        self.load_times[module] = time.perf_counter() - start
+        logger.debug(f"loaded {module} in {self.load_times[module]:.3f}s")
+        self._rebuild()
+
+    def load_for(self, path: str):
+        for module in self.match(path):
+            self.load(module)
+
+    def load_all(self):
+        for module in self.modules:
+            self.load(module)
+
+    def _rebuild(self):
+        routes = self.app.router.routes
+        lazy = {id(route) for routes in self.loaded.values() for route in routes}
+        eager = [route for route in routes if id(route) not in lazy]
+        # keep catch all mounts (e.g. the static site at /) last
+        mounts = [r for r in eager if isinstance(r, Mount) and r.path == ""]
+        eager = [r for r in eager if r not in mounts]
+        ordered = [
+            route
+            for module in self.modules
+            if module in self.loaded
+            for route in self.loaded[module]
+        ]
+        routes[:] = eager + ordered + mounts
+        # any cached schema would be missing the new routes
+        self.app.openapi_schema = None
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "pending": sorted(self.pending),
+            "load_times": dict(self.load_times),
+        }
+
+
+class LazyRouterMiddleware:
+    """
+    imports the routers a request needs before it is routed, every
+    router is loaded before the openapi schema or docs are built
+    """
+
+    def __init__(self, app: ASGIApp, routers: LazyRouters, load_all: Sequence[str] = ()):
+        self.app = app
+        self.routers = routers
+        self.load_all = set(load_all)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] in ("http", "websocket") and self.routers.pending:
+            path = scope["path"]
+            if path in self.load_all:
+                self.routers.load_all()
+            else:
+                self.routers.load_for(path)
+        await self.app(scope, receive, send)
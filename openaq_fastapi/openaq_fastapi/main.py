@@ -1,3 +1,4 @@
+import asyncio
 import datetime
 import logging
 import traceback
@@ -16,7 +17,8 @@ from mangum import Mangum
 from pydantic import BaseModel, ValidationError
 from starlette.responses import JSONResponse, RedirectResponse
 
-from openaq_fastapi.db import db_pool
+from openaq_fastapi.cache import EndpointHitMissRatioPlugin, TieredCache
+from openaq_fastapi.db import cache_stats, db_pool, start_keepalive
 
 from openaq_fastapi.models.logging import (
     InfrastructureErrorLog,
@@ -29,34 +31,12 @@ from openaq_fastapi.middleware import (
     CacheControlMiddleware,
     LoggingMiddleware,
     RateLimiterMiddleWare,
+    ResponseCacheMiddleware,
 )
-from openaq_fastapi.routers.averages import router as averages_router
-from openaq_fastapi.routers.cities import router as cities_router
-from openaq_fastapi.routers.countries import router as countries_router
-from openaq_fastapi.routers.locations import router as locations_router
-from openaq_fastapi.routers.manufacturers import router as manufacturers_router
-from openaq_fastapi.routers.measurements import router as measurements_router
-from openaq_fastapi.routers.mvt import router as mvt_router
-from openaq_fastapi.routers.parameters import router as parameters_router
-from openaq_fastapi.routers.projects import router as projects_router
-from openaq_fastapi.routers.sources import router as sources_router
-from openaq_fastapi.routers.summary import router as summary_router
-from openaq_fastapi.routers.auth import router as auth_router
-
-# V3 routers
-from openaq_fastapi.v3.routers import (
-    locations,
-    measurements,
-    trends,
-    parameters,
-    countries,
-    tiles,
-    providers,
-    sensors,
-)
-
-
+from openaq_fastapi.lazy import LazyRouterMiddleware, LazyRouters
 from openaq_fastapi.settings import settings
+from openaq_fastapi.snapshots import snapshots
+from openaq_fastapi.tilecache import tile_cache
 from os import environ
 
 
@@ -112,10 +92,11 @@ redis_client = None  # initialize for generalize_schema.py
 
 if settings.RATE_LIMITING:
     logger.debug("Connecting to redis")
-    import redis
+    from redis.asyncio import RedisCluster
 
     try:
-        redis_client = redis.RedisCluster(
+        # asyncio client, it connects on the first command
+        redis_client = RedisCluster(
             host=settings.REDIS_HOST,
             port=settings.REDIS_PORT,
             decode_responses=True,
@@ -128,6 +109,129 @@ if settings.RATE_LIMITING:
     logger.debug("Redis connected")
 
 
+# routers are imported on the first request that matches one of their
+# routes so that a cold start only pays for the routers it uses. Keep
+# these in sync with the routes of each router, the order is the order
+# routes are matched in.
+routers = LazyRouters(
+    app,
+    [
+        (
+            "openaq_fastapi.routers.auth",
+            ["/check-email", "/email-key", "/register", "/verify/{verification_code}"],
+        ),
+        # V3 routers
+        (
+            "openaq_fastapi.v3.routers.locations",
+            ["/v3/locations", "/v3/locations/{locations_id}"],
+        ),
+        (
+            "openaq_fastapi.v3.routers.parameters",
+            ["/v3/parameters", "/v3/parameters/{parameters_id}"],
+        ),
+        (
+            "openaq_fastapi.v3.routers.tiles",
+            [
+                "/v3/locations/tiles/{z}/{x}/{y}.pbf",
+                "/v3/thresholds/tiles/{z}/{x}/{y}.pbf",
+                "/v3/locations/tiles/mobile/{z}/{x}/{y}.pbf",
+                "/v3/locations/tiles/mobile-paths/{z}/{x}/{y}.pbf",
+                "/v3/locations/tiles/mobile-generalized/{z}/{x}/{y}.pbf",
+                "/v3/locations/tiles/tiles.json",
+            ],
+        ),
+        (
+            "openaq_fastapi.v3.routers.countries",
+            ["/v3/countries", "/v3/countries/{countries_id}"],
+        ),
+        (
+            "openaq_fastapi.v3.routers.measurements",
+            [
+                "/v3/locations/{locations_id}/measurements",
+                "/v3/locations/{locations_id}/measurements/export",
+                "/v3/locations/{locations_id}/measurementsv2",
+            ],
+        ),
+        (
+            "openaq_fastapi.v3.routers.trends",
+            ["/v3/locations/{locations_id}/trends/{measurands_id}"],
+        ),
+        (
+            "openaq_fastapi.v3.routers.providers",
+            ["/v3/providers", "/v3/providers/{providers_id}"],
+        ),
+        ("openaq_fastapi.v3.routers.sensors", ["/v3/sensors/{sensors_id}"]),
+        # V1/V2 routers
+        ("openaq_fastapi.routers.averages", ["/v2/averages"]),
+        ("openaq_fastapi.routers.cities", ["/v1/cities", "/v2/cities"]),
+        (
+            "openaq_fastapi.routers.countries",
+            [
+                "/v1/countries",
+                "/v1/countries/{country_id}",
+                "/v2/countries",
+                "/v2/countries/{country_id}",
+            ],
+        ),
+        (
+            "openaq_fastapi.routers.locations",
+            [
+                "/v1/latest",
+                "/v1/latest/{location_id}",
+                "/v1/locations",
+                "/v1/locations/{location_id}",
+                "/v2/latest",
+                "/v2/latest/{location_id}",
+                "/v2/locations",
+                "/v2/locations/{location_id}",
+            ],
+        ),
+        ("openaq_fastapi.routers.manufacturers", ["/v2/manufacturers", "/v2/models"]),
+        ("openaq_fastapi.routers.measurements", ["/v1/measurements", "/v2/measurements"]),
+        (
+            "openaq_fastapi.routers.mvt",
+            [
+                "/v2/locations/tiles/{z}/{x}/{y}.pbf",
+                "/v2/locations/tiles/tiles.json",
+                "/v2/locations/tiles/viewer",
+                "/v2/locations/tiles/mobile/{z}/{x}/{y}.pbf",
+                "/v2/locations/tiles/mobile/tiles.json",
+                "/v2/locations/tiles/mobile-generalized/{z}/{x}/{y}.pbf",
+                "/v2/locations/tiles/mobile-generalized/tiles.json",
+            ],
+        ),
+        ("openaq_fastapi.routers.parameters", ["/v1/parameters", "/v2/parameters"]),
+        ("openaq_fastapi.routers.projects", ["/v2/projects", "/v2/projects/{project_id}"]),
+        (
+            "openaq_fastapi.routers.sources",
+            ["/v1/sources", "/v2/sources", "/v2/sources/readme/{slug}"],
+        ),
+        ("openaq_fastapi.routers.summary", ["/v2/summary"]),
+    ],
+)
+
+# added first so it is the innermost middleware and
+# cached responses never trigger an import
+app.add_middleware(LazyRouterMiddleware, routers=routers, load_all=[app.openapi_url])
+
+
+# final response bodies of the hottest endpoints, added before the
+# rate limiter so that cached responses are still counted
+response_cache = TieredCache(
+    max_bytes=settings.API_RESPONSE_CACHE_MAX_BYTES,
+    redis_host=settings.REDIS_HOST if settings.API_CACHE_USE_REDIS else None,
+    redis_port=settings.REDIS_PORT,
+    plugins=[EndpointHitMissRatioPlugin()],
+)
+
+if settings.API_RESPONSE_CACHE_PATHS:
+    app.add_middleware(
+        ResponseCacheMiddleware,
+        cache=response_cache,
+        paths=settings.API_RESPONSE_CACHE_PATHS,
+        ttl=settings.API_CACHE_TIMEOUT,
+    )
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -152,10 +256,11 @@ if settings.RATE_LIMITING is True:
             )
         )
 
-app.include_router(auth_router)
-
-
-app.add_middleware(CacheControlMiddleware, cachecontrol="public, max-age=900")
+app.add_middleware(
+    CacheControlMiddleware,
+    cachecontrol=settings.API_CACHE_CONTROL,
+    paths=settings.API_CACHE_CONTROL_PATHS,
+)
 app.add_middleware(LoggingMiddleware)
 
 
@@ -196,7 +301,10 @@ async def startup_event():
     if not hasattr(app.state, "pool"):
         logger.debug("initializing connection pool")
         app.state.pool = await db_pool(None)
+        app.state.keepalive = start_keepalive(app.state.pool)
         logger.debug("Connection pool established")
+    if settings.API_SNAPSHOTS:
+        snapshots.start(app.state.pool)
 
     if hasattr(app.state, "counter"):
         app.state.counter += 1
@@ -207,11 +315,19 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     """Application shutdown: de-register the database connection."""
+    await snapshots.stop()
     if hasattr(app.state, "pool") and not settings.USE_SHARED_POOL:
         logger.debug("Closing connection")
+        if getattr(app.state, "keepalive", None) is not None:
+            app.state.keepalive.cancel()
+            app.state.keepalive = None
         await app.state.pool.close()
         delattr(app.state, "pool")
         logger.debug("Connection closed")
+    if getattr(app.state, "write_pool", None) is not None:
+        pool = await app.state.write_pool
+        await pool.close()
+        app.state.write_pool = None
 
 
 @app.get("/ping", include_in_schema=False)
@@ -225,41 +341,43 @@ def pong():
     return {"ping": "pong!"}
 
 
+@app.get("/cache-stats", include_in_schema=False)
+def get_cache_stats():
+    """
+    hit/miss/eviction stats for the query and response caches
+    of this process, grouped by endpoint
+    """
+    return {
+        "query": cache_stats(),
+        "response": response_cache.stats(),
+        "snapshots": snapshots.stats(),
+        "tiles": tile_cache.stats(),
+    }
+
+
 @app.get("/favicon.ico", include_in_schema=False)
 def favico():
     return RedirectResponse("https://openaq.org/assets/graphics/meta/favicon.png")
 
 
-app.include_router(locations.router)
-app.include_router(parameters.router)
-app.include_router(tiles.router)
-app.include_router(countries.router)
-app.include_router(measurements.router)
-app.include_router(trends.router)
-app.include_router(providers.router)
-app.include_router(sensors.router)
-
-app.include_router(auth_router)
-app.include_router(averages_router)
-app.include_router(cities_router)
-app.include_router(countries_router)
-app.include_router(locations_router)
-app.include_router(manufacturers_router)
-app.include_router(measurements_router)
-app.include_router(mvt_router)
-app.include_router(parameters_router)
-app.include_router(projects_router)
-app.include_router(sources_router)
-app.include_router(summary_router)
-
-
 static_dir = Path.joinpath(Path(__file__).resolve().parent, "static")
 
 app.mount("/", StaticFiles(directory=str(static_dir), html=True))
 
 
+# one adapter per container. mangum would otherwise run the startup and
+# shutdown events around every invocation, instead startup runs on the
+# first invocation and the pool it creates is reused by warm invocations
+asgi_handler = Mangum(app, lifespan="off")
+
+
 def handler(event, context):
-    asgi_handler = Mangum(app)
+    if getattr(app.state, "started", False):
+        app.state.counter += 1
+    else:
+        # mangum runs every invocation on this same loop
+        asyncio.get_event_loop().run_until_complete(app.router.startup())
+        app.state.started = True
     return asgi_handler(event, context)
 
 
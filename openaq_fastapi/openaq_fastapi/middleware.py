@@ -1,10 +1,13 @@
 from datetime import timedelta
+import gzip
+import hashlib
 import logging
 import json
 import re
 import time
 from os import environ
-from typing import Union
+from typing import TYPE_CHECKING, Dict, List, Sequence, Tuple, Union
+from urllib.parse import parse_qsl, urlencode
 
 from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
 from starlette.requests import Request
@@ -13,8 +16,8 @@ from starlette.types import ASGIApp, Receive, Send, Message, Scope
 
 from fastapi.responses import JSONResponse
 from fastapi import Response, status
-from redis import Redis
 
+from openaq_fastapi.cache import LRUStore, TieredCache, cache_key, current_endpoint
 from openaq_fastapi.models.logging import (
     HTTPLog,
     LogType,
@@ -22,30 +25,131 @@ from openaq_fastapi.models.logging import (
     UnauthorizedLog,
 )
 
+if TYPE_CHECKING:
+    # only imported when rate limiting is turned on
+    from redis.asyncio import Redis
+
 logger = logging.getLogger("middleware")
 
 
 class CacheControlMiddleware(BaseHTTPMiddleware):
-    """MiddleWare to add CacheControl in response headers."""
+    """
+    MiddleWare to add CacheControl in response headers, the policy of
+    the longest matching path prefix or the default one.
+    """
 
-    def __init__(self, app: ASGIApp, cachecontrol: Union[str, None] = None) -> None:
+    def __init__(
+        self,
+        app: ASGIApp,
+        cachecontrol: Union[str, None] = None,
+        paths: Union[Dict[str, str], None] = None,
+    ) -> None:
         """Init Middleware."""
         super().__init__(app)
         self.cachecontrol = cachecontrol
+        self.paths = sorted(
+            ((p.rstrip("/"), policy) for p, policy in (paths or {}).items()),
+            key=lambda item: len(item[0]),
+            reverse=True,
+        )
+
+    def policy(self, path: str) -> Union[str, None]:
+        path = path.rstrip("/")
+        for p, policy in self.paths:
+            if path == p or path.startswith(f"{p}/"):
+                return policy
+        return self.cachecontrol
 
     async def dispatch(self, request: Request, call_next):
         """Add cache-control."""
         response = await call_next(request)
+        cachecontrol = self.policy(request.url.path)
         if (
             not response.headers.get("Cache-Control")
-            and self.cachecontrol
+            and cachecontrol
             and request.method in ["HEAD", "GET"]
             and response.status_code < 500
         ):
-            response.headers["Cache-Control"] = self.cachecontrol
+            response.headers["Cache-Control"] = cachecontrol
         return response
 
 
+class ResponseCacheMiddleware(BaseHTTPMiddleware):
+    """
+    MiddleWare to cache the final, gzipped JSON body of hot endpoints.
+    A hit skips the database, model validation and serialization.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        cache: TieredCache,
+        paths: List[str],
+        ttl: int,
+        vary: Sequence[str] = (),
+    ) -> None:
+        """Init Middleware."""
+        super().__init__(app)
+        self.cache = cache
+        self.paths = [p.rstrip("/") for p in paths]
+        self.ttl = ttl
+        self.vary = [h.lower() for h in vary]
+
+    def cached_path(self, path: str) -> Union[str, None]:
+        # only the listed paths, /v3/locations/{id} and the like are not
+        if path in self.paths:
+            return path
+        return None
+
+    def key(self, request: Request) -> str:
+        path = request.url.path.rstrip("/")
+        # sorting by name only keeps the order of repeated parameters
+        query = urlencode(
+            sorted(
+                parse_qsl(request.url.query, keep_blank_values=True),
+                key=lambda kv: kv[0],
+            )
+        )
+        headers = "&".join(f"{h}={request.headers.get(h, '')}" for h in self.vary)
+        return cache_key(path, query, headers, prefix="openaq:response")
+
+    async def dispatch(self, request: Request, call_next):
+        prefix = self.cached_path(request.url.path.rstrip("/"))
+        if request.method != "GET" or prefix is None:
+            return await call_next(request)
+
+        token = current_endpoint.set(prefix)
+        try:
+            key = self.key(request)
+            compressed = await self.cache.get(key)
+            if compressed is not None:
+                headers = {"x-cache": "HIT", "vary": "accept-encoding"}
+                if "gzip" in request.headers.get("accept-encoding", ""):
+                    headers["content-encoding"] = "gzip"
+                    content = compressed
+                else:
+                    content = gzip.decompress(compressed)
+                return Response(
+                    content=content, media_type="application/json", headers=headers
+                )
+
+            response = await call_next(request)
+            if response.status_code != 200 or not response.headers.get(
+                "content-type", ""
+            ).startswith("application/json"):
+                return response
+
+            body = b"".join([chunk async for chunk in response.body_iterator])
+            await self.cache.set(key, gzip.compress(body), ttl=self.ttl)
+            headers = dict(response.headers)
+            headers["x-cache"] = "MISS"
+            return Response(
+                content=body, status_code=response.status_code, headers=headers
+            )
+        finally:
+            current_endpoint.reset(token)
+
+
 class GetHostMiddleware(BaseHTTPMiddleware):
     """MiddleWare to set servers url on App with current url."""
 
@@ -102,14 +206,81 @@ class LoggingMiddleware(BaseHTTPMiddleware):
         return response
 
 
+# Refills the bucket for the time since it was last touched and takes a
+# token if there is one, all in one round trip. The clock is the redis
+# server's so that every api instance agrees on it.
+token_bucket_script = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1])
+local ts = tonumber(bucket[2])
+if tokens == nil or ts == nil then
+    tokens = capacity
+    ts = now
+end
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+local retry_after = 0
+if allowed == 0 then
+    retry_after = math.ceil((1 - tokens) / rate)
+end
+return {allowed, math.floor(tokens), retry_after}
+"""
+
+
+class TokenBucket:
+    """
+    Token buckets in redis, each holding up to limit tokens and refilled
+    continuously so that limit requests are allowed per period.
+
+    :param redis_client: asyncio redis (cluster) client
+    :param period: seconds it takes to refill an empty bucket
+    """
+
+    def __init__(self, redis_client: "Redis", period: float):
+        from redis.exceptions import NoScriptError
+
+        self.redis_client = redis_client
+        self.period = period
+        self.sha = hashlib.sha1(token_bucket_script.encode()).hexdigest()
+        self.no_script = NoScriptError
+
+    async def take(self, key: str, limit: int) -> Tuple[bool, int, int]:
+        """(allowed, tokens left, seconds until the next token)"""
+        args = (limit, limit / self.period)
+        try:
+            result = await self.redis_client.evalsha(self.sha, 1, key, *args)
+        except self.no_script:
+            # loads the script for the following evalsha calls
+            result = await self.redis_client.eval(token_bucket_script, 1, key, *args)
+        allowed, tokens, retry_after = result
+        return bool(allowed), int(tokens), int(retry_after)
+
+
 class RateLimiterMiddleWare(BaseHTTPMiddleware):
+    """
+    rate limits requests per api key or client ip with a token bucket in
+    redis, taking one round trip per request on an asyncio client. Valid
+    api keys are remembered in process for key_ttl seconds.
+    """
+
     def __init__(
         self,
         app: ASGIApp,
-        redis_client: Redis,
+        redis_client: "Redis",
         rate_amount: int,  # number of requests allowed without api key
         rate_amount_key: int,  # number of requests allowed with api key
-        rate_time: timedelta,  # timedelta of rate limit expiration
+        rate_time: timedelta,  # time for an empty bucket to refill
+        key_ttl: float = 60,
     ) -> None:
         """Init Middleware."""
         super().__init__(app)
@@ -117,19 +288,34 @@ class RateLimiterMiddleWare(BaseHTTPMiddleware):
         self.rate_amount = rate_amount
         self.rate_amount_key = rate_amount_key
         self.rate_time = rate_time
-        self.counter = 0
-
-    def request_is_limited(self, key: str, limit: int):
-        if self.redis_client.setnx(key, limit):
-            self.redis_client.expire(key, int(self.rate_time.total_seconds()))
-        count = self.redis_client.get(key)
-        if count and int(count) > 0:
-            self.counter = self.redis_client.decrby(key, 1)
-            return False
-        return True
+        self.bucket = TokenBucket(redis_client, rate_time.total_seconds())
+        self.valid_keys = LRUStore(1024 * 1024)
+        self.key_ttl = key_ttl
+
+    async def request_is_limited(self, key: str, limit: int) -> Tuple[bool, int, int]:
+        """(limited, tokens left, seconds until the next token)"""
+        try:
+            allowed, tokens, retry_after = await self.bucket.take(
+                f"ratelimit:{key}", limit
+            )
+        except Exception as e:
+            # an unavailable redis should not take the api down with it
+            logger.warning(f"rate limiter failed, not limiting: {e}")
+            return False, limit, 0
+        return not allowed, tokens, retry_after
 
-    def check_valid_key(self, key: str):
-        if self.redis_client.sismember("keys", key):
+    async def check_valid_key(self, key: str) -> Union[bool, None]:
+        """None when the key cannot be checked"""
+        if self.valid_keys.get(key):
+            return True
+        try:
+            valid = await self.redis_client.sismember("keys", key)
+        except Exception as e:
+            # as with the limiter, an unavailable redis is not a 500
+            logger.warning(f"could not check api key, treating as unverified: {e}")
+            return None
+        if valid:
+            self.valid_keys.set(key, True, self.key_ttl, "keys")
             return True
         return False
 
@@ -157,28 +343,34 @@ class RateLimiterMiddleWare(BaseHTTPMiddleware):
         key = request.client.host
 
         if auth:
-            if not self.check_valid_key(auth):
+            valid = await self.check_valid_key(auth)
+            if valid is False:
                 logging.info(UnauthorizedLog(request=request).json())
                 return JSONResponse(
                     status_code=status.HTTP_401_UNAUTHORIZED,
                     content={"message": "invalid credentials"},
                 )
-            key = auth
-            limit = self.rate_amount_key
+            if valid:
+                key = auth
+                limit = self.rate_amount_key
 
-        if self.limited_path(route) and self.request_is_limited(key, limit):
-            logging.info(
-                TooManyRequestsLog(
-                    request=request,
-                    rate_limiter=f"{key}/{limit}/{self.counter}",
-                ).json()
-            )
-            return JSONResponse(
-                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                content={"message": "Too many requests"},
-            )
+        tokens = limit
+        if self.limited_path(route):
+            limited, tokens, retry_after = await self.request_is_limited(key, limit)
+            if limited:
+                logging.info(
+                    TooManyRequestsLog(
+                        request=request,
+                        rate_limiter=f"{key}/{limit}/{tokens}",
+                    ).json()
+                )
+                return JSONResponse(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    content={"message": "Too many requests"},
+                    headers={"retry-after": str(retry_after)},
+                )
 
-        request.app.state.rate_limiter = f"{key}/{limit}/{self.counter}"
+        request.app.state.rate_limiter = f"{key}/{limit}/{tokens}"
         response = await call_next(request)
 
         return response
@@ -1,9 +1,7 @@
-import inspect
 import logging
 from datetime import date, datetime, timedelta
 from enum import Enum
-from types import FunctionType
-from typing import Dict, List, Union
+from typing import List, Union
 
 import humps
 from dateutil.parser import parse
@@ -18,6 +16,9 @@ from pydantic import (
     root_validator,
 )
 
+from openaq_fastapi.cursors import decode_cursor
+from openaq_fastapi.dependencies import dependency_from_model
+
 logger = logging.getLogger("queries")
 
 maxint = 2147483647
@@ -28,6 +29,10 @@ ignore_in_docs = [
     "measurand",
     "lat",
     "lon",
+    "cursor_datetime",
+    "cursor_sensors_id",
+    "spatial_ids",
+    "distance_ids",
 ]
 
 
@@ -36,7 +41,7 @@ def parameter_dependency_from_model(name: str, model_cls):
     Takes a pydantic model class as input and creates
     a dependency with corresponding
     Query parameter definitions that can be used for GET
-    requests.
+    requests. The dependency is built once per model class.
 
     This will only work, if the fields defined in the
     input model can be turned into
@@ -47,41 +52,7 @@ def parameter_dependency_from_model(name: str, model_cls):
         name: Name for the dependency function.
         model_cls: A ``BaseModel`` inheriting model class as input.
     """
-    names = []
-    annotations: Dict[str, type] = {}
-    defaults = []
-    for field_model in model_cls.__fields__.values():
-        if field_model.name not in ["self"]:
-            field_info = field_model.field_info
-
-            if field_model.name not in ignore_in_docs:
-                names.append(field_model.name)
-                annotations[field_model.name] = field_model.outer_type_
-                defaults.append(
-                    Query(field_model.default, description=field_info.description)
-                )
-
-    code = inspect.cleandoc(
-        """
-    def %s(%s):
-        return %s(%s)
-    """
-        % (
-            name,
-            ", ".join(names),
-            model_cls.__name__,
-            ", ".join(["%s=%s" % (name, name) for name in names]),
-        )
-    )
-
-    compiled = compile(code, "string", "exec")
-    env = {model_cls.__name__: model_cls}
-    env.update(**globals())
-    func = FunctionType(compiled.co_consts[0], env, name)
-    func.__annotations__ = annotations
-    func.__defaults__ = (*defaults,)
-
-    return func
+    return dependency_from_model(name, model_cls, tuple(ignore_in_docs))
 
 
 class OBaseModel(BaseModel):
@@ -212,6 +183,8 @@ class Geo(OBaseModel):
         description="Search radius from coordinates as center in meters. Maximum of 25,000 (25km) defaults to 1000 (1km) e.g. radius=10000",
         example="10000",
     )
+    # candidate location ids from the spatial index, set by the router
+    spatial_ids: Union[List[int], None] = None
 
     @root_validator(pre=True)
     def addlatlon(cls, values):
@@ -225,7 +198,10 @@ class Geo(OBaseModel):
 
     def where_geo(self):
         if self.lat is not None and self.lon is not None:
-            return " st_dwithin(st_makepoint(:lon, :lat)::geography," " geog, :radius) "
+            where = " st_dwithin(st_makepoint(:lon, :lat)::geography," " geog, :radius) "
+            if self.spatial_ids is not None:
+                where = f" l.id = ANY(:spatial_ids) AND {where}"
+            return where
         return None
 
 
@@ -284,6 +260,9 @@ class Paging(OBaseModel):
 
     @validator("offset", check_fields=False)
     def check_offset(cls, v, values, **kwargs):
+        if "limit" not in values or "page" not in values:
+            # limit or page already failed validation
+            return v
         offset = values["limit"] * (values["page"] - 1)
         logger.debug(f"checking offset: {offset}")
         if offset + values["limit"] > 100000:
@@ -291,6 +270,26 @@ class Paging(OBaseModel):
         return offset
 
 
+class Cursor(OBaseModel):
+    cursor: Union[str, None] = Query(
+        None,
+        description="Continue from the end of a previous page by passing the cursor from its meta, with the same filters and sort. Cannot be combined with page",
+    )
+    cursor_datetime: Union[datetime, None] = None
+    cursor_sensors_id: Union[int, None] = None
+
+    @root_validator(pre=True)
+    def addcursor(cls, values):
+        cursor = values.get("cursor", None)
+        if cursor is not None:
+            if str(values.get("page", 1)) != "1":
+                raise ValueError("Cannot pass both a cursor and a page")
+            values["cursor_datetime"], values["cursor_sensors_id"] = decode_cursor(
+                cursor
+            )
+        return values
+
+
 class Sort(str, Enum):
     asc = "asc"
     desc = "desc"
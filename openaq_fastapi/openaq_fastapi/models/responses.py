@@ -28,6 +28,10 @@ class Meta(BaseModel):
     found: Union[int, str, None]
 
 
+class CursorMeta(Meta):
+    cursor: Union[str, None]
+
+
 class Date(BaseModel):
     utc: str
     local: str
@@ -335,6 +339,7 @@ class MeasurementsRow(BaseModel):
 
 
 class MeasurementsResponse(OpenAQResult):
+    meta: CursorMeta = CursorMeta()
     results: List[MeasurementsRow]
 
 
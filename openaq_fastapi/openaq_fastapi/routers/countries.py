@@ -3,6 +3,7 @@ from typing import Union, List
 from fastapi import APIRouter, Depends, Query
 from enum import Enum
 from ..db import DB
+from ..snapshots import snapshots
 from ..models.queries import APIBase, Country
 
 from openaq_fastapi.models.responses import (
@@ -86,6 +87,48 @@ class Countries(Country, APIBase):
         return " TRUE "
 
 
+countries_snapshot = snapshots.register(
+    "v2_countries",
+    """
+    SELECT
+    c.iso AS code
+    , c.name
+    , COUNT(DISTINCT sn.sensor_nodes_id) AS locations
+    , MIN(sr.datetime_first)::TEXT AS first_updated
+    , MAX(sr.datetime_last)::TEXT AS last_updated
+    , array_agg(DISTINCT m.measurand) AS parameters
+    , SUM(sr.value_count) AS "count"
+    , count (DISTINCT sn.city) AS cities
+    , count (DISTINCT p.source_name) AS sources
+    FROM
+        sensors_rollup sr
+    JOIN
+        sensors s USING (sensors_id)
+    JOIN
+        sensor_systems ss USING (sensor_systems_id)
+    JOIN
+        sensor_nodes sn USING (sensor_nodes_id)
+    JOIN
+        countries c USING (countries_id)
+    JOIN
+        measurands m USING (measurands_id)
+    JOIN
+        providers p USING (providers_id)
+    WHERE c.iso IS NOT NULL
+    GROUP BY code, c.name
+    ORDER BY c.name
+    """,
+    key="code",
+    order="name",
+)
+
+# snapshot columns for each order_by
+countries_order = {
+    "lastUpdated": "last_updated",
+    "firstUpdated": "first_updated",
+}
+
+
 @router.get(
     "/v1/countries/{country_id}",
     response_model=CountriesResponse,
@@ -111,6 +154,19 @@ async def countries_get(
     db: DB = Depends(),
     countries: Countries = Depends(Countries.depends()),
 ):
+    order_by = countries_order.get(countries.order_by.value, countries.order_by.value)
+    if await countries_snapshot.ensure(db) and countries_snapshot.sorts(order_by):
+        codes = set(countries.country or ())
+
+        def where(row):
+            return row["code"] in codes
+
+        return countries_snapshot.page(
+            countries.params(),
+            where if countries.country is not None else None,
+            order_by=order_by,
+            reverse=countries.sort == "desc",
+        )
     order_by = countries.order_by
     if countries.order_by == "lastUpdated":
         order_by = "8"
@@ -1,5 +1,5 @@
 import logging
-from typing import List
+from typing import ClassVar, List, Tuple
 
 import jq
 from fastapi import APIRouter, Depends, Query
@@ -14,6 +14,9 @@ from ..models.responses import (
     converter,
 )
 from ..db import DB
+from ..spatial import restrict
+from ..streaming import ndjson_page
+from ..v3.routers.locations import LocationsFormat
 from ..models.queries import (
     APIBase,
     City,
@@ -96,11 +99,37 @@ class Locations(
         example="Ecotech",
     )
     dumpRaw: Union[bool, None] = False
+    # page of ids in distance order from the spatial index
+    distance_ids: Union[List[int], None] = None
+
+    # fields with a filter in where(), besides the coordinates
+    filters: ClassVar[Tuple[str, ...]] = (
+        "project",
+        "location",
+        "country",
+        "city",
+        "parameter_id",
+        "parameter",
+        "sourceName",
+        "entity",
+        "sensorType",
+        "modelName",
+        "manufacturerName",
+        "isMobile",
+        "isAnalysis",
+        "unit",
+    )
+
+    def only_geo(self) -> bool:
+        return all(getattr(self, f, None) is None for f in self.filters)
 
     def order(self):
         stm = self.order_by
         if stm == "location":
             stm = "name"
+        elif stm == "distance" and self.distance_ids is not None:
+            # already in the requested direction
+            return "array_position(:distance_ids::int[], l.id) asc nulls last"
         elif stm == "distance":
             stm = "st_distance(st_makepoint(:lon,:lat)::geography, geog)"
         elif stm == "count":
@@ -220,7 +249,12 @@ class Locations(
 async def locations_get(
     db: DB = Depends(),
     locations: Locations = Depends(Locations.depends()),
+    format: LocationsFormat = Query(
+        "json",
+        description="Response format. ndjson streams one result per line followed by the meta",
+    ),
 ):
+    await restrict(locations, db)
     qparams = locations.params()
 
     hidejson = "rawData,"
@@ -257,6 +291,8 @@ async def locations_get(
     LIMIT :limit
     OFFSET :offset;
     """
+    if format == LocationsFormat.ndjson:
+        return ndjson_page(db, q, qparams)
     output = await db.fetchPage(q, qparams)
     return output
 
@@ -278,7 +314,12 @@ async def locations_get(
 async def latest_get(
     db: DB = Depends(),
     locations: Locations = Depends(Locations.depends()),
+    format: LocationsFormat = Query(
+        "json",
+        description="Response format. ndjson streams one result per line followed by the meta",
+    ),
 ):
+    await restrict(locations, db, ordered=False)
     qparams = locations.params()
 
     q = f"""
@@ -298,6 +339,8 @@ async def latest_get(
     LIMIT :limit
     OFFSET :offset
     """
+    if format == LocationsFormat.ndjson:
+        return ndjson_page(db, q, qparams)
     output = await db.fetchPage(q, qparams)
     return output
 
@@ -319,6 +362,7 @@ async def latest_v1_get(
     locations: Locations = Depends(Locations.depends()),
 ):
     locations.entity = "government"
+    await restrict(locations, db, ordered=False)
     qparams = locations.params()
 
     q = f"""
@@ -376,6 +420,7 @@ async def locationsv1_get(
     locations: Locations = Depends(Locations.depends()),
 ):
     locations.entity = "government"
+    await restrict(locations, db)
     qparams = locations.params()
 
     q = f"""
@@ -7,14 +7,17 @@ import jq
 import orjson as json
 from dateutil.tz import UTC
 from datetime import timedelta, datetime
-from fastapi import APIRouter, Depends, Query
-from starlette.responses import Response
+from fastapi import APIRouter, Depends, HTTPException, Query
+from starlette.responses import StreamingResponse
+from .. import columnar
 from ..db import DB
+from ..streaming import csv_chunks
 from ..models.responses import MeasurementsResponse, MeasurementsResponseV1, Meta
 from ..models.queries import (
     APIBase,
     City,
     Country,
+    Cursor,
     DateRange,
     Geo,
     HasGeo,
@@ -24,9 +27,6 @@ from ..models.queries import (
     SensorTypes,
     EntityTypes,
 )
-import csv
-import io
-
 from openaq_fastapi.models.responses import OpenAQResult, converter
 
 logger = logging.getLogger("measurements")
@@ -36,57 +36,61 @@ router = APIRouter(
 )
 
 
+meas_csv_header = [
+    "locationId",
+    "location",
+    "city",
+    "country",
+    "utc",
+    "local",
+    "parameter",
+    "value",
+    "unit",
+    "latitude",
+    "longitude",
+]
+meas_csv_fields = ["sourceName", "attribution", "averagingPeriod"]
+
+
 def meas_csv(rows, includefields):
-    output = io.StringIO()
-    writer = csv.writer(output)
-    header = [
-        "locationId",
-        "location",
-        "city",
-        "country",
-        "utc",
-        "local",
-        "parameter",
-        "value",
-        "unit",
-        "latitude",
-        "longitude",
-    ]
-    # include_fields in csv header
+    """streams rows as csv, with any requested include_fields as extra columns"""
+    include_fields = []
     if includefields is not None:
-        include_fields = includefields.split(",")
-        available_fields = ["sourceName", "attribution", "averagingPeriod"]
-        for f in include_fields:
-            if f in available_fields:
-                header.append(f)
-    writer.writerow(header)
-    for r in rows:
-        try:
-            row = [
-                r["locationId"],
-                r["location"],
-                r["city"],
-                r["country"],
-                r["date"]["utc"],
-                r["date"]["local"],
-                r["parameter"],
-                r["value"],
-                r["unit"],
-                r["coordinates"]["latitude"],
-                r["coordinates"]["longitude"],
-            ]
-            # include_fields in csv data
-            if includefields is not None:
-                include_fields = includefields.split(",")
-                available_fields = ["sourceName", "attribution", "averagingPeriod"]
-                for f in include_fields:
-                    if f in available_fields:
-                        row.append(r["{}".format(f)])
-            writer.writerow(row)
-        except Exception as e:
-            logger.debug(e)
-
-    return output.getvalue()
+        include_fields = [f for f in includefields.split(",") if f in meas_csv_fields]
+
+    def row(r):
+        date = r["date"] or {}
+        coordinates = r["coordinates"] or {}
+        return [
+            r["locationId"],
+            r["location"],
+            r.get("city"),
+            r["country"],
+            date.get("utc"),
+            date.get("local"),
+            r["parameter"],
+            r["value"],
+            r["unit"],
+            coordinates.get("latitude"),
+            coordinates.get("longitude"),
+            *(r.get(f) for f in include_fields),
+        ]
+
+    return csv_chunks(rows, meas_csv_header + include_fields, row)
+
+
+meas_columns = [
+    ("location_id", "int32", lambda r: r["locationId"]),
+    ("location", "string", lambda r: r["location"]),
+    ("sensors_id", "int32", lambda r: r["cursor_sensors_id"]),
+    ("parameter", "string", lambda r: r["parameter"]),
+    ("unit", "string", lambda r: r["unit"]),
+    ("datetime", "timestamp", lambda r: r["cursor_datetime"]),
+    ("value", "float64", lambda r: None if r["value"] is None else float(r["value"])),
+    ("latitude", "float64", lambda r: (r["coordinates"] or {}).get("latitude")),
+    ("longitude", "float64", lambda r: (r["coordinates"] or {}).get("longitude")),
+    ("country", "string", lambda r: r["country"]),
+]
 
 
 class MeasOrder(str, Enum):
@@ -97,7 +101,7 @@ class MeasOrder(str, Enum):
 
 
 class Measurements(
-    Location, City, Country, Geo, Measurands, HasGeo, APIBase, DateRange
+    Location, City, Country, Geo, Measurands, HasGeo, APIBase, DateRange, Cursor
 ):
     order_by: MeasOrder = Query("datetime")
     sort: Sort = Query("desc")
@@ -185,6 +189,11 @@ class Measurements(
                     wheres.append("h.datetime > :date_from")
                 elif f == "date_to":
                     wheres.append("h.datetime <= :date_to")
+                elif f == "cursor":
+                    op = "<" if self.sort == "desc" else ">"
+                    wheres.append(
+                        f"(h.datetime, h.sensors_id) {op} (:cursor_datetime, :cursor_sensors_id)"
+                    )
 
         wheres = list(filter(None, wheres))
         # wheres.append(" sensor_nodes_id not in (61485,61505,61506) ")
@@ -208,6 +217,9 @@ async def measurements_get(
     where = m.where()
     params = m.params()
     includes = m.include_fields
+    # every page can hand out a cursor, so every page is ordered on
+    # the full cursor key or rows sharing a datetime are skipped
+    sort = "DESC" if m.sort == "desc" else "ASC"
 
     sql = f"""
         SELECT sn.id as "locationId"
@@ -228,6 +240,8 @@ async def measurements_get(
                ELSE 'low-cost sensor'
                END as "sensorType"
         , sn.is_analysis
+        , h.datetime as cursor_datetime
+        , h.sensors_id as cursor_sensors_id
         FROM hourly_data h
         JOIN sensors s USING (sensors_id)
         JOIN sensor_systems sy USING (sensor_systems_id)
@@ -235,19 +249,31 @@ async def measurements_get(
         JOIN locations_view_cached sn ON (sy.sensor_nodes_id = sn.id)
         JOIN measurands m ON (m.measurands_id = h.measurands_id)
         WHERE {where}
+        ORDER BY h.datetime {sort}, h.sensors_id {sort}
         OFFSET :offset
         LIMIT :limit;
         """
 
-    response = await db.fetchPage(sql, params)
-
     if format == "csv":
-        return Response(
-            content=meas_csv(response.results, includes),
+        return StreamingResponse(
+            meas_csv(db.iterate(sql, params), includes),
             media_type="text/csv",
             headers={"Content-Disposition": "attachment;filename=measurements.csv"},
         )
+    if format in ("arrow", "parquet"):
+        if not columnar.available():
+            raise HTTPException(
+                status_code=501, detail=f"{format} output is not available"
+            )
+        return StreamingResponse(
+            columnar.stream(format, db.iterate(sql, params), meas_columns),
+            media_type=columnar.media_types[format],
+            headers={
+                "Content-Disposition": f"attachment;filename=measurements.{format}"
+            },
+        )
 
+    response = await db.fetchPage(sql, params)
     return response
 
 
@@ -290,13 +316,12 @@ async def measurements_get_v1(
         LIMIT :limit
         """
 
-    response = await db.fetchPage(sql, params)
-
     if format == "csv":
-        return Response(
-            content=meas_csv(response.results, m.include_fields),
+        return StreamingResponse(
+            meas_csv(db.iterate(sql, params), m.include_fields),
             media_type="text/csv",
             headers={"Content-Disposition": "attachment;filename=measurements.csv"},
         )
 
+    response = await db.fetchPage(sql, params)
     return response
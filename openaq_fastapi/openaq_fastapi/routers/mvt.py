@@ -13,6 +13,8 @@ from starlette.responses import HTMLResponse
 from starlette.templating import Jinja2Templates
 
 from ..db import DB
+from ..settings import settings
+from ..tilecache import cached_tile
 from ..models.queries import OBaseModel, fix_datetime
 
 templates = Jinja2Templates(
@@ -112,6 +114,25 @@ class MobileTile(TileBase):
                 """
         return paramcols
 
+    def clustercols(self):
+        clustercols = ""
+        if self.parameter is not None:
+            clustercols = """
+                parameter,
+                unit,
+                avg("lastValue") as "lastValue",
+                min("lastValue") as "minValue",
+                max("lastValue") as "maxValue",
+                """
+        return clustercols
+
+    def clustergroup(self):
+        # values are only comparable within the same parameter and unit
+        clustergroup = ""
+        if self.parameter is not None:
+            clustergroup = ", parameter, unit"
+        return clustergroup
+
     def paramgroup(self):
         paramgroup = "1,2,3,4,5,6"
         if self.parameter is not None:
@@ -127,9 +148,16 @@ class MobileTile(TileBase):
     include_in_schema=False,
 )
 async def get_tile(
+    request: Request,
     db: DB = Depends(),
     t: MobileTile = Depends(MobileTile.depends()),
 ):
+    return await cached_tile(
+        request, "v2_locations", t.params(), lambda: fetch_tile(t, db)
+    )
+
+
+async def fetch_tile(t: MobileTile, db: DB):
     query = f"""
         WITH
         tile AS (
@@ -156,16 +184,42 @@ async def get_tile(
             geom && tile
             GROUP BY {t.paramgroup()}, tile
         )
+        {cluster_sql(t) if clustered(t.z) else ""}
 
         SELECT
-            (SELECT ST_AsMVT(t, 'default') FROM t);
+            (SELECT ST_AsMVT(f, 'default') FROM {"clusters" if clustered(t.z) else "t"} f);
     """
+    params = t.params()
+    if clustered(t.z):
+        params["cluster_cell"] = settings.API_TILE_CLUSTER_CELL
+    return await db.fetchval(query, params)
 
-    vt = await db.fetchval(query, t.params())
-    if vt is None:
-        raise HTTPException(status_code=204, detail="no data found for this tile")
 
-    return Response(content=vt, status_code=200, media_type="application/x-protobuf")
+def clustered(z: int) -> bool:
+    return z <= settings.API_TILE_CLUSTER_MAX_ZOOM
+
+
+def cluster_sql(t: MobileTile) -> str:
+    """
+    replaces t with one feature per grid cell of :cluster_cell tile
+    units, with the number of locations in it and the most recently
+    updated one as its locationId
+    """
+    return f""",
+        clusters AS (
+            SELECT
+                (array_agg("locationId" ORDER BY "lastUpdated" DESC NULLS LAST))[1] as "locationId",
+                max("lastUpdated") as "lastUpdated",
+                count(*) as "locationCount",
+                bool_or("isMobile") as "isMobile",
+                bool_or("isAnalysis") as "isAnalysis",
+                {t.clustercols()}
+                sum(count) as count,
+                ST_SnapToGrid(ST_Centroid(ST_Collect(mvt)), 1) as mvt
+            FROM t
+            WHERE mvt IS NOT NULL
+            GROUP BY ST_SnapToGrid(mvt, :cluster_cell){t.clustergroup()}
+        )"""
 
 
 @router.get(
@@ -4,6 +4,7 @@ from fastapi import APIRouter, Depends, Query
 from pydantic.typing import Literal
 
 from ..db import DB
+from ..snapshots import snapshots
 from ..models.queries import (
     APIBase,
     SourceName,
@@ -28,6 +29,21 @@ class Parameters(APIBase):
     order_by: Literal["id", "name", "preferredUnit"] = Query("id")
 
 
+parameters_snapshot = snapshots.register(
+    "v2_parameters",
+    """
+    SELECT
+        measurands_id as id
+        , measurand as name
+        , display as "displayName"
+        , coalesce(description, display, 'n/a') as description
+        , units as "preferredUnit"
+    FROM
+        measurands
+    """,
+)
+
+
 @router.get(
     "/v2/parameters",
     response_model=ParametersResponse,
@@ -39,6 +55,14 @@ async def parameters_get(
     db: DB = Depends(),
     parameters: Parameters = Depends(Parameters.depends()),
 ):
+    if await parameters_snapshot.ensure(db) and parameters_snapshot.sorts(
+        parameters.order_by
+    ):
+        return parameters_snapshot.page(
+            parameters.params(),
+            order_by=parameters.order_by,
+            reverse=parameters.sort == "desc",
+        )
     q = f"""
     SELECT
         measurands_id as id
@@ -7,6 +7,7 @@ from markdown import markdown
 from starlette.exceptions import HTTPException
 from enum import Enum
 from ..db import DB
+from ..snapshots import snapshots
 from ..models.queries import (
     APIBase,
     SourceName,
@@ -48,6 +49,31 @@ class Sources(SourceName, APIBase):
         return " TRUE "
 
 
+sources_snapshot = snapshots.register(
+    "v2_sources",
+    """
+    SELECT
+        sources_id as "sourceId",
+        slug as "sourceSlug",
+        sources.name as "sourceName",
+        sources.metadata as data,
+        case when readme is not null then
+        '/v2/sources/readmes/' || slug
+        else null end as readme,
+        count(*) as locations
+    FROM sources
+    LEFT JOIN sensor_nodes_sources USING (sources_id)
+    LEFT JOIN sensor_systems USING (sensor_nodes_id)
+    LEFT JOIN sensors USING (sensor_systems_id)
+    GROUP BY
+    1,2,3,4,5
+    ORDER BY "sourceName"
+    """,
+    key="sourceId",
+    order="sourceName",
+)
+
+
 @router.get(
     "/v2/sources",
     response_model=SourcesResponse,
@@ -61,6 +87,27 @@ async def sources_get(
 ):
     qparams = sources.params()
 
+    # firstUpdated and lastUpdated are not selected yet
+    if sources.order_by == "sourceName" and await sources_snapshot.ensure(db):
+        filters = [
+            (column, set(values))
+            for column, values in (
+                ("sourceId", sources.sourceId),
+                ("sourceName", sources.sourceName),
+                ("sourceSlug", sources.sourceSlug),
+            )
+            if values is not None
+        ]
+        output = sources_snapshot.page(
+            qparams,
+            lambda row: all(row[column] in values for column, values in filters),
+            order_by="sourceName",
+            reverse=sources.sort == "desc",
+        )
+        # the query below counts the rows of the page
+        output.meta.found = len(output.results)
+        return output
+
     #
     q = f"""
     WITH t AS (
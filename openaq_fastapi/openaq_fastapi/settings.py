@@ -1,4 +1,4 @@
-from typing import Union
+from typing import Dict, List, Tuple, Union
 from pydantic import BaseSettings, validator
 from pathlib import Path
 from os import environ
@@ -14,7 +14,65 @@ class Settings(BaseSettings):
     DATABASE_PORT: int
     DATABASE_READ_URL: Union[str, None]
     DATABASE_WRITE_URL: Union[str, None]
+    DATABASE_COMMAND_TIMEOUT: float = 6
+    DATABASE_POOL_MIN_SIZE: int = 1
+    DATABASE_POOL_MAX_SIZE: int = 10
+    DATABASE_POOL_MAX_INACTIVE_LIFETIME: float = 15
+    DATABASE_POOL_WARM_SIZE: int = 2
+    DATABASE_POOL_KEEPALIVE: float = 10
+    DATABASE_POOL_PREPARE_SHAPES: int = 5
+    DATABASE_CURSOR_PREFETCH: int = 1000
+    DATABASE_WRITE_POOL_MIN_SIZE: int = 0
+    DATABASE_WRITE_POOL_MAX_SIZE: int = 2
+    DATABASE_WRITE_POOL_MAX_INACTIVE_LIFETIME: float = 60
+    DATABASE_WRITE_COMMAND_TIMEOUT: float = 10
     API_CACHE_TIMEOUT: int = 900
+    API_CACHE_HARD_TIMEOUT: int = 3600
+    API_CACHE_ENDPOINT_TIMEOUTS: Dict[str, Tuple[int, int]] = {
+        "/v2/latest": (300, 1800),
+    }
+    API_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    # exact counts unless a deployment opts an endpoint in, e.g.
+    # {"/v3/locations": "cached"} or {"/v2/measurements": "estimate"}
+    API_COUNT_MODES: Dict[str, str] = {}
+    API_COUNT_ESTIMATE_THRESHOLD: int = 10000
+    API_COUNT_CACHE_TIMEOUT: int = 86400
+    API_SNAPSHOTS: bool = True
+    API_SNAPSHOT_INTERVAL: int = 900
+    API_SNAPSHOT_CHANNEL: Union[str, None] = "openaq_snapshots"
+    # a primary to LISTEN on for refreshes, replicas do not deliver them
+    API_SNAPSHOT_LISTEN_URL: Union[str, None] = None
+    API_SPATIAL_INDEX: bool = True
+    API_SPATIAL_INDEX_CELL: float = 0.25
+    API_SPATIAL_INDEX_MAX_IDS: int = 5000
+    API_TILE_CACHE: bool = True
+    API_TILE_GEOM_CACHED: bool = False
+    API_TILE_CLUSTER_MAX_ZOOM: int = 5
+    API_TILE_CLUSTER_CELL: int = 128
+    API_TILE_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    API_TILE_CACHE_TTL: int = 900
+    API_TILE_CACHE_STORE: Union[str, None] = None
+    API_TILE_CACHE_STORE_TTL: int = 3600
+    API_TILE_SEED_MAX_ZOOM: int = 6
+    API_TILE_SEED_PARAMETERS: List[int] = [2]
+    API_MOBILE_TILE_ZOOMS: List[int] = [0, 2, 4, 6, 8, 10, 12, 14, 16]
+    API_CACHE_USE_REDIS: bool = True
+    API_CACHE_SHARED_LOCK: bool = False
+    API_CACHE_LOCK_LEASE: float = 6
+    API_STATEMENT_CACHE_SIZE: int = 100
+    API_RESPONSE_CACHE_PATHS: List[str] = ["/v2/latest", "/v2/locations", "/v3/locations"]
+    API_RESPONSE_CACHE_MAX_BYTES: int = 32 * 1024 * 1024
+    API_CACHE_CONTROL: str = "public, max-age=900"
+    API_CACHE_CONTROL_PATHS: Dict[str, str] = {
+        "/ping": "no-store",
+        "/cache-stats": "no-store",
+        "/v2/locations/tiles": "public, max-age=300, stale-while-revalidate=900",
+        "/v3/locations/tiles": "public, max-age=300, stale-while-revalidate=900",
+        "/v3/thresholds/tiles": "public, max-age=3600",
+        "/v3/locations/tiles/mobile": "public, max-age=3600",
+        "/v3/locations/tiles/mobile-generalized": "public, max-age=3600",
+        "/v3/locations/tiles/mobile-paths": "public, max-age=3600",
+    }
     USE_SHARED_POOL: bool = False
     LOG_LEVEL: str = "INFO"
     LOG_BUCKET: str = None
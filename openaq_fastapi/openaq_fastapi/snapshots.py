@@ -0,0 +1,249 @@
+"""
+In memory copies of small, slowly changing reference tables so their
+endpoints can filter, sort and page without going to the database.
+
+A snapshot is declared next to the endpoint that serves it and is
+loaded the first time it is used. Once loaded it is refreshed every
+``API_SNAPSHOT_INTERVAL`` seconds and whenever a notification arrives
+on ``API_SNAPSHOT_CHANNEL``, e.g.
+
+    NOTIFY openaq_snapshots, 'v3_parameters';
+
+with the snapshot name as the payload, or no payload to refresh all.
+Until a snapshot has loaded, or if loading fails, endpoints fall back
+to querying the database.
+
+Rows are sorted in python, which does not know the collation of the
+database, so text columns are only sorted by the column the snapshot
+query itself orders by and every other text order goes to the database.
+Notifications are only listened for on an explicit
+``API_SNAPSHOT_LISTEN_URL``, otherwise snapshots refresh on the interval.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Type
+
+import asyncpg
+
+from openaq_fastapi.models.responses import Meta, OpenAQResult
+from openaq_fastapi.settings import settings
+
+logger = logging.getLogger("snapshots")
+
+
+def sort_key(column: str):
+    # nulls sort last, and so first when reversed, as in postgres
+    def key(row):
+        value = row[column]
+        return (value is None, value)
+
+    return key
+
+
+def collated(value) -> bool:
+    # text, and arrays of text, compare by the collation of the database
+    if isinstance(value, (list, tuple)):
+        return any(collated(v) for v in value)
+    return isinstance(value, str)
+
+
+class Snapshot:
+    """
+    every row of a query along with an index on its key column
+
+    :param name: name used for notifications and stats
+    :param sql: query for all of the rows, without parameters
+    :param key: column to index rows on for lookups by id
+    :param order: column the query orders rows by, kept in that order
+    """
+
+    def __init__(
+        self, name: str, sql: str, key: str = "id", order: Optional[str] = None
+    ):
+        self.name = name
+        self.sql = sql
+        self.key = key
+        self.order = order
+        self.rows: Optional[List[Any]] = None
+        self.index: Dict[Any, Any] = {}
+        self.loaded_at: Optional[float] = None
+        self._loading: Optional[asyncio.Future] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.rows is not None
+
+    def enabled(self) -> bool:
+        return settings.API_SNAPSHOTS
+
+    def build(self, rows: List[Any]):
+        # swapped in whole so readers never see a partial snapshot
+        self.rows, self.index = rows, {row[self.key]: row for row in rows}
+
+    async def load(self, pool):
+        start = time.time()
+        async with pool.acquire() as con:
+            rows = await con.fetch(self.sql)
+        self.build(rows)
+        self.loaded_at = time.time()
+        logger.debug(
+            f"loaded {self.name}: {len(rows)} rows in {time.time() - start:.3f}s"
+        )
+
+    async def ensure(self, db) -> bool:
+        """loads the snapshot on first use, True if it can be served"""
+        if self.loaded:
+            return True
+        if not self.enabled():
+            return False
+        if self._loading is None:
+            self._loading = asyncio.ensure_future(self.load(await db.pool()))
+        try:
+            await asyncio.shield(self._loading)
+        except Exception as e:
+            logger.warning(f"could not load snapshot {self.name}: {e}")
+            self._loading = None
+            return False
+        return True
+
+    def sorts(self, column: str) -> bool:
+        """True if ordering by column matches the database"""
+        if column == self.order:
+            return True
+        return not any(collated(row[column]) for row in self.rows or [])
+
+    def page(
+        self,
+        kwargs: dict,
+        where: Optional[Callable[[Any], bool]] = None,
+        order_by: Optional[str] = None,
+        reverse: bool = False,
+    ) -> OpenAQResult:
+        """the same page fetchPage would return for these rows"""
+        rows = self.rows
+        if where is not None:
+            rows = [row for row in rows if where(row)]
+        if order_by is not None and order_by == self.order:
+            # already in the order of the database
+            rows = rows[::-1] if reverse else rows
+        elif order_by is not None:
+            rows = sorted(rows, key=sort_key(order_by), reverse=reverse)
+        limit = kwargs.get("limit", len(rows))
+        offset = (kwargs.get("page", 1) - 1) * limit
+        kwargs["found"] = len(rows)
+        return OpenAQResult(
+            meta=Meta.parse_obj(kwargs), results=rows[offset:offset + limit]
+        )
+
+    def get(self, kwargs: dict, key: Any) -> OpenAQResult:
+        row = self.index.get(key)
+        kwargs["found"] = 0 if row is None else 1
+        return OpenAQResult(
+            meta=Meta.parse_obj(kwargs), results=[] if row is None else [row]
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rows": None if self.rows is None else len(self.rows),
+            "age": (
+                None if self.loaded_at is None else round(time.time() - self.loaded_at)
+            ),
+        }
+
+
+class Snapshots:
+    """the declared snapshots and the task that keeps them fresh"""
+
+    def __init__(self):
+        self.snapshots: Dict[str, Snapshot] = {}
+        self.pending: Set[str] = set()
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Future] = None
+        self._listener = None
+
+    def register(
+        self,
+        name: str,
+        sql: str,
+        key: str = "id",
+        order: Optional[str] = None,
+        cls: Type[Snapshot] = Snapshot,
+    ) -> Snapshot:
+        snapshot = cls(name, sql, key, order)
+        self.snapshots[name] = snapshot
+        return snapshot
+
+    def notify(self, connection, pid, channel, payload):
+        self.pending.add(payload or "*")
+        if self._wake is not None:
+            self._wake.set()
+
+    async def refresh(self, pool, names: Optional[Set[str]] = None):
+        for snapshot in self.snapshots.values():
+            # only snapshots in use are kept up to date
+            if not snapshot.loaded or (names and snapshot.name not in names):
+                continue
+            try:
+                await snapshot.load(pool)
+                self.refreshes += 1
+            except Exception as e:
+                self.refresh_errors += 1
+                logger.warning(f"could not refresh snapshot {snapshot.name}: {e}")
+
+    async def _listen(self):
+        # never defaults to the write url, it would hold a connection open
+        url = settings.API_SNAPSHOT_LISTEN_URL
+        if not settings.API_SNAPSHOT_CHANNEL or not url:
+            return
+        try:
+            # notifications are not delivered on read replicas
+            self._listener = await asyncpg.connect(url)
+            await self._listener.add_listener(
+                settings.API_SNAPSHOT_CHANNEL, self.notify
+            )
+        except Exception as e:
+            self._listener = None
+            logger.warning(f"not listening for snapshot notifications: {e}")
+
+    async def _run(self, pool):
+        await self._listen()
+        while not pool.is_closing():
+            try:
+                await asyncio.wait_for(
+                    self._wake.wait(), timeout=settings.API_SNAPSHOT_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            pending, self.pending = self.pending, set()
+            if pool.is_closing():
+                break
+            await self.refresh(pool, None if not pending or "*" in pending else pending)
+
+    def start(self, pool):
+        if self._task is None or self._task.done():
+            # created here so it belongs to the running loop
+            self._wake = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run(pool))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._listener is not None:
+            await self._listener.close()
+            self._listener = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "snapshots": {name: s.stats() for name, s in self.snapshots.items()},
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "listening": self._listener is not None,
+        }
+
+
+snapshots = Snapshots()
@@ -0,0 +1,272 @@
+"""
+In process grid index over the location points in locations_view_cached
+used to narrow radius and bbox queries down to a set of location ids
+before they reach the database. numpy is an optional dependency,
+install it with the ``spatial`` extra to enable the index.
+
+The index only picks candidates, with a small margin, and the database
+still applies the exact ST_DWithin/&& filter to them. Like the other
+snapshots it is loaded on first use and refreshed along with them, so
+it can be up to ``API_SNAPSHOT_INTERVAL`` seconds behind the view,
+unless a notification refreshes it sooner. Locations added or moved
+since the last refresh are missed until the next one.
+"""
+import logging
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from openaq_fastapi.settings import settings
+from openaq_fastapi.snapshots import Snapshot, snapshots
+
+logger = logging.getLogger("spatial")
+
+# mean earth radius in meters
+earth_radius = 6371008.8
+meters_per_degree = earth_radius * math.pi / 180
+# headroom for the sphere vs the spheroid postgis measures on
+margin = 1.01
+
+Bbox = Tuple[float, float, float, float]
+
+
+def available() -> bool:
+    return np is not None
+
+
+def haversine(lon, lat, lons, lats):
+    """distances in meters from (lon, lat) to each of the points"""
+    lon, lat = math.radians(lon), math.radians(lat)
+    lons, lats = np.radians(lons), np.radians(lats)
+    a = (
+        np.sin((lats - lat) / 2) ** 2
+        + math.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    )
+    return 2 * earth_radius * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def radius_bboxes(lon: float, lat: float, meters: float) -> List[Bbox]:
+    """bboxes covering a circle, split in two where it crosses the antimeridian"""
+    dlat = meters / meters_per_degree
+    miny, maxy = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+    widest = math.cos(math.radians(max(abs(miny), abs(maxy))))
+    if maxy >= 90 or miny <= -90 or dlat >= 90 * widest:
+        return [(-180.0, miny, 180.0, maxy)]
+    dlon = dlat / widest
+    minx, maxx = lon - dlon, lon + dlon
+    if minx < -180:
+        return [(minx + 360, miny, 180.0, maxy), (-180.0, miny, maxx, maxy)]
+    if maxx > 180:
+        return [(minx, miny, 180.0, maxy), (-180.0, miny, maxx - 360, maxy)]
+    return [(minx, miny, maxx, maxy)]
+
+
+class GridIndex:
+    """
+    points bucketed into a regular lon/lat grid, sorted by cell so that
+    each row of cells in a bbox is one contiguous slice of the arrays
+
+    :param ids: location ids
+    :param lons: longitudes, in the same order
+    :param lats: latitudes, in the same order
+    :param cell: cell size in degrees
+    """
+
+    def __init__(self, ids, lons, lats, cell: float = 0.25):
+        self.cell = cell
+        self.cols = int(math.ceil(360 / cell))
+        self.rows = int(math.ceil(180 / cell))
+        lons = np.asarray(lons, dtype=np.float64)
+        lats = np.asarray(lats, dtype=np.float64)
+        keys = self._row(lats) * self.cols + self._col(lons)
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.ids = np.asarray(ids, dtype=np.int64)[order]
+        self.lons = lons[order]
+        self.lats = lats[order]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _col(self, lons):
+        return np.clip(((lons + 180) // self.cell).astype(np.int64), 0, self.cols - 1)
+
+    def _row(self, lats):
+        return np.clip(((lats + 90) // self.cell).astype(np.int64), 0, self.rows - 1)
+
+    def _cells(self, bbox: Bbox):
+        """positions of the points in the cells a bbox touches"""
+        minx, miny, maxx, maxy = bbox
+        col0, col1 = self._col(np.array([minx, maxx]))
+        rows = np.arange(self._row(np.array([miny]))[0], self._row(np.array([maxy]))[0] + 1)
+        starts = np.searchsorted(self.keys, rows * self.cols + col0, side="left")
+        ends = np.searchsorted(self.keys, rows * self.cols + col1, side="right")
+        slices = [np.arange(s, e) for s, e in zip(starts, ends) if e > s]
+        if not slices:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(slices)
+
+    def _within(self, bbox: Bbox):
+        minx, miny, maxx, maxy = bbox
+        positions = self._cells(bbox)
+        lons, lats = self.lons[positions], self.lats[positions]
+        return positions[
+            (lons >= minx) & (lons <= maxx) & (lats >= miny) & (lats <= maxy)
+        ]
+
+    def bbox(self, minx: float, miny: float, maxx: float, maxy: float):
+        """ids of the points in a bbox, edges included"""
+        bbox = (min(minx, maxx), min(miny, maxy), max(minx, maxx), max(miny, maxy))
+        return self.ids[self._within(bbox)]
+
+    def radius_positions(self, lon: float, lat: float, meters: float):
+        positions = np.concatenate(
+            [self._within(bbox) for bbox in radius_bboxes(lon, lat, meters)]
+        )
+        distances = haversine(lon, lat, self.lons[positions], self.lats[positions])
+        keep = distances <= meters
+        return positions[keep], distances[keep]
+
+    def radius(self, lon: float, lat: float, meters: float):
+        """ids of the points within meters of (lon, lat)"""
+        positions, _ = self.radius_positions(lon, lat, meters)
+        return self.ids[positions]
+
+    def nearest(
+        self,
+        lon: float,
+        lat: float,
+        k: int,
+        meters: Optional[float] = None,
+        reverse: bool = False,
+    ):
+        """
+        ids of the k points nearest to (lon, lat), or farthest when
+        reversed, in order, optionally only from those within meters
+        """
+        if meters is None:
+            positions = np.arange(len(self.ids))
+            distances = haversine(lon, lat, self.lons, self.lats)
+        else:
+            positions, distances = self.radius_positions(lon, lat, meters)
+        if reverse:
+            distances = -distances
+        if k < len(distances):
+            # only the first k need sorting
+            top = np.argpartition(distances, k - 1)[:k]
+            top = top[np.argsort(distances[top], kind="stable")]
+        else:
+            top = np.argsort(distances, kind="stable")
+        return self.ids[positions[top]]
+
+
+class LocationIndex(Snapshot):
+    """a snapshot of location points kept as a GridIndex"""
+
+    grid: Optional[GridIndex] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.grid is not None
+
+    def enabled(self) -> bool:
+        return settings.API_SPATIAL_INDEX and available() and super().enabled()
+
+    def build(self, rows: List[Any]):
+        self.grid = GridIndex(
+            [r["id"] for r in rows],
+            [r["lon"] for r in rows],
+            [r["lat"] for r in rows],
+            settings.API_SPATIAL_INDEX_CELL,
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), "rows": None if self.grid is None else len(self.grid)}
+
+
+locations_index = snapshots.register(
+    "locations_index",
+    """
+    SELECT id
+    , st_x(geom) as lon
+    , st_y(geom) as lat
+    FROM locations_view_cached
+    WHERE geom IS NOT NULL
+    """,
+    cls=LocationIndex,
+)
+
+
+def candidates(query) -> Optional[List[int]]:
+    """
+    candidate location ids for the radius or bbox of a (v2 or v3) query,
+    None when it has neither or there are too many ids to be worth it
+    """
+    grid = locations_index.grid
+    lat, lon = getattr(query, "lat", None), getattr(query, "lon", None)
+    radius = getattr(query, "radius", None)
+    if lat is not None and lon is not None and radius is not None:
+        ids = grid.radius(lon, lat, radius * margin)
+    elif getattr(query, "minx", None) is not None:
+        # postgis compares float4 boxes, pad by about 10 m to cover that
+        pad = 1e-4
+        ids = grid.bbox(
+            query.minx - pad, query.miny - pad, query.maxx + pad, query.maxy + pad
+        )
+    else:
+        return None
+    if len(ids) > settings.API_SPATIAL_INDEX_MAX_IDS:
+        return None
+    return ids.tolist()
+
+
+def distance_order(query) -> Optional[List[int]]:
+    """
+    the ids for the requested page of a (v2) query ordered by distance,
+    only when it has no other filters that could drop any of them.
+
+    Locations close to the radius may be in or out depending on whether
+    it is measured on the sphere or the spheroid. All of those are kept
+    on top of the page so that the page is still complete and in order
+    after the database drops the ones that are out.
+    """
+    if getattr(query, "order_by", None) != "distance" or not query.only_geo():
+        return None
+    grid = locations_index.grid
+    _, distances = grid.radius_positions(query.lon, query.lat, query.radius * margin)
+    uncertain = int((distances > query.radius / margin).sum())
+    ids = grid.nearest(
+        query.lon,
+        query.lat,
+        query.offset + query.limit + uncertain,
+        query.radius * margin,
+        reverse=query.sort == "desc",
+    )
+    return ids.tolist()
+
+
+async def restrict(query, db, ordered: bool = True):
+    """
+    sets spatial_ids on a query with a radius or bbox when the index is
+    available so that the database only has to check those locations,
+    and distance_ids when the index can also order them. Pass ordered
+    False for queries that join tables that can drop locations, the
+    database orders those itself.
+    """
+    if not (
+        getattr(query, "lat", None) is not None
+        or getattr(query, "minx", None) is not None
+    ):
+        return
+    if not await locations_index.ensure(db):
+        return
+    ids = candidates(query)
+    if ids is not None:
+        query.spatial_ids = ids
+        distance_ids = distance_order(query) if ordered else None
+        if distance_ids is not None:
+            query.distance_ids = distance_ids
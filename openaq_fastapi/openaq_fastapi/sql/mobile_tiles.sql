@@ -0,0 +1,123 @@
+-- Generalized measurements of the mobile locations for the v3 mobile
+-- tile endpoints, one set per zoom tier so that a tile reads the cells
+-- of its tier instead of the raw measurements.
+--
+-- Each tier snaps the points to a grid of 1/256 of a tile at that zoom,
+-- so a tile holds at most 256 x 256 cells per location and parameter no
+-- matter how many measurements fall within it. The tiers have to match
+-- API_MOBILE_TILE_ZOOMS, a tile uses the deepest tier at or above its
+-- zoom. Refresh on the same schedule as the other cached views.
+
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mobile_points_generalized AS
+WITH tiers AS (
+    SELECT zoom
+    , 2 * 20037508.342789244 / 2 ^ zoom AS tile_size
+    FROM unnest(ARRAY[0, 2, 4, 6, 8, 10, 12, 14, 16]) AS zoom
+), points AS (
+    SELECT sn.sensor_nodes_id
+    , s.measurands_id
+    , m.datetime
+    , m.value
+    , ST_Transform(ST_SetSRID(ST_MakePoint(m.lon, m.lat), 4326), 3857) AS geom3857
+    FROM measurements m
+    JOIN sensors s ON (s.sensors_id = m.sensors_id)
+    JOIN sensor_systems ss ON (ss.sensor_systems_id = s.sensor_systems_id)
+    JOIN sensor_nodes sn ON (sn.sensor_nodes_id = ss.sensor_nodes_id)
+    WHERE sn.ismobile
+    AND m.lon IS NOT NULL
+    AND m.lat IS NOT NULL
+)
+SELECT tiers.zoom
+, points.sensor_nodes_id
+, points.measurands_id
+, ST_SnapToGrid(points.geom3857, tiers.tile_size / 256) AS geom3857
+, count(*) AS count
+, avg(points.value) AS value
+, min(points.datetime) AS datetime_first
+, max(points.datetime) AS datetime_last
+FROM points
+CROSS JOIN tiers
+GROUP BY 1, 2, 3, 4;
+
+CREATE INDEX IF NOT EXISTS mobile_points_generalized_zoom_geom3857_idx
+ON mobile_points_generalized USING GIST (zoom, geom3857);
+
+-- The path of each location through the cells of a tier, in the order
+-- they were first visited, cut into one line for each run of cells
+-- within a tier tile so a tile only clips the lines near it. Each run
+-- starts from the last cell before it, so the step from one tier tile
+-- into the next is drawn and the path has no gaps at tile borders.
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mobile_paths_generalized AS
+WITH cells AS (
+    SELECT zoom
+    , sensor_nodes_id
+    , geom3857
+    , floor(ST_X(geom3857) / (2 * 20037508.342789244 / 2 ^ zoom)) AS tile_x
+    , floor(ST_Y(geom3857) / (2 * 20037508.342789244 / 2 ^ zoom)) AS tile_y
+    , min(datetime_first) AS datetime_first
+    , max(datetime_last) AS datetime_last
+    , sum(count) AS count
+    FROM mobile_points_generalized
+    GROUP BY 1, 2, 3
+), steps AS (
+    SELECT cells.*
+    , row_number() OVER w AS n
+    , lag(geom3857) OVER w AS previous_geom3857
+    , (lag(tile_x) OVER w, lag(tile_y) OVER w)
+        IS DISTINCT FROM (tile_x, tile_y) AS entered
+    FROM cells
+    WINDOW w AS (PARTITION BY zoom, sensor_nodes_id ORDER BY datetime_first)
+), runs AS (
+    SELECT steps.*
+    , sum(entered::int) OVER (
+        PARTITION BY zoom, sensor_nodes_id ORDER BY n
+    ) AS run
+    FROM steps
+), points AS (
+    SELECT zoom, sensor_nodes_id, run, 2 * n AS position, geom3857
+    , datetime_first, datetime_last, count
+    FROM runs
+    UNION ALL
+    -- the cell the run was entered from, only for its position
+    SELECT zoom, sensor_nodes_id, run, 2 * n - 1, previous_geom3857
+    , NULL, NULL, 0
+    FROM runs
+    WHERE entered AND previous_geom3857 IS NOT NULL
+)
+SELECT zoom
+, sensor_nodes_id
+, ST_MakeLine(geom3857 ORDER BY position) AS geom3857
+, min(datetime_first) AS datetime_first
+, max(datetime_last) AS datetime_last
+, sum(count) AS count
+FROM points
+GROUP BY zoom
+, sensor_nodes_id
+, run
+HAVING count(*) > 1;
+
+CREATE INDEX IF NOT EXISTS mobile_paths_generalized_zoom_geom3857_idx
+ON mobile_paths_generalized USING GIST (zoom, geom3857);
+
+-- The extent of each mobile location, used to find the locations in a
+-- tile before reading any of their cells.
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mobile_bounds AS
+SELECT sensor_nodes_id
+, ST_SetSRID(ST_Extent(geom3857)::geometry, 3857) AS box3857
+FROM mobile_points_generalized
+WHERE zoom = 16
+GROUP BY 1;
+
+CREATE UNIQUE INDEX IF NOT EXISTS mobile_bounds_sensor_nodes_id_idx
+ON mobile_bounds (sensor_nodes_id);
+
+CREATE INDEX IF NOT EXISTS mobile_bounds_box3857_idx
+ON mobile_bounds USING GIST (box3857);
+
+-- REFRESH MATERIALIZED VIEW mobile_points_generalized;
+-- REFRESH MATERIALIZED VIEW mobile_paths_generalized;
+-- REFRESH MATERIALIZED VIEW CONCURRENTLY mobile_bounds;
@@ -0,0 +1,23 @@
+-- Location geometries in web mercator for the v3 tile queries so that
+-- tiles are pruned on a GiST index instead of transforming every point.
+-- Set API_TILE_GEOM_CACHED=true once this exists, and refresh it along
+-- with locations_view_cached.
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS locations_geom3857_cached AS
+SELECT id
+, ST_Transform(geom, 3857) AS geom3857
+FROM locations_view_cached
+WHERE geom IS NOT NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS locations_geom3857_cached_id_idx
+ON locations_geom3857_cached (id);
+
+CREATE INDEX IF NOT EXISTS locations_geom3857_cached_geom3857_idx
+ON locations_geom3857_cached USING GIST (geom3857);
+
+-- the fallback prunes on the 4326 geometry
+CREATE INDEX IF NOT EXISTS locations_view_cached_geom_idx
+ON locations_view_cached USING GIST (geom);
+
+-- after refreshing locations_view_cached
+-- REFRESH MATERIALIZED VIEW CONCURRENTLY locations_geom3857_cached;
@@ -0,0 +1,149 @@
+import re
+from collections import OrderedDict
+from typing import Any, Dict, List
+
+import asyncpg
+
+from openaq_fastapi.cache import cache_key, current_endpoint
+
+# quoted strings and identifiers are kept as is, comments are dropped
+# and any run of whitespace becomes a single space
+_tokens = re.compile(r"('(?:[^']|'')*')|(\"(?:[^\"]|\"\")*\")|((?:\s|--[^\n]*)+)")
+
+
+def normalize(sql: str) -> str:
+    """
+    reduces rendered sql to its shape so that queries built from the
+    same template with different whitespace or comments from the
+    f-string fragments end up with the same text
+    """
+
+    def replace(match):
+        if match.group(3) is not None:
+            return " "
+        return match.group(0)
+
+    return _tokens.sub(replace, sql).strip()
+
+
+class ShapeRegistry:
+    """
+    Counts calls per normalized query shape and how many of them were
+    served from an already prepared statement. Only the max_shapes most
+    recently called shapes are kept.
+    """
+
+    def __init__(self, max_shapes: int = 1000):
+        self.shapes: OrderedDict = OrderedDict()
+        self.max_shapes = max_shapes
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, sql: str, hit: bool):
+        key = cache_key(sql, prefix="shape")
+        shape = self.shapes.get(key)
+        if shape is None:
+            shape = self.shapes[key] = {
+                "sql": sql,
+                "endpoint": current_endpoint.get(),
+                "calls": 0,
+                "hits": 0,
+            }
+            while len(self.shapes) > self.max_shapes:
+                self.shapes.popitem(last=False)
+        else:
+            self.shapes.move_to_end(key)
+        shape["calls"] += 1
+        if hit:
+            shape["hits"] += 1
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def top(self, n: int = 10) -> List[Dict[str, Any]]:
+        """the most called shapes, most called first"""
+        return sorted(self.shapes.values(), key=lambda s: s["calls"], reverse=True)[:n]
+
+    def stats(self, n: int = 10) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "shapes": len(self.shapes),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0,
+            "top": [
+                {
+                    "endpoint": s["endpoint"],
+                    "calls": s["calls"],
+                    "hit_ratio": s["hits"] / s["calls"],
+                    "sql": s["sql"][:200],
+                }
+                for s in self.top(n)
+            ],
+        }
+
+
+registry = ShapeRegistry()
+
+
+class StatementConnection(asyncpg.Connection):
+    """
+    asyncpg connection that keeps an LRU of prepared statements keyed on
+    the normalized sql. asyncpg's own statement cache only helps when the
+    text is byte identical, which our rendered queries rarely are.
+    """
+
+    __slots__ = ("_prepared", "_max_prepared")
+
+    # set from settings when the pool is created
+    max_prepared = 100
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._prepared: OrderedDict = OrderedDict()
+        self._max_prepared = self.max_prepared
+
+    async def fetch_prepared(self, sql: str, *args, timeout=None):
+        sql = normalize(sql)
+        if self._max_prepared <= 0:
+            registry.record(sql, False)
+            return await self.fetch(sql, *args, timeout=timeout)
+        statement = self._prepared.get(sql)
+        registry.record(sql, statement is not None)
+        try:
+            return await self._fetch_statement(statement, sql, args, timeout)
+        except asyncpg.exceptions.InvalidCachedStatementError:
+            # the result type changed since it was prepared, e.g. a view
+            # was recreated. Prepare it again and retry once, the way
+            # asyncpg does for its own cache
+            self._prepared.pop(sql, None)
+            if self.is_in_transaction():
+                raise
+        except asyncpg.exceptions.OutdatedSchemaCacheError:
+            # asyncpg has reloaded the types already and any of our
+            # statements could be using the outdated ones
+            self.clear_prepared()
+            if self.is_in_transaction():
+                raise
+        return await self._fetch_statement(None, sql, args, timeout)
+
+    async def _fetch_statement(self, statement, sql: str, args, timeout):
+        if statement is None:
+            statement = await self.prepare(sql, timeout=timeout)
+            self._prepared[sql] = statement
+            while len(self._prepared) > self._max_prepared:
+                # asyncpg closes the server side statement once
+                # it is garbage collected
+                self._prepared.popitem(last=False)
+        else:
+            self._prepared.move_to_end(sql)
+        return await statement.fetch(*args, timeout=timeout)
+
+    async def prepare_shapes(self, sqls: List[str]):
+        """prepares already normalized sql ahead of the first request"""
+        for sql in sqls[: self._max_prepared]:
+            if sql not in self._prepared:
+                self._prepared[sql] = await self.prepare(sql)
+
+    def clear_prepared(self):
+        self._prepared.clear()
@@ -0,0 +1,112 @@
+"""
+Encoders that turn rows coming off a database cursor into response
+chunks, so large downloads are written out as they are read.
+"""
+import csv
+import io
+from decimal import Decimal
+from typing import Any, AsyncIterator, Callable, Container, List, Optional
+
+import orjson
+from starlette.responses import StreamingResponse
+
+from openaq_fastapi.counts import without_total
+from openaq_fastapi.db import page_meta
+
+# columns that only feed the meta
+page_columns = ("found", "cursor_datetime", "cursor_sensors_id")
+
+
+def default(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError
+
+
+async def ndjson(
+    rows: AsyncIterator,
+    exclude: Container[str] = (),
+    chunk_size: int = 500,
+    transform: Optional[Callable[[dict], dict]] = None,
+    trailer: Optional[Callable[[Any, Any, int], dict]] = None,
+) -> AsyncIterator[bytes]:
+    """
+    one json object per line, chunk_size lines per chunk. trailer is
+    called with the first row, the last row and the number of rows and
+    its result is written as the last line
+    """
+    lines = []
+    first = last = None
+    count = 0
+    async for row in rows:
+        if first is None:
+            first = row
+        last = row
+        count += 1
+        record = {k: v for k, v in row.items() if k not in exclude}
+        if transform is not None:
+            record = transform(record)
+        lines.append(
+            orjson.dumps(record, default=default, option=orjson.OPT_APPEND_NEWLINE)
+        )
+        if len(lines) >= chunk_size:
+            yield b"".join(lines)
+            lines = []
+    if trailer is not None:
+        lines.append(
+            orjson.dumps(
+                trailer(first, last, count),
+                default=default,
+                option=orjson.OPT_APPEND_NEWLINE,
+            )
+        )
+    if lines:
+        yield b"".join(lines)
+
+
+def ndjson_page(
+    db,
+    sql: str,
+    kwargs: dict,
+    transform: Optional[Callable[[dict], dict]] = None,
+) -> StreamingResponse:
+    """
+    a page of the results of sql as ndjson, with the meta that would
+    otherwise wrap the results as a {"meta": ...} trailer. The window
+    count is dropped, it would make postgres build the whole result
+    before the first row is sent.
+    """
+
+    def trailer(first, last, count):
+        return {"meta": page_meta(kwargs, first, last, count).dict()}
+
+    rows = db.iterate(without_total(sql) or sql, kwargs)
+    return StreamingResponse(
+        ndjson(rows, exclude=page_columns, transform=transform, trailer=trailer),
+        media_type="application/x-ndjson",
+    )
+
+
+async def csv_chunks(
+    rows: AsyncIterator,
+    header: List[str],
+    row: Callable[[Any], List[Any]],
+    chunk_size: int = 500,
+) -> AsyncIterator[bytes]:
+    """
+    the header and then one line per row, as built by row(), only
+    chunk_size lines are held before they are written out
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    lines = 0
+    async for r in rows:
+        writer.writerow(row(r))
+        lines += 1
+        if lines >= chunk_size:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+            lines = 0
+    yield buffer.getvalue().encode()
@@ -0,0 +1,454 @@
+"""
+Cache of rendered vector tiles, keyed on the tile and its normalized
+filters and stored gzipped along with an ETag so that clients holding a
+current copy get a 304 without the tile being rendered.
+
+Endpoints that can cheaply tell how fresh the data in a tile is (e.g.
+the latest update of its sensors) pass a version, the ETag is derived
+from it and a client revalidating a tile that has not changed gets a
+304 without ``ST_AsMVT`` running, even when the tile is not cached.
+
+Tiles are kept in a bounded in-process LRU in front of an optional
+shared store, a directory or an S3 prefix set with
+``API_TILE_CACHE_STORE`` (``file:///tmp/tiles`` or
+``s3://bucket/prefix``). The low zooms of the shared store can be
+seeded ahead of time, e.g. on a schedule
+
+    python -m openaq_fastapi.tilecache --max-zoom 6 --parameters-id 2
+"""
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Union
+from urllib.parse import urlparse
+
+import buildpg
+from fastapi import Request, Response
+
+from openaq_fastapi.cache import LRUStore, SingleFlight, cache_key
+from openaq_fastapi.settings import settings
+
+logger = logging.getLogger("tilecache")
+
+media_type = "application/x-protobuf"
+
+
+class CachedTile(NamedTuple):
+    """gzipped tile, empty for tiles without data"""
+
+    etag: str
+    body: bytes
+    stored_at: float
+
+    @classmethod
+    def from_body(cls, body: bytes, stored_at: Optional[float] = None) -> "CachedTile":
+        etag = hashlib.blake2b(body, digest_size=12).hexdigest()
+        return cls(f'"{etag}"', body, stored_at or time.time())
+
+    @classmethod
+    def rendered(cls, vt: Optional[bytes], etag: Optional[str] = None) -> "CachedTile":
+        tile = cls.from_body(gzip.compress(vt) if vt else b"")
+        return tile._replace(etag=etag) if etag else tile
+
+
+def normalize(params: Dict[str, Any]) -> str:
+    """filters as a string that is the same for equivalent requests"""
+    normalized = {}
+    for name, value in params.items():
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple, set)):
+            value = sorted(value, key=str)
+        normalized[name] = value
+    return json.dumps(normalized, sort_keys=True, default=str)
+
+
+def tile_key(name: str, params: Dict[str, Any]) -> str:
+    return cache_key(name, normalize(params), prefix="openaq:tile")
+
+
+def version_etag(key: str, version: Any) -> str:
+    etag = hashlib.blake2b(f"{key}:{version}".encode(), digest_size=12).hexdigest()
+    return f'"{etag}"'
+
+
+class DiskTileStore:
+    """tiles as files in a directory, written atomically"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key.replace(":", "_"))
+
+    def _get(self, key: str) -> Optional[CachedTile]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                body = f.read()
+            tile = CachedTile.from_body(body, os.path.getmtime(path))
+        except FileNotFoundError:
+            return None
+        try:
+            with open(f"{path}.etag") as f:
+                return tile._replace(etag=f.read())
+        except FileNotFoundError:
+            return tile
+
+    def _write(self, path: str, data: bytes):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _set(self, key: str, tile: CachedTile):
+        path = self._path(key)
+        # the etag first so that a reader never pairs a new etag with
+        # an old body, only the other way around which just re-renders
+        self._write(f"{path}.etag", tile.etag.encode())
+        self._write(path, tile.body)
+
+    async def get(self, key: str) -> Optional[CachedTile]:
+        return await asyncio.get_running_loop().run_in_executor(None, self._get, key)
+
+    async def set(self, key: str, tile: CachedTile):
+        await asyncio.get_running_loop().run_in_executor(None, self._set, key, tile)
+
+
+class S3TileStore:
+    """tiles as objects under an S3 prefix"""
+
+    def __init__(self, bucket: str, prefix: str = ""):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self._client = None
+
+    @property
+    def client(self):
+        # created lazily so processes without a store never import boto3
+        if self._client is None:
+            import boto3
+
+            self._client = boto3.client("s3")
+        return self._client
+
+    def _key(self, key: str) -> str:
+        key = key.replace(":", "/")
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def _get(self, key: str) -> Optional[CachedTile]:
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=self._key(key))
+        except self.client.exceptions.NoSuchKey:
+            return None
+        tile = CachedTile.from_body(obj["Body"].read(), obj["LastModified"].timestamp())
+        etag = obj.get("Metadata", {}).get("etag")
+        return tile._replace(etag=etag) if etag else tile
+
+    def _set(self, key: str, tile: CachedTile):
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self._key(key),
+            Body=tile.body,
+            ContentType=media_type,
+            ContentEncoding="gzip",
+            Metadata={"etag": tile.etag},
+        )
+
+    async def get(self, key: str) -> Optional[CachedTile]:
+        return await asyncio.get_running_loop().run_in_executor(None, self._get, key)
+
+    async def set(self, key: str, tile: CachedTile):
+        await asyncio.get_running_loop().run_in_executor(None, self._set, key, tile)
+
+
+Store = Union[DiskTileStore, S3TileStore]
+
+
+def store_from_url(url: Optional[str]) -> Optional[Store]:
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if parsed.scheme == "s3":
+        return S3TileStore(parsed.netloc, parsed.path)
+    if parsed.scheme in ("", "file"):
+        return DiskTileStore(parsed.path)
+    raise ValueError(f"unsupported tile store {url}")
+
+
+class TileCache:
+    """
+    :param max_bytes: byte budget for the in-process tier
+    :param ttl: seconds a tile is served from the in-process tier
+    :param store: optional shared store
+    :param store_ttl: seconds a tile is served from the shared store
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        ttl: int,
+        store: Optional[Store] = None,
+        store_ttl: int = 3600,
+    ):
+        self.local = LRUStore(max_bytes)
+        self.ttl = ttl
+        self.store = store
+        self.store_ttl = store_ttl
+        self.flight = SingleFlight()
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.store_errors = 0
+
+    async def _from_store(
+        self, key: str, etag: Optional[str] = None
+    ) -> Optional[CachedTile]:
+        if self.store is None:
+            return None
+        try:
+            tile = await self.store.get(key)
+        except Exception as e:
+            self.store_errors += 1
+            logger.warning(f"tile store get failed: {e}")
+            return None
+        if tile is None or tile.stored_at + self.store_ttl < time.time():
+            return None
+        if etag is not None and tile.etag != etag:
+            # rendered from an older version of the data
+            return None
+        return tile
+
+    async def put(self, key: str, tile: CachedTile, shared: bool = True):
+        self.local.set(key, tile, self.ttl, "tiles")
+        if shared and self.store is not None:
+            try:
+                await self.store.set(key, tile)
+            except Exception as e:
+                self.store_errors += 1
+                logger.warning(f"tile store set failed: {e}")
+
+    async def render(
+        self,
+        key: str,
+        render: Callable[[], Awaitable[Optional[bytes]]],
+        etag: Optional[str] = None,
+    ) -> CachedTile:
+        tile = CachedTile.rendered(await render(), etag)
+        await self.put(key, tile)
+        return tile
+
+    async def fetch(
+        self,
+        key: str,
+        render: Callable[[], Awaitable[Optional[bytes]]],
+        etag: Optional[str] = None,
+    ) -> CachedTile:
+        """
+        the tile for key, when etag is given a stored tile with another
+        etag is rendered again and the new one is stored under etag
+        """
+        tile = self.local.get(key)
+        if tile is not None and (etag is None or tile.etag == etag):
+            self.hits += 1
+            return tile
+
+        async def load() -> CachedTile:
+            tile = await self._from_store(key, etag)
+            if tile is not None:
+                self.store_hits += 1
+                await self.put(key, tile, shared=False)
+                return tile
+            self.misses += 1
+            return await self.render(key, render, etag)
+
+        # concurrent requests for the same tile render it once
+        return await self.flight.do(key, load)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self.local),
+            "bytes": self.local.bytes,
+            "max_bytes": self.local.max_bytes,
+            "hits": self.hits,
+            "store_hits": self.store_hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "store_errors": self.store_errors,
+            "store": type(self.store).__name__ if self.store is not None else None,
+        }
+
+
+tile_cache = TileCache(
+    settings.API_TILE_CACHE_MAX_BYTES,
+    settings.API_TILE_CACHE_TTL,
+    store_from_url(settings.API_TILE_CACHE_STORE),
+    settings.API_TILE_CACHE_STORE_TTL,
+)
+
+
+def not_modified(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [t.strip().removeprefix("W/") for t in header.split(",")]
+    return "*" in tags or etag in tags
+
+
+def tile_headers(etag: str) -> Dict[str, str]:
+    return {"etag": etag, "vary": "accept-encoding"}
+
+
+def tile_response(request: Request, tile: CachedTile) -> Response:
+    headers = tile_headers(tile.etag)
+    if not_modified(request, tile.etag):
+        return Response(status_code=304, headers=headers)
+    if not tile.body:
+        return Response(status_code=204, headers=headers)
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        headers["content-encoding"] = "gzip"
+        content = tile.body
+    else:
+        content = gzip.decompress(tile.body)
+    return Response(content=content, media_type=media_type, headers=headers)
+
+
+async def cached_tile(
+    request: Request,
+    name: str,
+    params: Dict[str, Any],
+    render: Callable[[], Awaitable[Optional[bytes]]],
+    version: Optional[Callable[[], Awaitable[Any]]] = None,
+) -> Response:
+    """
+    the tile for params from the cache, rendering it on a miss.
+
+    :param version: returns a value that changes whenever the data in
+        the tile does, checked before rendering so that a matching
+        If-None-Match gets a 304 without the tile being rendered
+    """
+    key = tile_key(name, params)
+    if version is None:
+        if not settings.API_TILE_CACHE:
+            return tile_response(request, CachedTile.rendered(await render()))
+        return tile_response(request, await tile_cache.fetch(key, render))
+
+    if settings.API_TILE_CACHE:
+        # the in-process copy is current until its ttl runs out
+        tile = tile_cache.local.get(key)
+        if tile is not None:
+            tile_cache.hits += 1
+            return tile_response(request, tile)
+    etag = version_etag(key, await version())
+    if not_modified(request, etag):
+        tile_cache.not_modified += 1
+        return Response(status_code=304, headers=tile_headers(etag))
+    if not settings.API_TILE_CACHE:
+        return tile_response(request, CachedTile.rendered(await render(), etag))
+    return tile_response(request, await tile_cache.fetch(key, render, etag))
+
+
+class PoolDB:
+    """the part of DB that the tile queries use, over a plain pool"""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def fetchval(self, query, kwargs):
+        rquery, args = buildpg.render(query, **kwargs)
+        async with self.pool.acquire() as con:
+            return await con.fetchval(rquery, *args)
+
+
+def tiles(max_zoom: int, min_zoom: int = 0):
+    for z in range(min_zoom, max_zoom + 1):
+        for x in range(2**z):
+            for y in range(2**z):
+                yield z, x, y
+
+
+async def seed(
+    max_zoom: int,
+    parameters_ids: List[int],
+    min_zoom: int = 0,
+    concurrency: int = 4,
+) -> int:
+    """
+    renders the v3 location tiles for each parameters_id into the
+    shared store, returns the number of tiles written
+    """
+    from openaq_fastapi.db import db_pool
+    from openaq_fastapi.v3.models.queries import QueryBuilder
+    from openaq_fastapi.v3.routers.tiles import Tile, fetch_tile_version, fetch_tiles
+
+    if tile_cache.store is None:
+        raise ValueError("API_TILE_CACHE_STORE has to be set to seed tiles")
+    pool = await db_pool(None)
+    db = PoolDB(pool)
+    semaphore = asyncio.Semaphore(concurrency)
+    start = time.time()
+
+    async def seed_tile(z: int, x: int, y: int, parameters_id: int):
+        tile = Tile(z=z, x=x, y=y, parameters_id=[str(parameters_id)])
+        key = tile_key("v3_locations", QueryBuilder(tile).params())
+        async with semaphore:
+            etag = version_etag(key, await fetch_tile_version(tile, db))
+            await tile_cache.render(key, lambda: fetch_tiles(tile, db), etag)
+
+    try:
+        jobs = [
+            seed_tile(z, x, y, parameters_id)
+            for parameters_id in parameters_ids
+            for z, x, y in tiles(max_zoom, min_zoom)
+        ]
+        await asyncio.gather(*jobs)
+    finally:
+        await pool.close()
+    logger.info(f"seeded {len(jobs)} tiles in {time.time() - start:.1f}s")
+    return len(jobs)
+
+
+def seed_handler(event, context):
+    """lambda handler for seeding on a schedule"""
+    event = event or {}
+    count = asyncio.get_event_loop().run_until_complete(
+        seed(
+            event.get("max_zoom", settings.API_TILE_SEED_MAX_ZOOM),
+            event.get("parameters_ids", settings.API_TILE_SEED_PARAMETERS),
+        )
+    )
+    return {"tiles": count}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="seeds the shared tile store")
+    parser.add_argument("--min-zoom", type=int, default=0)
+    parser.add_argument("--max-zoom", type=int, default=settings.API_TILE_SEED_MAX_ZOOM)
+    parser.add_argument(
+        "--parameters-id",
+        type=int,
+        action="append",
+        help="can be repeated, defaults to API_TILE_SEED_PARAMETERS",
+    )
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(
+        seed(
+            args.max_zoom,
+            args.parameters_id or settings.API_TILE_SEED_PARAMETERS,
+            args.min_zoom,
+            args.concurrency,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
+import functools
 import inspect
 import logging
-from types import FunctionType, GenericAlias
+from types import GenericAlias
 from enum import Enum
 from typing import (
     Dict,
@@ -18,6 +19,9 @@ from pydantic import BaseModel, conint, confloat, root_validator
 from inspect import signature
 from fastapi.exceptions import ValidationError, HTTPException
 
+from openaq_fastapi.cursors import decode_cursor
+from openaq_fastapi.dependencies import dependency_from_model
+
 logger = logging.getLogger("queries")
 
 maxint = 2147483647
@@ -28,6 +32,9 @@ ignore_in_docs = [
     "measurand",
     "lat",
     "lon",
+    "cursor_datetime",
+    "cursor_sensors_id",
+    "spatial_ids",
 ]
 
 
@@ -36,7 +43,7 @@ def parameter_dependency_from_model(name: str, model_cls):
     Takes a pydantic model class as input and creates
     a dependency with corresponding
     Query parameter definitions that can be used for GET
-    requests.
+    requests. The dependency is built once per model class.
 
     This will only work, if the fields defined in the
     input model can be turned into
@@ -47,41 +54,7 @@ def parameter_dependency_from_model(name: str, model_cls):
         name: Name for the dependency function.
         model_cls: A ``BaseModel`` inheriting model class as input.
     """
-    names = []
-    annotations: Dict[str, type] = {}
-    defaults = []
-    for field_model in model_cls.__fields__.values():
-        if field_model.name not in ["self"]:
-            field_info = field_model.field_info
-
-            if field_model.name not in ignore_in_docs:
-                names.append(field_model.name)
-                annotations[field_model.name] = field_model.outer_type_
-                defaults.append(
-                    Query(field_model.default, description=field_info.description)
-                )
-
-    code = inspect.cleandoc(
-        """
-    def %s(%s):
-        return %s(%s)
-    """
-        % (
-            name,
-            ", ".join(names),
-            model_cls.__name__,
-            ", ".join(["%s=%s" % (name, name) for name in names]),
-        )
-    )
-
-    compiled = compile(code, "string", "exec")
-    env = {model_cls.__name__: model_cls}
-    env.update(**globals())
-    func = FunctionType(compiled.co_consts[0], env, name)
-    func.__annotations__ = annotations
-    func.__defaults__ = (*defaults,)
-
-    return func
+    return dependency_from_model(name, model_cls, tuple(ignore_in_docs))
 
 
 class TypeParametersMemoizer(type):
@@ -157,6 +130,28 @@ def make_dependable(cls):
     return init_cls_and_handle_errors
 
 
+# compiled sql fragments keyed on (model class, field signature, method)
+_plans: Dict[tuple, str] = {}
+_max_plans = 4096
+
+
+def _signature(query) -> frozenset:
+    """
+    the set fields of a query along with their types, which is all the
+    where/fields/pagination methods are allowed to depend on. Date
+    clauses differ for naive and aware datetimes so that is included too
+    """
+    signature = []
+    for name, value in query.__dict__.items():
+        if value is None:
+            continue
+        if isinstance(value, datetime):
+            signature.append((name, datetime, value.tzinfo is not None))
+        else:
+            signature.append((name, type(value)))
+    return frozenset(signature)
+
+
 class QueryBuilder(object):
     def __init__(self, query):
         """
@@ -166,10 +161,28 @@ class QueryBuilder(object):
         self.query = query
 
     def _bases(self) -> List[type]:
-        bases = list(inspect.getmro(self.query.__class__))[
-            :-4
-        ]  # removes object primitives
-        return bases
+        return _bases(self.query.__class__)
+
+    def _compile(self, method: str) -> List[str]:
+        """
+        calls each ancestor's own implementation of method, base classes
+        first, keeping the first occurrence of each sql fragment so that
+        the output is the same for every request with the same fields
+        """
+        key = (self.query.__class__, _signature(self.query), method)
+        fragments = _plans.get(key)
+        if fragments is None:
+            fragments = []
+            for base in self._bases():
+                func = base.__dict__.get(method)
+                if callable(func):
+                    fragment = func(self.query)
+                    if fragment and fragment not in fragments:
+                        fragments.append(fragment)
+            if len(_plans) >= _max_plans:
+                _plans.clear()
+            _plans[key] = fragments
+        return fragments
 
     def fields(self) -> str:
         """
@@ -177,27 +190,15 @@ class QueryBuilder(object):
         their respective fields() methods to concatenate
         into additional fields for select
         """
-        fields = []
-        bases = self._bases()
-        for base in bases:
-            if callable(getattr(base, "fields", None)):
-                if base.fields(self.query):
-                    fields.append(base.fields(self.query))
+        fields = self._compile("fields")
         if len(fields):
-            fields = list(set(fields))
             return "\n," + ("\n,").join(fields)
         else:
             return ""
 
     def pagination(self) -> str:
-        pagination = []
-        bases = self._bases()
-        for base in bases:
-            if callable(getattr(base, "pagination", None)):
-                if base.pagination(self.query):
-                    pagination.append(base.pagination(self.query))
+        pagination = self._compile("pagination")
         if len(pagination):
-            pagination = list(set(pagination))
             return "\n" + ("\n,").join(pagination)
         else:
             return ""
@@ -215,19 +216,19 @@ class QueryBuilder(object):
         their respective where() methods to concatenate
         into a full where statement
         """
-        where = []
-        bases = self._bases()
-        for base in bases:
-            if callable(getattr(base, "where", None)):
-                if base.where(self.query):
-                    where.append(base.where(self.query))
+        where = self._compile("where")
         if len(where):
-            where = list(set(where))
             return "WHERE " + ("\nAND ").join(where)
         else:
             return ""
 
 
+@functools.lru_cache(maxsize=None)
+def _bases(cls: type) -> List[type]:
+    # removes object primitives and puts the base classes first
+    return list(reversed(inspect.getmro(cls)[:-4]))
+
+
 class QueryBaseModel(BaseModel):
     """
     # Using this to catch valididation errors that should be 422s
@@ -292,6 +293,36 @@ class Paging(BaseModel):
         return "LIMIT :limit OFFSET :offset"
 
 
+class CursorQuery(QueryBaseModel):
+    """
+    keyset pagination over (datetime, sensors_id), the query has to
+    order by those columns and select them as cursor_datetime and
+    cursor_sensors_id for the next cursor to be returned in the meta
+    """
+
+    cursor: Union[str, None] = Query(
+        None,
+        description="Continue from the end of a previous page by passing the cursor from its meta, with the same filters. Cannot be combined with page",
+    )
+    cursor_datetime: Union[datetime, None] = None
+    cursor_sensors_id: Union[int, None] = None
+
+    @root_validator(pre=True)
+    def addcursor(cls, values):
+        cursor = values.get("cursor", None)
+        if cursor is not None:
+            if str(values.get("page", 1)) != "1":
+                raise ValueError("Cannot pass both a cursor and a page")
+            dt, sensors_id = decode_cursor(cursor)
+            values["cursor_datetime"] = dt
+            values["cursor_sensors_id"] = sensors_id
+        return values
+
+    def where(self) -> Union[str, None]:
+        if self.has("cursor"):
+            return "(h.datetime, h.sensors_id) > (:cursor_datetime, :cursor_sensors_id)"
+
+
 class ParametersQuery(QueryBaseModel):
     parameters_id: Union[CommaSeparatedList[int], None] = Query(description="")
 
@@ -420,7 +451,16 @@ class PeriodNameQuery(QueryBaseModel):
 
 
 # Some spatial helper queries
-class RadiusQuery(QueryBaseModel):
+class SpatialIdsQuery(QueryBaseModel):
+    # candidate location ids from the spatial index, set by the router
+    spatial_ids: Union[List[int], None] = None
+
+    def where(self) -> Union[str, None]:
+        if self.spatial_ids is not None:
+            return "id = ANY(:spatial_ids)"
+
+
+class RadiusQuery(SpatialIdsQuery):
     coordinates: Union[str, None] = Query(
         None,
         regex=r"^(-)?(?:90(?:\.0{1,4})?|((?:|[1-8])[0-9])(?:\.[0-9]{1,4})?)\,(-)?(?:180(?:\.0{1,4})?|((?:|[1-9]|1[0-7])[0-9])(?:\.[0-9]{1,4})?)$",
@@ -470,7 +510,7 @@ class RadiusQuery(QueryBaseModel):
         return None
 
 
-class BboxQuery(QueryBaseModel):
+class BboxQuery(SpatialIdsQuery):
     bbox: Union[str, None] = Query(
         None,
         regex=r"^(-)?(?:180(?:\.0{1,4})?|((?:|[1-9]|1[0-7])[0-9])(?:\.[0-9]{1,4})?)\,(-)?(?:90(?:\.0{1,4})?|((?:|[1-8])[0-9])(?:\.[0-9]{1,4})?)\,(-)?(?:180(?:\.0{1,4})?|((?:|[1-9]|1[0-7])[0-9])(?:\.[0-9]{1,4})?)\,(-)?(?:90(?:\.0{1,4})?|((?:|[1-8])[0-9])(?:\.[0-9]{1,4})?)$",
@@ -19,6 +19,10 @@ class Meta(JsonBase):
     found: Union[int, str, None]
 
 
+class CursorMeta(Meta):
+    cursor: Union[str, None]
+
+
 class OpenAQResult(JsonBase):
     meta: Meta = Meta()
     results: List[Any] = []
@@ -235,6 +239,7 @@ class LocationsResponse(OpenAQResult):
 
 
 class MeasurementsResponse(OpenAQResult):
+    meta: CursorMeta = CursorMeta()
     results: List[Measurement]
 
 
@@ -3,6 +3,7 @@ from typing import List, Union
 from fastapi import APIRouter, Depends, Path, Query
 from pydantic import root_validator
 from openaq_fastapi.db import DB
+from openaq_fastapi.snapshots import snapshots
 from openaq_fastapi.v3.models.responses import (
     CountriesResponse,
 )
@@ -37,6 +38,24 @@ class CountriesQueries(QueryBaseModel, Paging):
     ...
 
 
+countries_snapshot = snapshots.register(
+    "v3_countries",
+    """
+    SELECT id
+    , code
+    , name
+    , datetime_first
+    , datetime_last
+    , parameters
+    , locations_count
+    , measurements_count
+    , providers_count
+    FROM countries_view_cached
+    ORDER BY id
+    """,
+)
+
+
 @router.get(
     "/countries/{countries_id}",
     response_model=CountriesResponse,
@@ -47,6 +66,10 @@ async def country_get(
     country: CountryPathQuery = Depends(CountryPathQuery),
     db: DB = Depends(),
 ):
+    if await countries_snapshot.ensure(db):
+        return countries_snapshot.get(
+            QueryBuilder(country).params(), country.countries_id
+        )
     response = await fetch_countries(country, db)
     return response
 
@@ -61,6 +84,8 @@ async def countries_get(
     countries: CountriesQueries = Depends(CountriesQueries.depends()),
     db: DB = Depends(),
 ):
+    if await countries_snapshot.ensure(db):
+        return countries_snapshot.page(QueryBuilder(countries).params())
     response = await fetch_countries(countries, db)
     return response
 
@@ -1,6 +1,10 @@
 import logging
-from fastapi import APIRouter, Depends, Path
+from enum import Enum
+from fastapi import APIRouter, Depends, Path, Query
+from humps import camelize
 from openaq_fastapi.db import DB
+from openaq_fastapi.spatial import restrict
+from openaq_fastapi.streaming import ndjson_page
 from openaq_fastapi.v3.models.responses import LocationsResponse
 
 from openaq_fastapi.v3.models.queries import (
@@ -47,6 +51,11 @@ class LocationsQueries(
     ...
 
 
+class LocationsFormat(str, Enum):
+    json = "json"
+    ndjson = "ndjson"
+
+
 @router.get(
     "/locations/{locations_id}",
     response_model=LocationsResponse,
@@ -69,15 +78,31 @@ async def location_get(
 )
 async def locations_get(
     locations: LocationsQueries = Depends(LocationsQueries.depends()),
+    format: LocationsFormat = Query(
+        "json",
+        description="Response format. ndjson streams one location per line followed by the meta",
+    ),
     db: DB = Depends(),
 ):
+    await restrict(locations, db)
+    if format == LocationsFormat.ndjson:
+        query_builder = QueryBuilder(locations)
+        params = query_builder.params()
+        sql = locations_sql(query_builder)
+        return ndjson_page(db, sql, params, camelize)
     response = await fetch_locations(locations, db)
     return response
 
 
 async def fetch_locations(query, db):
     query_builder = QueryBuilder(query)
-    sql = f"""
+    sql = locations_sql(query_builder)
+    response = await db.fetchPage(sql, query_builder.params())
+    return response
+
+
+def locations_sql(query_builder: QueryBuilder) -> str:
+    return f"""
     SELECT id
     , name
     , ismobile as is_mobile
@@ -99,5 +124,3 @@ async def fetch_locations(query, db):
     {query_builder.where()}
     {query_builder.pagination()}
     """
-    response = await db.fetchPage(sql, query_builder.params())
-    return response
@@ -1,5 +1,10 @@
-from fastapi import APIRouter, Depends, Path
+from fastapi import APIRouter, Depends, HTTPException, Path
+from starlette.responses import StreamingResponse
+from enum import Enum
+from humps import camelize
+from openaq_fastapi import columnar
 from openaq_fastapi.db import DB
+from openaq_fastapi.streaming import ndjson, ndjson_page, page_columns
 from typing import List, Union
 from fastapi import Query
 from pydantic import Field
@@ -14,6 +19,7 @@ from openaq_fastapi.v3.models.queries import (
     QueryBaseModel,
     QueryBuilder,
     Paging,
+    CursorQuery,
     DateFromQuery,
     DateToQuery,
     PeriodNameQuery,
@@ -50,6 +56,34 @@ class LocationMeasurementsQueries(
     DateToQuery,
     MeasurementsParametersQuery,
     PeriodNameQuery,
+    CursorQuery,
+):
+    ...
+
+
+class MeasurementsFormat(str, Enum):
+    json = "json"
+    ndjson = "ndjson"
+    arrow = "arrow"
+    parquet = "parquet"
+
+
+measurements_columns = [
+    ("locations_id", "int32", lambda r: r["id"]),
+    ("sensors_id", "int32", lambda r: r["cursor_sensors_id"]),
+    ("parameters_id", "int32", lambda r: r["parameter"]["id"]),
+    ("parameter", "string", lambda r: r["parameter"]["name"]),
+    ("units", "string", lambda r: r["parameter"]["units"]),
+    ("datetime", "timestamp", lambda r: r["cursor_datetime"]),
+    ("value", "float64", lambda r: None if r["value"] is None else float(r["value"])),
+]
+
+
+class LocationMeasurementsExportQueries(
+    LocationPathQuery,
+    DateFromQuery,
+    DateToQuery,
+    MeasurementsParametersQuery,
 ):
     ...
 
@@ -64,20 +98,70 @@ async def measurements_get(
     measurements: LocationMeasurementsQueries = Depends(
         LocationMeasurementsQueries.depends()
     ),
+    format: MeasurementsFormat = Query(
+        "json",
+        description="Response format. ndjson streams one measurement per line followed by the meta, arrow (IPC stream) and parquet return hourly measurements as typed columns",
+    ),
     db: DB = Depends(),
 ):
+    if format in (MeasurementsFormat.arrow, MeasurementsFormat.parquet):
+        if measurements.period_name not in [None, "hour"]:
+            raise HTTPException(
+                status_code=422,
+                detail=f"{format.value} is only available for hourly measurements",
+            )
+        return columnar_response(format.value, measurements, db)
+    if format == MeasurementsFormat.ndjson:
+        query = QueryBuilder(measurements)
+        params = query.params()
+        sql = measurements_sql(measurements, query)
+        return ndjson_page(db, sql, params, camelize)
     response = await fetch_measurements(measurements, db)
     return response
 
 
-async def fetch_measurements(q, db):
+def columnar_response(format: str, q, db) -> StreamingResponse:
+    if not columnar.available():
+        raise HTTPException(
+            status_code=501, detail=f"{format} output is not available"
+        )
     query = QueryBuilder(q)
-    dur = "01:00:00"
-    expected_hours = 1
+    rows = db.iterate(hourly_sql(query), query.params())
+    return StreamingResponse(
+        columnar.stream(format, rows, measurements_columns),
+        media_type=columnar.media_types[format],
+        headers={
+            "Content-Disposition": f"attachment;filename=measurements.{format}"
+        },
+    )
 
-    if q.period_name in [None, "hour"]:
-        # Query for hourly data
-        sql = f"""
+
+@router.get(
+    "/locations/{locations_id}/measurements/export",
+    summary="Export hourly measurements by location",
+    description="Streams every hourly measurement for a location as newline delimited json, one measurement per line",
+)
+async def measurements_export(
+    measurements: LocationMeasurementsExportQueries = Depends(
+        LocationMeasurementsExportQueries.depends()
+    ),
+    db: DB = Depends(),
+):
+    query = QueryBuilder(measurements)
+    rows = db.iterate(hourly_sql(query), query.params())
+    return StreamingResponse(
+        ndjson(rows, exclude=page_columns),
+        media_type="application/x-ndjson",
+    )
+
+
+def hourly_sql(query: QueryBuilder) -> str:
+    """
+    hourly measurements in (datetime, sensors_id) order, which is also
+    the key for cursor pagination
+    """
+    expected_hours = 1
+    return f"""
         SELECT sn.id
         , json_build_object(
         'label', '1hour'
@@ -110,6 +194,8 @@ async def fetch_measurements(q, db):
           'datetime_from', get_datetime_object(h.first_datetime, sn.timezone)
         , 'datetime_to', get_datetime_object(h.last_datetime, sn.timezone)
         ) as coverage
+        , h.datetime as cursor_datetime
+        , h.sensors_id as cursor_sensors_id
         {query.fields()}
         FROM hourly_data h
         JOIN sensors s USING (sensors_id)
@@ -117,10 +203,29 @@ async def fetch_measurements(q, db):
         JOIN locations_view_cached sn ON (sy.sensor_nodes_id = sn.id)
         JOIN measurands m ON (m.measurands_id = h.measurands_id)
         {query.where()}
-        ORDER BY datetime
+        ORDER BY h.datetime, h.sensors_id
         {query.pagination()}
         """
+
+
+async def fetch_measurements(q, db):
+    query = QueryBuilder(q)
+    response = await db.fetchPage(measurements_sql(q, query), query.params())
+    return response
+
+
+def measurements_sql(q, query: QueryBuilder) -> str:
+    dur = "01:00:00"
+
+    if q.period_name in [None, "hour"]:
+        # Query for hourly data
+        sql = hourly_sql(query)
     else:
+        if q.has("cursor"):
+            raise HTTPException(
+                status_code=422,
+                detail="A cursor can only be used with hourly measurements",
+            )
         # Query for the aggregate data
         if q.period_name == "hour":
             dur = "01:00:00"
@@ -194,8 +299,7 @@ SELECT
  JOIN measurands m ON (t.measurands_id = m.measurands_id)
  {query.pagination()}
     """
-    response = await db.fetchPage(sql, query.params())
-    return response
+    return sql
 
 
 # Remove from here down once we update the v2/measurements endpoint
@@ -3,6 +3,7 @@ import logging
 from typing import Union
 from fastapi import APIRouter, Depends, Query, Path
 from openaq_fastapi.db import DB
+from openaq_fastapi.snapshots import snapshots
 from openaq_fastapi.v3.models.responses import ParametersResponse
 
 from openaq_fastapi.v3.models.queries import (
@@ -54,6 +55,26 @@ class ParametersQueries(
     ...
 
 
+parameters_snapshot = snapshots.register(
+    "v3_parameters",
+    """
+    SELECT id
+        , p.name
+        , p.display_name
+        , p.units
+        , p.description
+        , p.locations_count
+        , p.measurements_count
+        , m.parameter_type
+    FROM
+        parameters_view_cached p
+    JOIN
+        measurands m ON p.id = m.measurands_id
+    ORDER BY id
+    """,
+)
+
+
 @router.get(
     "/parameters/{parameters_id}",
     response_model=ParametersResponse,
@@ -64,6 +85,10 @@ async def parameter_get(
     parameter: ParameterPathQuery = Depends(ParameterPathQuery.depends()),
     db: DB = Depends(),
 ):
+    if await parameters_snapshot.ensure(db):
+        return parameters_snapshot.get(
+            QueryBuilder(parameter).params(), parameter.parameters_id
+        )
     response = await fetch_parameters(parameter, db)
     return response
 
@@ -78,6 +103,19 @@ async def parameters_get(
     parameter: ParametersQueries = Depends(ParametersQueries.depends()),
     db: DB = Depends(),
 ):
+    # the spatial and country filters need the database
+    spatial = any(
+        parameter.has(f) for f in ("countries_id", "iso", "bbox", "coordinates")
+    )
+    if not spatial and await parameters_snapshot.ensure(db):
+
+        def where(row):
+            return row["parameter_type"] == parameter.parameter_type
+
+        return parameters_snapshot.page(
+            QueryBuilder(parameter).params(),
+            where if parameter.has("parameter_type") else None,
+        )
     response = await fetch_parameters(parameter, db)
     return response
 
@@ -1,6 +1,7 @@
 import logging
 from fastapi import APIRouter, Depends, Query, Path
 from openaq_fastapi.db import DB
+from openaq_fastapi.snapshots import snapshots
 from openaq_fastapi.v3.models.queries import (
     QueryBuilder,
     QueryBaseModel,
@@ -34,6 +35,29 @@ class ProvidersQueries(QueryBaseModel, Paging):
     ...
 
 
+providers_snapshot = snapshots.register(
+    "v3_providers",
+    """
+    SELECT id
+    , name
+    , source_name
+    , export_prefix
+    , datetime_first
+    , datetime_last
+    , datetime_added
+    , measurements_count
+    , locations_count
+    , countries_count
+    , owner_entity
+    , parameters
+    , license
+    , st_asgeojson(extent)::json as bbox
+    FROM providers_view_cached
+    ORDER BY id
+    """,
+)
+
+
 class ProviderLocationPathQuery(QueryBaseModel):
     providers_id: int = Path(
         description="Limit the results to a specific country",
@@ -53,6 +77,10 @@ async def provider_get(
     provider: ProviderPathQuery = Depends(ProviderPathQuery.depends()),
     db: DB = Depends(),
 ):
+    if await providers_snapshot.ensure(db):
+        return providers_snapshot.get(
+            QueryBuilder(provider).params(), provider.providers_id
+        )
     response = await fetch_providers(provider, db)
     return response
 
@@ -67,6 +95,8 @@ async def providers_get(
     provider: ProvidersQueries = Depends(ProvidersQueries.depends()),
     db: DB = Depends(),
 ):
+    if await providers_snapshot.ensure(db):
+        return providers_snapshot.page(QueryBuilder(provider).params())
     response = await fetch_providers(provider, db)
     return response
 
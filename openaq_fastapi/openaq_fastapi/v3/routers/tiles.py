@@ -1,9 +1,11 @@
 import logging
 import urllib
 from typing import List, Union
-from fastapi import APIRouter, Depends, HTTPException, Query, Path, Request, Response
+from fastapi import APIRouter, Depends, Query, Path, Request, Response
 from pydantic import BaseModel, Field
 from openaq_fastapi.db import DB
+from openaq_fastapi.settings import settings
+from openaq_fastapi.tilecache import cached_tile
 
 from openaq_fastapi.v3.models.queries import (
     QueryBaseModel,
@@ -94,21 +96,20 @@ class MobileTile(TileBase):
     providers: Union[List[int], None] = Query(
         description="Limit the results to a specific provider by id"
     )
-    is_monitor: Union[List[int], None] = Query(
-        description="Limit the results to one or more sensor types"
+    is_monitor: Union[bool, None] = Query(
+        description="Limit the results to reference monitors or not"
     )
     is_active: Union[bool, None] = Query(
         description="Limit the results to locations active within the last 48 hours"
     )
 
     def where(self):
-        where = ["WHERE ismobile = false"]
-        where.append("measurands_id = :parameters_id")
-        if hasattr(self, "providers") and self.providers is not None:
+        where = ["parameters_id = :parameters_id"]
+        if self.has("providers"):
             where.append("providers_id = ANY(:providers)")
-        if hasattr(self, "is_monitor") and self.is_monitor is not None:
-            where.append("is_monitor = :is_monitor")
-        if hasattr(self, "is_active") and self.is_active is not None:
+        if self.has("is_monitor"):
+            where.append("ismonitor = :is_monitor")
+        if self.has("is_active"):
             where.append("active = :is_active")
         return ("\nAND ").join(where)
 
@@ -119,14 +120,17 @@ class MobileTile(TileBase):
     response_class=Response,
 )
 async def get_tile(
+    request: Request,
     db: DB = Depends(),
     tile: Tile = Depends(Tile.depends()),
 ):
-    vt = await fetch_tiles(tile, db)
-    if vt is None:
-        raise HTTPException(status_code=204, detail="no data found for this tile")
-
-    return Response(content=vt, status_code=200, media_type="application/x-protobuf")
+    return await cached_tile(
+        request,
+        "v3_locations",
+        QueryBuilder(tile).params(),
+        lambda: fetch_tiles(tile, db),
+        lambda: fetch_tile_version(tile, db),
+    )
 
 
 @router.get(
@@ -135,43 +139,78 @@ async def get_tile(
     response_class=Response,
 )
 async def get_threshold_tile(
+    request: Request,
     db: DB = Depends(),
     threshold_tile: ThresholdTile = Depends(ThresholdTile.depends()),
 ):
-    vt = await fetch_threshold_tiles(threshold_tile, db)
-    if vt is None:
-        raise HTTPException(status_code=204, detail="no data found for this tile")
-
-    return Response(content=vt, status_code=200, media_type="application/x-protobuf")
+    return await cached_tile(
+        request,
+        "v3_thresholds",
+        QueryBuilder(threshold_tile).params(),
+        lambda: fetch_threshold_tiles(threshold_tile, db),
+        lambda: fetch_threshold_tile_version(threshold_tile, db),
+    )
 
 
-async def fetch_tiles(query, db):
-    query_builder = QueryBuilder(query)
-    sql = f"""
-    WITH
+def tile_bounds_sql() -> str:
+    """the tile envelope and the envelope plus the ST_AsMVTGeom buffer"""
+    return """
         tile AS (
             SELECT ST_TileEnvelope(:z,:x,:y) AS tile
         ),
-        locations AS (
+        bounds AS (
+            SELECT ST_Expand(tile, (ST_XMax(tile) - ST_XMin(tile)) * 256 / 4096) AS envelope
+            FROM tile
+        )"""
+
+
+def tile_sensors_sql() -> str:
+    """
+    every sensor of the locations within the tile (plus the buffer that
+    ST_AsMVTGeom keeps), pruned on the envelope before any other join.
+    Uses the precomputed 3857 geometries (see sql/tiles.sql) when
+    API_TILE_GEOM_CACHED is set and transforms the envelope otherwise.
+    """
+    if settings.API_TILE_GEOM_CACHED:
+        locations = """
+                locations_geom3857_cached g
+            JOIN
+                bounds
+            ON
+                g.geom3857 && bounds.envelope
+            JOIN
+                locations_view_cached l
+            ON
+                l.id = g.id"""
+        geom = "g.geom3857"
+    else:
+        locations = """
+                locations_view_cached l
+            JOIN
+                bounds
+            ON
+                l.geom && ST_Transform(bounds.envelope, 4326)"""
+        geom = "ST_Transform(l.geom, 3857)"
+    return f"""
+        {tile_bounds_sql()},
+        sensors AS (
             SELECT
-                locations_view_cached.id AS sensor_nodes_id
-                , locations_view_cached.ismobile 
-                , locations_view_cached.ismonitor 
+                l.id AS sensor_nodes_id
+                , l.ismobile
+                , l.ismonitor
+                , (l.provider->'id')::int AS providers_id
+                , (l.owner->'id')::int AS owners_id
+                , {geom} AS geom
                 , sensors.measurands_id AS parameters_id
-                , ST_AsMVTGeom(ST_Transform(locations_view_cached.geom, 3857), tile) AS mvt
                 , sensors_rollup.value_latest AS value
-                , sensors_rollup.datetime_last > (NOW() - INTERVAL '48 hours' ) AS active
-                , (locations_view_cached.provider->'id')::int AS providers_id 
+                , sensors_rollup.datetime_last
+                , sensors_rollup.datetime_last > (NOW() - INTERVAL '48 hours') AS active
             FROM
-                locations_view_cached
-            JOIN
-                tile
-            ON
-                TRUE
+                {locations}
             JOIN
                 sensor_systems
             ON
-                sensor_systems.sensor_nodes_id = locations_view_cached.id
+                sensor_systems.sensor_nodes_id = l.id
             JOIN
                 sensors
             ON
@@ -180,94 +219,168 @@ async def fetch_tiles(query, db):
                 sensors_rollup
             ON
                 sensors_rollup.sensors_id = sensors.sensors_id
-        ),
-        t AS (
+        )"""
+
+
+async def fetch_tiles(query, db):
+    query_builder = QueryBuilder(query)
+    # filters apply to the sensors, then there is one feature per
+    # location with the value of its most recently updated sensor
+    sql = f"""
+    WITH
+        {tile_sensors_sql()},
+        locations AS (
             SELECT
                 sensor_nodes_id
-                , mvt
-                , value
-                , active
+                , geom
+                , (array_agg(value ORDER BY datetime_last DESC NULLS LAST))[1] AS value
+                , (array_agg(parameters_id ORDER BY datetime_last DESC NULLS LAST))[1] AS parameters_id
+                , bool_or(active) AS active
                 , providers_id
-                , parameters_id
                 , ismonitor
                 , ismobile
             FROM
-                locations
+                sensors
             {query_builder.where()}
+            GROUP BY
+                sensor_nodes_id, geom, providers_id, ismonitor, ismobile
+        ),
+        t AS (
+            {location_features_sql(query.z)}
         )
         SELECT ST_AsMVT(t, 'default') FROM t;
     """
-    response = await db.fetchval(sql, query_builder.params())
+    params = query_builder.params()
+    if clustered(query.z):
+        params["cluster_cell"] = settings.API_TILE_CLUSTER_CELL
+    response = await db.fetchval(sql, params)
     return response
 
 
-async def fetch_threshold_tiles(query, db):
+async def fetch_tile_version(query, db):
+    """
+    the latest update of the sensors in the tile along with how many
+    there are and how many are active, which changes whenever the
+    rendered tile would, for a fraction of the cost of rendering it
+    """
     query_builder = QueryBuilder(query)
     sql = f"""
     WITH
-        tile AS (
-            SELECT ST_TileEnvelope(:z,:x,:y) AS tile
-        ),
-        thresholds AS (
-            SELECT 
+        {tile_sensors_sql()}
+        SELECT concat_ws(':', max(datetime_last), count(*), count(*) FILTER (WHERE active))
+        FROM sensors
+        {query_builder.where()};
+    """
+    response = await db.fetchval(sql, query_builder.params())
+    return response
+
+
+def clustered(z: int) -> bool:
+    return z <= settings.API_TILE_CLUSTER_MAX_ZOOM
+
+
+def location_features_sql(z: int) -> str:
+    """
+    one feature per location, or at low zooms one per grid cell of
+    :cluster_cell tile units with the count and the min/mean/max value
+    of its locations and parameter. The representative location is the
+    first active one by id and providers_id is only kept when all of the
+    locations share it.
+    """
+    if not clustered(z):
+        return """
+            SELECT
                 sensor_nodes_id
-                , measurands_id
-                , days AS period
-                , threshold_value AS threshold
-                , ((exceedance_count / total_count) * 100)::int AS exceedance
+                , ST_AsMVTGeom(geom, tile) AS mvt
+                , value
+                , active
+                , providers_id
+                , parameters_id
+                , ismonitor
+                , ismobile
             FROM
-                sensor_node_range_exceedances
-        ),
-        locations AS (
+                locations, tile"""
+    return """
             SELECT
-                locations_view_cached.id AS sensor_nodes_id
-                , locations_view_cached.ismobile 
-                , locations_view_cached.ismonitor 
-                , sensors.measurands_id AS measurands_id
-                , ST_AsMVTGeom(ST_Transform(locations_view_cached.geom, 3857), tile) AS mvt
-                , thresholds.exceedance
-                , thresholds.period    
-                , thresholds.threshold       
-                , sensors_rollup.datetime_last > (NOW() - INTERVAL '48 hours' ) AS active
-                , (locations_view_cached.provider->'id')::int AS providers_id 
+                (array_agg(sensor_nodes_id ORDER BY active DESC, sensor_nodes_id))[1] AS sensor_nodes_id
+                , ST_SnapToGrid(ST_Centroid(ST_Collect(mvt)), 1) AS mvt
+                , count(*) AS count
+                , avg(value) AS value
+                , min(value) AS value_min
+                , max(value) AS value_max
+                , bool_or(active) AS active
+                , CASE WHEN count(DISTINCT providers_id) = 1 THEN min(providers_id) END AS providers_id
+                , parameters_id
+                , bool_or(ismonitor) AS ismonitor
+                , bool_or(ismobile) AS ismobile
+            FROM
+                (
+                    SELECT locations.*, ST_AsMVTGeom(geom, tile) AS mvt
+                    FROM locations, tile
+                ) points
+            WHERE
+                mvt IS NOT NULL
+            GROUP BY
+                ST_SnapToGrid(mvt, :cluster_cell), parameters_id"""
+
+
+def tile_thresholds_sql() -> str:
+    return """
+        thresholds AS (
+            SELECT
+                sensors.*
+                , exceedances.days AS period
+                , exceedances.threshold_value AS threshold
+                , ((exceedances.exceedance_count / exceedances.total_count) * 100)::int AS exceedance
             FROM
-                locations_view_cached
-            JOIN
-                tile
-            ON
-                TRUE
-            JOIN
-                sensor_systems
-            ON
-                sensor_systems.sensor_nodes_id = locations_view_cached.id
-            JOIN
                 sensors
-            ON
-                sensors.sensor_systems_id = sensor_systems.sensor_systems_id
-            JOIN
-                thresholds
-            ON
-                thresholds.sensor_nodes_id = locations_view_cached.id AND thresholds.measurands_id = sensors.measurands_id
             JOIN
-                sensors_rollup
+                sensor_node_range_exceedances exceedances
             ON
-                sensors_rollup.sensors_id = sensors.sensors_id
+                exceedances.sensor_nodes_id = sensors.sensor_nodes_id
+                AND exceedances.measurands_id = sensors.parameters_id
+        )"""
+
+
+async def fetch_threshold_tiles(query, db):
+    query_builder = QueryBuilder(query)
+    sql = f"""
+    WITH
+        {tile_sensors_sql()},
+        {tile_thresholds_sql()},
+        locations AS (
+            SELECT
+                sensor_nodes_id
+                , geom
+                , period
+                , threshold
+                , max(exceedance) AS exceedance
+                , bool_or(active) AS active
+                , providers_id
+                , parameters_id
+                , ismonitor
+                , ismobile
+            FROM
+                thresholds
+            {query_builder.where()}
+            GROUP BY
+                sensor_nodes_id, geom, period, threshold, providers_id
+                , parameters_id, ismonitor, ismobile
         ),
         t AS (
             SELECT
                 sensor_nodes_id
-                , mvt
+                , ST_AsMVTGeom(geom, tile) AS mvt
                 , period
                 , threshold
                 , exceedance
                 , active
                 , providers_id
-                , measurands_id
+                , parameters_id AS measurands_id
                 , ismonitor
                 , ismobile
             FROM
-                locations
-            {query_builder.where()}
+                locations, tile
         )
         SELECT ST_AsMVT(t, 'default') FROM t;
     """
@@ -275,22 +388,161 @@ async def fetch_threshold_tiles(query, db):
     return response
 
 
+async def fetch_threshold_tile_version(query, db):
+    query_builder = QueryBuilder(query)
+    sql = f"""
+    WITH
+        {tile_sensors_sql()},
+        {tile_thresholds_sql()}
+        SELECT concat_ws(
+            ':', max(datetime_last), count(*), count(*) FILTER (WHERE active), sum(exceedance)
+        )
+        FROM thresholds
+        {query_builder.where()};
+    """
+    response = await db.fetchval(sql, query_builder.params())
+    return response
+
+
 @router.get(
     "/locations/tiles/mobile-generalized/{z}/{x}/{y}.pbf",
     responses={200: {"content": {"application/x-protobuf": {}}}},
     response_class=Response,
 )
 async def get_mobile_gen_tiles(
+    request: Request,
     db: DB = Depends(),
-    tile: Tile = Depends(Tile),
+    tile: Tile = Depends(Tile.depends()),
 ):
-    ...
+    return await cached_tile(
+        request,
+        "v3_mobile_generalized",
+        QueryBuilder(tile).params(),
+        lambda: fetch_mobile_gen_tiles(tile, db),
+    )
+
+
+def mobile_tier(z: int) -> int:
+    """the deepest zoom tier of the generalized store at or above z"""
+    tiers = sorted(settings.API_MOBILE_TILE_ZOOMS)
+    return max((tier for tier in tiers if tier <= z), default=tiers[0])
+
+
+def mobile_sensors_sql() -> str:
+    """
+    every sensor of the mobile locations whose extent overlaps the tile,
+    one row per sensor so that the tile filters apply as they do to the
+    stationary locations
+    """
+    return """
+        mobile_sensors AS (
+            SELECT
+                l.id AS sensor_nodes_id
+                , l.ismobile
+                , l.ismonitor
+                , (l.provider->'id')::int AS providers_id
+                , (l.owner->'id')::int AS owners_id
+                , sensors.measurands_id AS parameters_id
+                , sensors_rollup.datetime_last > (NOW() - INTERVAL '48 hours') AS active
+            FROM
+                mobile_bounds b
+            JOIN
+                bounds
+            ON
+                b.box3857 && bounds.envelope
+            JOIN
+                locations_view_cached l
+            ON
+                l.id = b.sensor_nodes_id
+            JOIN
+                sensor_systems
+            ON
+                sensor_systems.sensor_nodes_id = l.id
+            JOIN
+                sensors
+            ON
+                sensors.sensor_systems_id = sensor_systems.sensor_systems_id
+            JOIN
+                sensors_rollup
+            ON
+                sensors_rollup.sensors_id = sensors.sensors_id
+        )"""
+
+
+def mobile_params(query) -> dict:
+    params = QueryBuilder(query).params()
+    params["tier"] = mobile_tier(query.z)
+    return params
 
 
-async def fetch_mobile_gen_tiles(where, db):
+async def fetch_mobile_gen_tiles(query, db):
+    query_builder = QueryBuilder(query)
+    measurands = ""
+    if query.has("parameters_id"):
+        measurands = "AND p.measurands_id = ANY (:parameters_id)"
+    # the cells of the tier merged across parameters, the value is only
+    # kept for cells with a single parameter
     sql = f"""
+    WITH
+        {tile_bounds_sql()},
+        {mobile_sensors_sql()},
+        nodes AS (
+            SELECT DISTINCT sensor_nodes_id
+            FROM mobile_sensors
+            {query_builder.where()}
+        ),
+        cells AS (
+            SELECT
+                p.sensor_nodes_id
+                , p.geom3857
+                , sum(p.count) AS count
+                , CASE WHEN count(DISTINCT p.measurands_id) = 1
+                    THEN sum(p.value * p.count) / sum(p.count) END AS value
+                , max(p.datetime_last) AS datetime_last
+            FROM
+                mobile_points_generalized p
+            JOIN
+                nodes
+            ON
+                nodes.sensor_nodes_id = p.sensor_nodes_id
+            JOIN
+                bounds
+            ON
+                p.geom3857 && bounds.envelope
+            WHERE
+                p.zoom = :tier
+                {measurands}
+            GROUP BY
+                p.sensor_nodes_id, p.geom3857
+        ),
+        t AS (
+            SELECT
+                sensor_nodes_id
+                , ST_AsMVTGeom(geom3857, tile) AS mvt
+                , count
+                , value
+                , datetime_last
+            FROM
+                cells, tile
+        ),
+        extents AS (
+            SELECT
+                b.sensor_nodes_id
+                , ST_AsMVTGeom(b.box3857, tile, 4096, 256, false) AS mvt
+            FROM
+                mobile_bounds b
+            JOIN
+                nodes
+            ON
+                nodes.sensor_nodes_id = b.sensor_nodes_id
+            , tile
+        )
+        SELECT
+            (SELECT ST_AsMVT(t, 'default') FROM t)
+            ||
+            (SELECT ST_AsMVT(extents, 'bounds') FROM extents);
     """
-    response = await db.fetchval(sql, where.params())
+    response = await db.fetchval(sql, mobile_params(query))
     return response
 
 
@@ -300,16 +552,53 @@ async def fetch_mobile_gen_tiles(where, db):
     response_class=Response,
 )
 async def get_mobile_path_tiles(
+    request: Request,
     db: DB = Depends(),
     tile: Tile = Depends(Tile.depends()),
 ):
-    ...
+    return await cached_tile(
+        request,
+        "v3_mobile_paths",
+        QueryBuilder(tile).params(),
+        lambda: fetch_mobile_path_tiles(tile, db),
+    )
 
 
-async def fetch_mobile_path_tiles(where, db):
+async def fetch_mobile_path_tiles(query, db):
+    query_builder = QueryBuilder(query)
     sql = f"""
+    WITH
+        {tile_bounds_sql()},
+        {mobile_sensors_sql()},
+        nodes AS (
+            SELECT DISTINCT sensor_nodes_id
+            FROM mobile_sensors
+            {query_builder.where()}
+        ),
+        t AS (
+            SELECT
+                p.sensor_nodes_id
+                , ST_AsMVTGeom(p.geom3857, tile) AS mvt
+                , p.count
+                , p.datetime_first
+                , p.datetime_last
+            FROM
+                mobile_paths_generalized p
+            JOIN
+                nodes
+            ON
+                nodes.sensor_nodes_id = p.sensor_nodes_id
+            JOIN
+                bounds
+            ON
+                p.geom3857 && bounds.envelope
+            , tile
+            WHERE
+                p.zoom = :tier
+        )
+        SELECT ST_AsMVT(t, 'default') FROM t;
     """
-    response = await db.fetchval(sql, where.params())
+    response = await db.fetchval(sql, mobile_params(query))
     return response
 
 
@@ -319,16 +608,56 @@ async def fetch_mobile_path_tiles(where, db):
     response_class=Response,
 )
 async def get_mobiletiles(
+    request: Request,
     db: DB = Depends(),
     mt: MobileTile = Depends(MobileTile.depends()),
 ):
-    ...
+    return await cached_tile(
+        request,
+        "v3_mobile",
+        QueryBuilder(mt).params(),
+        lambda: fetch_mobile_tiles(mt, db),
+    )
 
 
-async def fetch_mobile_tiles(where, db):
+async def fetch_mobile_tiles(query, db):
+    query_builder = QueryBuilder(query)
     sql = f"""
+    WITH
+        {tile_bounds_sql()},
+        {mobile_sensors_sql()},
+        nodes AS (
+            SELECT DISTINCT sensor_nodes_id
+            FROM mobile_sensors
+            {query_builder.where()}
+        ),
+        t AS (
+            SELECT
+                p.sensor_nodes_id
+                , ST_AsMVTGeom(p.geom3857, tile) AS mvt
+                , p.measurands_id AS parameters_id
+                , p.value
+                , p.count
+                , p.datetime_first
+                , p.datetime_last
+            FROM
+                mobile_points_generalized p
+            JOIN
+                nodes
+            ON
+                nodes.sensor_nodes_id = p.sensor_nodes_id
+            JOIN
+                bounds
+            ON
+                p.geom3857 && bounds.envelope
+            , tile
+            WHERE
+                p.zoom = :tier
+                AND p.measurands_id = :parameters_id
+        )
+        SELECT ST_AsMVT(t, 'default') FROM t;
     """
-    response = await db.fetchval(sql, where.params())
+    response = await db.fetchval(sql, mobile_params(query))
     return response
 
 
@@ -44,6 +44,12 @@ setup(
         "redis",
     ],
     extras_require={
+        "columnar": [
+            "pyarrow",
+        ],
+        "spatial": [
+            "numpy",
+        ],
         "dev": [
             "black",
             "flake8",
@@ -57,6 +63,7 @@ setup(
         "console_scripts": [
             "openaqapi=openaq_fastapi.main:run",
             "openaqfetch=openaq_fastapi.ingest.fetch:app",
+            "openaqtiles=openaq_fastapi.tilecache:main",
         ]
     },
     include_package_data=True,
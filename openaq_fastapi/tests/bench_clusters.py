@@ -0,0 +1,79 @@
+"""
+Payload size and latency of the location tiles with one feature per
+location and with the low zoom clusters, per zoom level, for the v3
+and v2 endpoints. Needs the database.
+
+    python tests/bench_clusters.py [--lon 0 --lat 20] [--max-zoom 7]
+
+Clustering applies up to API_TILE_CLUSTER_MAX_ZOOM, the rows above it
+are the same for both and show where the switch to raw points happens.
+"""
+import argparse
+import asyncio
+import gzip
+import time
+
+from openaq_fastapi.db import db_pool
+from openaq_fastapi.routers.mvt import MobileTile, fetch_tile
+from openaq_fastapi.settings import settings
+from openaq_fastapi.tilecache import PoolDB
+from openaq_fastapi.v3.routers.tiles import Tile, fetch_tiles
+
+from bench_tiles import tile_for
+
+
+async def timed(fetch, db, max_zoom: int):
+    settings.API_TILE_CLUSTER_MAX_ZOOM = max_zoom
+    start = time.perf_counter()
+    vt = await fetch(db) or b""
+    ms = (time.perf_counter() - start) * 1000
+    return ms, len(vt), len(gzip.compress(vt)) if vt else 0
+
+
+def reduction(before: int, after: int) -> str:
+    return f"{(1 - after / before) * 100:5.1f}%" if before else "    -"
+
+
+async def main(args):
+    cluster_max_zoom = settings.API_TILE_CLUSTER_MAX_ZOOM
+    pool = await db_pool(None)
+    db = PoolDB(pool)
+    print(
+        f"{'':>4} {'zoom':>4} {'points':>10} {'gzip':>8}"
+        f" {'clusters':>10} {'gzip':>8} {'smaller':>7}"
+    )
+    try:
+        for version in ("v3", "v2"):
+            for z in range(0, args.max_zoom + 1):
+                x, y = tile_for(args.lon, args.lat, z)
+                if version == "v3":
+                    tile = Tile(z=z, x=x, y=y, parameters_id=[str(args.parameters_id)])
+
+                    def fetch(db):
+                        return fetch_tiles(tile, db)
+
+                else:
+
+                    def fetch(db):
+                        return fetch_tile(
+                            MobileTile(z=z, x=x, y=y, parameter=args.parameters_id), db
+                        )
+
+                points = await timed(fetch, db, -1)
+                clusters = await timed(fetch, db, cluster_max_zoom)
+                print(
+                    f"{version:>4} {z:>4} {points[1]:10} {points[2]:8}"
+                    f" {clusters[1]:10} {clusters[2]:8} {reduction(points[2], clusters[2]):>7}"
+                    f"  ({points[0]:.0f}ms / {clusters[0]:.0f}ms)"
+                )
+    finally:
+        await pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--lon", type=float, default=0.0)
+    parser.add_argument("--lat", type=float, default=20.0)
+    parser.add_argument("--max-zoom", type=int, default=7)
+    parser.add_argument("--parameters-id", type=int, default=2)
+    asyncio.run(main(parser.parse_args()))
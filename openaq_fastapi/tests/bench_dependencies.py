@@ -0,0 +1,105 @@
+"""
+Compares the per request cost of resolving the query model dependencies
+with the old exec generated dependency, where fastapi validates every
+parameter before the model validates them again, and the current one
+where the model validates the request once.
+
+    python tests/bench_dependencies.py [iterations]
+"""
+import asyncio
+import inspect
+import sys
+import time
+from types import FunctionType
+from typing import Dict
+
+from fastapi import Query
+from fastapi.dependencies.utils import get_dependant, solve_dependencies
+from starlette.requests import Request
+
+from openaq_fastapi.routers.measurements import Measurements
+from openaq_fastapi.v3.routers.locations import LocationsQueries
+
+ignore_in_docs = ["date_from_adj", "date_to_adj", "measurand", "lat", "lon"]
+
+
+def legacy_dependency(name: str, model_cls):
+    """the previous parameter_dependency_from_model"""
+    names = []
+    annotations: Dict[str, type] = {}
+    defaults = []
+    for field_model in model_cls.__fields__.values():
+        if field_model.name not in ignore_in_docs:
+            names.append(field_model.name)
+            annotations[field_model.name] = field_model.outer_type_
+            defaults.append(
+                Query(field_model.default, description=field_model.field_info.description)
+            )
+    code = inspect.cleandoc(
+        """
+    def %s(%s):
+        return %s(%s)
+    """
+        % (
+            name,
+            ", ".join(names),
+            model_cls.__name__,
+            ", ".join(["%s=%s" % (name, name) for name in names]),
+        )
+    )
+    compiled = compile(code, "string", "exec")
+    func = FunctionType(compiled.co_consts[0], {model_cls.__name__: model_cls}, name)
+    func.__annotations__ = annotations
+    func.__defaults__ = (*defaults,)
+    return func
+
+
+def request(query_string: str) -> Request:
+    return Request(
+        {
+            "type": "http",
+            "method": "GET",
+            "path": "/",
+            "headers": [],
+            "query_string": query_string.encode(),
+            "path_params": {},
+        }
+    )
+
+
+async def run(dependency, query_string: str, iterations: int) -> float:
+    dependant = get_dependant(path="/", call=dependency)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        values, errors, *_ = await solve_dependencies(
+            request=request(query_string), dependant=dependant
+        )
+        assert not errors, errors
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+cases = [
+    (
+        LocationsQueries,
+        "limit=100&page=2&coordinates=38.907,-77.037&radius=1000"
+        "&providers_id=1,2&monitor=true",
+    ),
+    (
+        Measurements,
+        "limit=100&page=1&date_from=2022-01-01&parameter=pm25&parameter=o3"
+        "&country=US&order_by=datetime&sort=desc",
+    ),
+]
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    for model_cls, query_string in cases:
+        before = asyncio.run(
+            run(legacy_dependency("depends", model_cls), query_string, iterations)
+        )
+        after = asyncio.run(run(model_cls.depends(), query_string, iterations))
+        print(
+            f"{model_cls.__name__:<20} before: {before:8.1f}us"
+            f"  after: {after:8.1f}us  ({before / after:.2f}x)"
+        )
@@ -0,0 +1,98 @@
+"""
+Times ordering points by distance for a page of results, the way
+order_by=distance is answered: numpy haversine over every point with
+argpartition for the page, a full argsort for comparison and, with
+--db, postgis ordering by st_distance over the same points.
+
+    python tests/bench_distance.py [--db] [-k 100] [-n 20]
+
+--db loads the random points into a temporary table first.
+"""
+import argparse
+import asyncio
+import time
+
+import numpy as np
+
+from openaq_fastapi.settings import settings
+from openaq_fastapi.spatial import GridIndex, haversine
+
+sizes = [10_000, 100_000, 1_000_000]
+center = (-77.037, 38.907)
+
+
+def points(size: int):
+    rng = np.random.default_rng(size)
+    return (
+        np.arange(1, size + 1),
+        rng.uniform(-180, 180, size),
+        np.degrees(np.arcsin(rng.uniform(-1, 1, size))),
+    )
+
+
+def timed(n: int, func) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        func()
+    return (time.perf_counter() - start) / n * 1000
+
+
+def argsort(grid, k):
+    distances = haversine(*center, grid.lons, grid.lats)
+    return grid.ids[np.argsort(distances)[:k]]
+
+
+async def sql_timing(con, ids, lons, lats, k: int, n: int) -> float:
+    await con.execute("DROP TABLE IF EXISTS bench_points")
+    await con.execute(
+        "CREATE TEMP TABLE bench_points (id int, lon float8, lat float8, geog geography)"
+    )
+    await con.copy_records_to_table(
+        "bench_points",
+        records=zip(ids.tolist(), lons.tolist(), lats.tolist()),
+        columns=["id", "lon", "lat"],
+    )
+    await con.execute(
+        "UPDATE bench_points SET geog = st_makepoint(lon, lat)::geography"
+    )
+    await con.execute("ANALYZE bench_points")
+    sql = """
+        SELECT id FROM bench_points
+        ORDER BY st_distance(st_makepoint($1, $2)::geography, geog)
+        LIMIT $3
+        """
+    start = time.perf_counter()
+    for _ in range(n):
+        await con.fetch(sql, *center, k)
+    return (time.perf_counter() - start) / n * 1000
+
+
+async def main(k: int, n: int, db: bool):
+    con = None
+    if db:
+        import asyncpg
+
+        con = await asyncpg.connect(settings.DATABASE_READ_URL)
+    header = f"{'points':>10} {'argpartition':>13} {'argsort':>10}"
+    print(header + (f" {'postgis':>10}" if db else ""))
+    for size in sizes:
+        ids, lons, lats = points(size)
+        grid = GridIndex(ids, lons, lats, settings.API_SPATIAL_INDEX_CELL)
+        assert list(grid.nearest(*center, k)) == list(argsort(grid, k))
+        top = timed(n, lambda: grid.nearest(*center, k))
+        full = timed(n, lambda: argsort(grid, k))
+        line = f"{size:>10} {top:11.2f}ms {full:8.2f}ms"
+        if con is not None:
+            line += f" {await sql_timing(con, ids, lons, lats, k, n):8.2f}ms"
+        print(line)
+    if con is not None:
+        await con.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-k", type=int, default=100, help="page size")
+    parser.add_argument("-n", type=int, default=20, help="iterations per size")
+    parser.add_argument("--db", action="store_true", help="include postgis")
+    args = parser.parse_args()
+    asyncio.run(main(args.k, args.n, args.db))
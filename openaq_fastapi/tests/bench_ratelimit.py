@@ -0,0 +1,138 @@
+"""
+Measures how long the event loop is blocked while requests go through
+the rate limiter, with the previous synchronous limiter (setnx, expire,
+get and decrby on a blocking client) and the current one (one Lua
+script call on an asyncio client). Needs a redis to talk to.
+
+    python tests/bench_ratelimit.py --redis-host localhost -n 2000 -c 50
+
+A ticker sleeps 1ms at a time next to the requests, the lag is how much
+later than asked for it wakes up, i.e. how long other requests on the
+same loop would have been stalled.
+"""
+import argparse
+import asyncio
+import datetime
+import statistics
+import time
+
+import httpx
+from fastapi import FastAPI
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from openaq_fastapi.middleware import RateLimiterMiddleWare
+
+
+class LegacyRateLimiterMiddleWare(BaseHTTPMiddleware):
+    """the previous limiter, fixed windows on a blocking client"""
+
+    def __init__(self, app, redis_client, rate_amount, rate_amount_key, rate_time):
+        super().__init__(app)
+        self.redis_client = redis_client
+        self.rate_amount = rate_amount
+        self.rate_time = rate_time
+
+    def request_is_limited(self, key: str, limit: int):
+        if self.redis_client.setnx(key, limit):
+            self.redis_client.expire(key, int(self.rate_time.total_seconds()))
+        count = self.redis_client.get(key)
+        if count and int(count) > 0:
+            self.redis_client.decrby(key, 1)
+            return False
+        return True
+
+    async def dispatch(self, request, call_next):
+        self.request_is_limited(f"bench:{request.client.host}", self.rate_amount)
+        return await call_next(request)
+
+
+def app_with(middleware, redis_client) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/v3/bench")
+    async def bench():
+        return {"ok": True}
+
+    app.add_middleware(
+        middleware,
+        redis_client=redis_client,
+        rate_amount=10**9,
+        rate_amount_key=10**9,
+        rate_time=datetime.timedelta(minutes=1),
+    )
+    return app
+
+
+async def ticker(lags, stop: asyncio.Event, interval: float = 0.001):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append((time.perf_counter() - start - interval) * 1000)
+
+
+async def run(app: FastAPI, n: int, concurrency: int):
+    lags = []
+    stop = asyncio.Event()
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+
+        async def one():
+            async with semaphore:
+                response = await client.get("/v3/bench")
+                assert response.status_code == 200, response.text
+
+        tick = asyncio.create_task(ticker(lags, stop))
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(n)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await tick
+    return elapsed, lags
+
+
+def report(name: str, n: int, elapsed: float, lags):
+    lags.sort()
+    print(f"{name}")
+    print(f"  requests/s:      {n / elapsed:10.1f}")
+    print(f"  loop lag mean:   {statistics.mean(lags):10.2f}ms")
+    print(f"  loop lag p99:    {lags[int(len(lags) * 0.99)]:10.2f}ms")
+    print(f"  loop lag max:    {lags[-1]:10.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--redis-host", default="localhost")
+    parser.add_argument("--redis-port", type=int, default=6379)
+    parser.add_argument("--cluster", action="store_true")
+    parser.add_argument("-n", type=int, default=2000, help="number of requests")
+    parser.add_argument("-c", type=int, default=50, help="concurrent requests")
+    args = parser.parse_args()
+
+    import redis
+    import redis.asyncio
+
+    kwargs = {"host": args.redis_host, "port": args.redis_port, "decode_responses": True}
+    if args.cluster:
+        kwargs["skip_full_coverage_check"] = True
+        sync_client = redis.RedisCluster(**kwargs)
+    else:
+        sync_client = redis.Redis(**kwargs)
+
+    async def after():
+        # created within the loop that uses it
+        if args.cluster:
+            async_client = redis.asyncio.RedisCluster(**kwargs)
+        else:
+            async_client = redis.asyncio.Redis(**kwargs)
+        return await run(app_with(RateLimiterMiddleWare, async_client), args.n, args.c)
+
+    elapsed, lags = asyncio.run(
+        run(app_with(LegacyRateLimiterMiddleWare, sync_client), args.n, args.c)
+    )
+    report("before: sync fixed window", args.n, elapsed, lags)
+    elapsed, lags = asyncio.run(after())
+    report("after: async token bucket", args.n, elapsed, lags)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Compares radius and bbox lookups through the in process spatial index
+with the postgis filters on locations_view_cached. Without --db only the
+index is timed, over random points.
+
+    python tests/bench_spatial.py [--points 100000] [--db] [-n 200]
+
+--db loads the real location points and times, for each case, the
+postgis query alone and the index followed by the same query limited
+to the candidate ids (what the api does).
+"""
+import argparse
+import asyncio
+import time
+
+import numpy as np
+
+from openaq_fastapi.settings import settings
+from openaq_fastapi.spatial import GridIndex, locations_index
+
+cases = [
+    ("radius 1km, washington", "radius", (-77.037, 38.907, 1000)),
+    ("radius 25km, delhi", "radius", (77.209, 28.614, 25000)),
+    ("bbox, washington", "bbox", (-77.12, 38.79, -76.91, 39.0)),
+    ("bbox, california", "bbox", (-124.4, 32.5, -114.1, 42.0)),
+]
+
+sql = {
+    "radius": """
+        SELECT id FROM locations_view_cached
+        WHERE {ids} ST_DWithin(ST_MakePoint($1, $2)::geography, geog, $3)
+        """,
+    "bbox": """
+        SELECT id FROM locations_view_cached
+        WHERE {ids} st_makeenvelope($1, $2, $3, $4, 4326) && geom
+        """,
+}
+
+
+def lookup(grid, kind, args):
+    if kind == "radius":
+        return grid.radius(*args)
+    return grid.bbox(*args)
+
+
+def timed(n, func):
+    start = time.perf_counter()
+    for _ in range(n):
+        result = func()
+    return (time.perf_counter() - start) / n * 1000, result
+
+
+def random_grid(points: int) -> GridIndex:
+    rng = np.random.default_rng(0)
+    return GridIndex(
+        np.arange(points),
+        rng.uniform(-180, 180, points),
+        np.degrees(np.arcsin(rng.uniform(-1, 1, points))),
+        settings.API_SPATIAL_INDEX_CELL,
+    )
+
+
+async def with_db(n: int):
+    import asyncpg
+
+    con = await asyncpg.connect(settings.DATABASE_READ_URL)
+    rows = await con.fetch(locations_index.sql)
+    locations_index.build(rows)
+    grid = locations_index.grid
+    print(f"{len(grid)} locations\n")
+    print(f"{'case':<26} {'postgis':>10} {'index':>10} {'index+db':>10} {'ids':>6}")
+    for name, kind, args in cases:
+        plain = sql[kind].format(ids="")
+        limited = sql[kind].format(ids="id = ANY($%d) AND" % (len(args) + 1))
+        postgis = 0.0
+        for _ in range(n):
+            start = time.perf_counter()
+            await con.fetch(plain, *args)
+            postgis += time.perf_counter() - start
+        both = 0.0
+        for _ in range(n):
+            start = time.perf_counter()
+            ids = lookup(grid, kind, args).tolist()
+            await con.fetch(limited, *args, ids)
+            both += time.perf_counter() - start
+        index, ids = timed(n, lambda: lookup(grid, kind, args))
+        print(
+            f"{name:<26} {postgis / n * 1000:8.3f}ms {index:8.3f}ms"
+            f" {both / n * 1000:8.3f}ms {len(ids):6}"
+        )
+    await con.close()
+
+
+def without_db(points: int, n: int):
+    start = time.perf_counter()
+    grid = random_grid(points)
+    print(f"{points} random points, built in {(time.perf_counter() - start) * 1000:.1f}ms\n")
+    print(f"{'case':<26} {'index':>10} {'ids':>6}")
+    for name, kind, args in cases:
+        ms, ids = timed(n, lambda: lookup(grid, kind, args))
+        print(f"{name:<26} {ms:8.3f}ms {len(ids):6}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--points", type=int, default=100000)
+    parser.add_argument("--db", action="store_true", help="use the database")
+    parser.add_argument("-n", type=int, default=200, help="iterations per case")
+    args = parser.parse_args()
+    if args.db:
+        asyncio.run(with_db(args.n))
+    else:
+        without_db(args.points, args.n)
@@ -0,0 +1,132 @@
+"""
+Per tile latency and payload size of the v3 location tiles across zoom
+levels, for the previous query (every location transformed and clipped
+before filtering) and the current one (pruned on the tile envelope,
+filtered, then one feature per location). Needs the database.
+
+    python tests/bench_tiles.py [--lon -77.037 --lat 38.907] [--parameters-id 2]
+    python tests/bench_tiles.py --cached  # with locations_geom3857_cached
+
+The caches are bypassed, each query goes straight to the pool.
+"""
+import argparse
+import asyncio
+import gzip
+import math
+import time
+
+from openaq_fastapi.db import db_pool
+from openaq_fastapi.settings import settings
+from openaq_fastapi.tilecache import PoolDB
+from openaq_fastapi.v3.models.queries import QueryBuilder
+from openaq_fastapi.v3.routers.tiles import Tile, fetch_tiles
+
+
+async def legacy_fetch_tiles(query, db):
+    """the query fetch_tiles used to run"""
+    query_builder = QueryBuilder(query)
+    sql = f"""
+    WITH
+        tile AS (
+            SELECT ST_TileEnvelope(:z,:x,:y) AS tile
+        ),
+        locations AS (
+            SELECT
+                locations_view_cached.id AS sensor_nodes_id
+                , locations_view_cached.ismobile
+                , locations_view_cached.ismonitor
+                , sensors.measurands_id AS parameters_id
+                , ST_AsMVTGeom(ST_Transform(locations_view_cached.geom, 3857), tile) AS mvt
+                , sensors_rollup.value_latest AS value
+                , sensors_rollup.datetime_last > (NOW() - INTERVAL '48 hours' ) AS active
+                , (locations_view_cached.provider->'id')::int AS providers_id
+            FROM
+                locations_view_cached
+            JOIN
+                tile
+            ON
+                TRUE
+            JOIN
+                sensor_systems
+            ON
+                sensor_systems.sensor_nodes_id = locations_view_cached.id
+            JOIN
+                sensors
+            ON
+                sensors.sensor_systems_id = sensor_systems.sensor_systems_id
+            JOIN
+                sensors_rollup
+            ON
+                sensors_rollup.sensors_id = sensors.sensors_id
+        ),
+        t AS (
+            SELECT
+                sensor_nodes_id
+                , mvt
+                , value
+                , active
+                , providers_id
+                , parameters_id
+                , ismonitor
+                , ismobile
+            FROM
+                locations
+            {query_builder.where()}
+        )
+        SELECT ST_AsMVT(t, 'default') FROM t;
+    """
+    return await db.fetchval(sql, query_builder.params())
+
+
+def tile_for(lon: float, lat: float, z: int):
+    """the xyz tile containing a point"""
+    n = 2**z
+    x = int((lon + 180) / 360 * n)
+    lat = math.radians(lat)
+    y = int((1 - math.log(math.tan(lat) + 1 / math.cos(lat)) / math.pi) / 2 * n)
+    return min(x, n - 1), min(y, n - 1)
+
+
+async def timed(fetch, tile, db, n: int):
+    start = time.perf_counter()
+    for _ in range(n):
+        vt = await fetch(tile, db)
+    ms = (time.perf_counter() - start) / n * 1000
+    vt = vt or b""
+    return ms, len(vt), len(gzip.compress(vt)) if vt else 0
+
+
+async def main(args):
+    settings.API_TILE_GEOM_CACHED = args.cached
+    pool = await db_pool(None)
+    db = PoolDB(pool)
+    print(
+        f"{'zoom':>4} {'tile':>14} {'before':>10} {'bytes':>9} {'gzip':>8}"
+        f" {'after':>10} {'bytes':>9} {'gzip':>8}"
+    )
+    try:
+        for z in range(args.min_zoom, args.max_zoom + 1):
+            x, y = tile_for(args.lon, args.lat, z)
+            filters = {"parameters_id": [str(args.parameters_id)]} if args.parameters_id else {}
+            tile = Tile(z=z, x=x, y=y, **filters)
+            before = await timed(legacy_fetch_tiles, tile, db, args.n)
+            after = await timed(fetch_tiles, tile, db, args.n)
+            print(
+                f"{z:>4} {f'{z}/{x}/{y}':>14}"
+                f" {before[0]:8.1f}ms {before[1]:9} {before[2]:8}"
+                f" {after[0]:8.1f}ms {after[1]:9} {after[2]:8}"
+            )
+    finally:
+        await pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--lon", type=float, default=-77.037)
+    parser.add_argument("--lat", type=float, default=38.907)
+    parser.add_argument("--min-zoom", type=int, default=0)
+    parser.add_argument("--max-zoom", type=int, default=14)
+    parser.add_argument("--parameters-id", type=int, default=2)
+    parser.add_argument("--cached", action="store_true", help="use locations_geom3857_cached")
+    parser.add_argument("-n", type=int, default=5, help="iterations per tile")
+    asyncio.run(main(parser.parse_args()))
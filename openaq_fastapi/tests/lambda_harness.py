@@ -0,0 +1,103 @@
+"""
+Fires simulated API Gateway (HTTP API, payload v2.0) events at the
+lambda handler in a loop and reports the per invocation overhead.
+Needs the same environment (database, redis) as the deployed function.
+
+    python tests/lambda_harness.py --path /ping -n 500
+    python tests/lambda_harness.py --path /v3/locations/1 --legacy
+
+--legacy builds a new Mangum adapter per invocation, the way the
+handler used to, for comparison.
+"""
+import argparse
+import statistics
+import time
+import uuid
+from typing import Dict
+
+from mangum import Mangum
+
+from openaq_fastapi.main import app, handler
+
+
+class Context:
+    function_name = "openaq-api-harness"
+    memory_limit_in_mb = 1536
+    aws_request_id = "harness"
+
+    def get_remaining_time_in_millis(self):
+        return 15000
+
+
+def event(path: str, query_string: str = "") -> Dict:
+    now = time.time()
+    return {
+        "version": "2.0",
+        "routeKey": "$default",
+        "rawPath": path,
+        "rawQueryString": query_string,
+        "headers": {
+            "accept": "application/json",
+            "accept-encoding": "gzip",
+            "host": "api.openaq.org",
+            "user-agent": "lambda-harness",
+            "x-forwarded-for": "127.0.0.1",
+            "x-forwarded-proto": "https",
+            "x-forwarded-port": "443",
+        },
+        "requestContext": {
+            "accountId": "123456789012",
+            "apiId": "harness",
+            "domainName": "api.openaq.org",
+            "domainPrefix": "api",
+            "http": {
+                "method": "GET",
+                "path": path,
+                "protocol": "HTTP/1.1",
+                "sourceIp": "127.0.0.1",
+                "userAgent": "lambda-harness",
+            },
+            "requestId": str(uuid.uuid4()),
+            "routeKey": "$default",
+            "stage": "$default",
+            "time": time.strftime("%d/%b/%Y:%H:%M:%S +0000", time.gmtime(now)),
+            "timeEpoch": int(now * 1000),
+        },
+        "isBase64Encoded": False,
+    }
+
+
+def legacy_handler(event, context):
+    return Mangum(app)(event, context)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--path", default="/ping")
+    parser.add_argument("--query", default="", help="raw query string")
+    parser.add_argument("-n", type=int, default=200, help="number of invocations")
+    parser.add_argument("--legacy", action="store_true")
+    args = parser.parse_args()
+
+    call = legacy_handler if args.legacy else handler
+    context = Context()
+    timings = []
+    for i in range(args.n):
+        start = time.perf_counter()
+        response = call(event(args.path, args.query), context)
+        timings.append((time.perf_counter() - start) * 1000)
+        if response["statusCode"] >= 500:
+            raise SystemExit(f"invocation {i} failed: {response}")
+
+    cold, warm = timings[0], timings[1:]
+    print(f"{'legacy' if args.legacy else 'current'} handler, {args.path}")
+    print(f"  first invocation: {cold:8.2f}ms")
+    if warm:
+        warm.sort()
+        print(f"  warm mean:        {statistics.mean(warm):8.2f}ms")
+        print(f"  warm p50:         {warm[len(warm) // 2]:8.2f}ms")
+        print(f"  warm p95:         {warm[int(len(warm) * 0.95)]:8.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Load test for the signup flow, POST /register and GET /verify/{code}.
+Run it against a staging stack with SES in sandbox mode, the users it
+creates are real rows in the write database.
+
+    locust -f tests/locustfile_auth.py --host https://staging.openaq.org
+
+Verification codes are emailed rather than returned, so /verify reads
+them from the file named by VERIFICATION_CODES, one per line, e.g.
+
+    psql $DATABASE_WRITE_URL -Atc "SELECT verification_code FROM users
+        WHERE email_address LIKE 'loadtest+%' AND NOT is_active" > codes.txt
+
+Compare the response times before and after a change to the write path
+by running the same user count against each deployment.
+"""
+import os
+import uuid
+from random import choice
+
+from locust import HttpUser, between, task
+
+codes = []
+if os.environ.get("VERIFICATION_CODES"):
+    with open(os.environ["VERIFICATION_CODES"]) as f:
+        codes = [line.strip() for line in f if line.strip()]
+
+
+class SignupUser(HttpUser):
+    wait_time = between(0.5, 2)
+
+    @task(3)
+    def Register(self):
+        password = f"load test {uuid.uuid4().hex}"
+        self.client.post(
+            "/register",
+            data={
+                "fullname": "Load Test",
+                "emailaddress": f"loadtest+{uuid.uuid4().hex}@openaq.org",
+                "entitytype": "Person",
+                "password": password,
+                "passwordconfirm": password,
+            },
+            allow_redirects=False,
+            name="register",
+        )
+
+    @task(1)
+    def Verify(self):
+        if not codes:
+            return
+        # each code verifies once, later requests for it take the
+        # already verified redirect
+        self.client.get(
+            f"/verify/{choice(codes)}", allow_redirects=False, name="verify/:code"
+        )
@@ -0,0 +1,188 @@
+import asyncio
+import pickle
+import time
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+import pytest
+
+from openaq_fastapi.cache import (
+    CachedRecord,
+    EndpointHitMissRatioPlugin,
+    LRUStore,
+    SingleFlight,
+    Stamped,
+    TieredCache,
+    cache_key,
+    cached_swr,
+    current_endpoint,
+    dumps,
+    loads,
+)
+
+
+class TestCacheKey:
+    def test_stable(self):
+        assert cache_key("SELECT 1", b"[]") == cache_key("SELECT 1", b"[]")
+
+    def test_parts_are_separated(self):
+        assert cache_key("ab", "c") != cache_key("a", "bc")
+
+    def test_prefix(self):
+        assert cache_key("SELECT 1", prefix="test").startswith("test:")
+
+
+class TestLRUStore:
+    def test_get_set(self):
+        store = LRUStore(max_bytes=10_000)
+        store.set("a", "value", None, "/v2/latest")
+        assert store.get("a") == "value"
+        assert store.get("b") is None
+
+    def test_ttl(self):
+        store = LRUStore(max_bytes=10_000)
+        store.set("a", "value", 0.01, "/v2/latest")
+        time.sleep(0.02)
+        assert store.get("a") is None
+        assert store.bytes == 0
+
+    def test_byte_budget_evicts_least_recently_used(self):
+        value = "x" * 400
+        store = LRUStore(max_bytes=1000)
+        store.set("a", value, None, "/v2/latest")
+        store.set("b", value, None, "/v2/locations")
+        store.get("a")
+        store.set("c", value, None, "/v2/latest")
+        assert store.get("a") == value
+        assert store.get("b") is None
+        assert store.get("c") == value
+        assert store.bytes <= 1000
+        assert store.evictions == {"/v2/locations": 1}
+
+    def test_over_budget_not_stored(self):
+        store = LRUStore(max_bytes=100)
+        assert store.set("a", "x" * 1000, None, "/v2/latest") is False
+        assert len(store) == 0
+
+
+class TestSerialization:
+    def test_records_round_trip(self):
+        rows = [
+            CachedRecord({"id": 0, "name": 1}, (1, "one")),
+            CachedRecord({"id": 0, "name": 1}, (2, "two")),
+        ]
+        restored = loads(dumps(rows))
+        assert restored[1]["name"] == "two"
+        assert restored[1][0] == 2
+        assert list(restored[0].keys()) == ["id", "name"]
+        assert dict(restored[0]) == {"id": 1, "name": "one"}
+
+    def test_value_round_trip(self):
+        assert loads(dumps({"a": [1, 2]})) == {"a": [1, 2]}
+
+    def test_types_round_trip(self):
+        value = {
+            "datetime": datetime(2024, 1, 2, 3, 4, 5, 6, tzinfo=timezone.utc),
+            "date": date(2024, 1, 2),
+            "decimal": Decimal("1.10"),
+            "bytes": b"\x00tile",
+            "nested": [{"when": date(2024, 1, 3)}],
+        }
+        assert loads(dumps(value)) == value
+        rows = [CachedRecord({"day": 0}, (date(2024, 1, 2),))]
+        assert loads(dumps(rows))[0]["day"] == date(2024, 1, 2)
+
+    def test_not_pickle(self):
+        with pytest.raises(TypeError):
+            dumps(object())
+        with pytest.raises(ValueError):
+            loads(pickle.dumps(("value", 1)))
+
+
+class TestTieredCache:
+    def test_endpoint_stats(self):
+        async def run():
+            cache = TieredCache(
+                max_bytes=10_000, plugins=[EndpointHitMissRatioPlugin()]
+            )
+            current_endpoint.set("/v2/latest")
+            await cache.get("a")
+            await cache.set("a", [1, 2, 3], ttl=60)
+            assert await cache.get("a") == [1, 2, 3]
+            return cache.stats()
+
+        stats = asyncio.run(run())
+        assert stats["endpoints"]["/v2/latest"]["total"] == 2
+        assert stats["endpoints"]["/v2/latest"]["hits"] == 1
+        assert stats["endpoints"]["/v2/latest"]["evictions"] == 0
+        assert stats["shared"] is False
+
+
+class TestSingleFlight:
+    def test_concurrent_calls_are_coalesced(self):
+        calls = []
+
+        async def query():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return [1, 2, 3]
+
+        async def run():
+            flight = SingleFlight()
+            current_endpoint.set("/v2/latest")
+            results = await asyncio.gather(
+                *[flight.do("a", query) for _ in range(5)]
+            )
+            return flight, results
+
+        flight, results = asyncio.run(run())
+        assert len(calls) == 1
+        assert results == [[1, 2, 3]] * 5
+        assert flight.stats()["coalesced"] == {"/v2/latest": 4}
+        assert len(flight) == 0
+
+    def test_errors_are_shared_and_not_cached(self):
+        async def query():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        async def run():
+            flight = SingleFlight()
+            results = await asyncio.gather(
+                flight.do("a", query), flight.do("a", query), return_exceptions=True
+            )
+            return flight, results
+
+        flight, results = asyncio.run(run())
+        assert all(isinstance(r, ValueError) for r in results)
+        assert len(flight) == 0
+
+
+class TestStaleWhileRevalidate:
+    def test_stale_value_served_then_refreshed(self):
+        calls = []
+
+        @cached_swr(ttls=lambda endpoint: (0.05, 60), cache=TieredCache)
+        async def query():
+            calls.append(1)
+            return len(calls)
+
+        async def run():
+            current_endpoint.set("/v2/latest")
+            first = await query()
+            await asyncio.sleep(0.06)
+            stale = await query()
+            # let the background refresh finish
+            await asyncio.sleep(0.01)
+            fresh = await query()
+            return first, stale, fresh
+
+        assert asyncio.run(run()) == (1, 1, 2)
+        assert query.swr.stats()["stale"] == {"/v2/latest": 1}
+        assert query.swr.stats()["refreshes"] == {"/v2/latest": 1}
+
+    def test_stamped_records_round_trip(self):
+        rows = [CachedRecord({"id": 0}, (1,))]
+        restored = loads(dumps(Stamped(10.0, rows)))
+        assert restored.stored_at == 10.0
+        assert restored.value[0]["id"] == 1
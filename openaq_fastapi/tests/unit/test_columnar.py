@@ -0,0 +1,77 @@
+import asyncio
+import io
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+from openaq_fastapi.columnar import arrow_stream, parquet_stream  # noqa: E402
+from openaq_fastapi.routers.measurements import meas_columns  # noqa: E402
+from openaq_fastapi.v3.routers.measurements import measurements_columns  # noqa: E402
+
+columns = [
+    ("id", "int32", lambda r: r["id"]),
+    ("datetime", "timestamp", lambda r: r["datetime"]),
+    ("value", "float64", lambda r: r["value"]),
+]
+start = datetime(2023, 1, 1, tzinfo=timezone.utc)
+
+
+async def rows(n):
+    for i in range(n):
+        yield {"id": i, "datetime": start + timedelta(hours=i), "value": i / 2}
+
+
+def collect(chunks):
+    async def run():
+        return [chunk async for chunk in chunks]
+
+    return asyncio.run(run())
+
+
+class TestArrowStream:
+    def test_round_trip(self):
+        chunks = collect(arrow_stream(rows(25), columns, batch_size=10))
+        table = pa.ipc.open_stream(b"".join(chunks)).read_all()
+        assert table.schema.field("id").type == pa.int32()
+        assert table.schema.field("datetime").type == pa.timestamp("us", tz="UTC")
+        assert table.num_rows == 25
+        assert table.column("value").to_pylist()[-1] == 12.0
+
+    def test_empty(self):
+        chunks = collect(arrow_stream(rows(0), columns))
+        assert pa.ipc.open_stream(b"".join(chunks)).read_all().num_rows == 0
+
+
+class TestParquetStream:
+    def test_row_groups(self):
+        chunks = collect(parquet_stream(rows(25), columns, batch_size=10))
+        # row groups are written out as they are filled
+        assert len([c for c in chunks if c]) > 2
+        parquet = pq.ParquetFile(io.BytesIO(b"".join(chunks)))
+        assert parquet.metadata.num_row_groups == 3
+        table = parquet.read()
+        assert table.column("datetime").to_pylist()[1] == start + timedelta(hours=1)
+
+
+
+class TestMeasurementsColumns:
+    @pytest.mark.parametrize("columns", [meas_columns, measurements_columns])
+    def test_numeric_values(self, columns):
+        # numeric columns come back as Decimal, which arrow will not take
+        chunks = collect(
+            arrow_stream(
+                aiter_values([Decimal("1.5"), None]),
+                [c for c in columns if c[0] == "value"],
+            )
+        )
+        table = pa.ipc.open_stream(b"".join(chunks)).read_all()
+        assert table.column("value").to_pylist() == [1.5, None]
+
+
+async def aiter_values(values):
+    for value in values:
+        yield {"value": value}
@@ -0,0 +1,95 @@
+import asyncio
+
+from openaq_fastapi.counts import (
+    CountMode,
+    count_sql,
+    estimate_sql,
+    plan_rows,
+    unpaged,
+    without_total,
+)
+from openaq_fastapi.db import DB
+from openaq_fastapi.v3.routers.locations import LocationsQueries, locations_sql
+from openaq_fastapi.v3.models.queries import QueryBuilder
+
+v2_sql = """
+    SELECT l.id
+    , name
+    , COUNT(1) OVER() as found
+    FROM locations_view_cached l
+    WHERE city = ANY(:city)
+    ORDER BY city asc nulls last
+    LIMIT :limit
+    OFFSET :offset;
+    """
+
+
+class TestSql:
+    def test_without_total(self):
+        sql = without_total(v2_sql)
+        assert "COUNT" not in sql
+        assert "LIMIT :limit" in sql
+
+    def test_without_total_needs_total_and_paging(self):
+        assert without_total("SELECT 1 LIMIT :limit") is None
+        assert without_total("SELECT 1, COUNT(1) OVER() as found") is None
+
+    def test_unpaged(self):
+        sql = unpaged(without_total(v2_sql))
+        assert sql.rstrip().endswith("WHERE city = ANY(:city)")
+
+    def test_order_with_expressions_kept(self):
+        sql = "SELECT 1 FROM t ORDER BY (a->>'b')::int LIMIT :limit OFFSET :offset"
+        assert unpaged(sql) == "SELECT 1 FROM t ORDER BY (a->>'b')::int"
+
+    def test_v3_locations(self):
+        query = QueryBuilder(LocationsQueries(limit=10, page=1, iso="us"))
+        sql = without_total(locations_sql(query))
+        assert sql is not None
+        assert count_sql(sql).startswith("SELECT COUNT(1) AS found FROM (")
+        assert "LIMIT" not in count_sql(sql)
+        assert estimate_sql(sql).startswith("EXPLAIN (FORMAT JSON)")
+
+    def test_plan_rows(self):
+        assert plan_rows([{"Plan": {"Plan Rows": 1234}}]) == 1234
+        assert plan_rows('[{"Plan": {"Plan Rows": 5}}]') == 5
+
+
+class FakeDB(DB):
+    def __init__(self, plan_rows=0, exact=0):
+        self.plan = [{"Plan": {"Plan Rows": plan_rows}}]
+        self.exact = exact
+        self.queries = []
+
+    @property
+    def endpoint(self):
+        return "/test"
+
+    async def fetchrow(self, query, kwargs):
+        self.queries.append(query)
+        if query.startswith("EXPLAIN"):
+            return [self.plan]
+        return [self.exact]
+
+
+class TestCount:
+    sql = without_total(v2_sql)
+
+    def count(self, db, rows, page=1, mode=CountMode.estimate):
+        kwargs = {"limit": 100, "offset": (page - 1) * 100}
+        return asyncio.run(db.count(self.sql, kwargs, mode, rows))
+
+    def test_last_page_needs_no_query(self):
+        db = FakeDB()
+        assert self.count(db, 40, page=3) == 240
+        assert db.queries == []
+
+    def test_estimate_above_threshold(self):
+        db = FakeDB(plan_rows=50000)
+        assert self.count(db, 100) == ">10000"
+        assert len(db.queries) == 1
+
+    def test_estimate_below_threshold_counts(self):
+        db = FakeDB(plan_rows=500, exact=321)
+        assert self.count(db, 100) == 321
+        assert db.queries[1].startswith("SELECT COUNT(1)")
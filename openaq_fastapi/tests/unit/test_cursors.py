@@ -0,0 +1,112 @@
+import asyncio
+import re
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from openaq_fastapi.cursors import decode_cursor, encode_cursor, next_cursor
+from openaq_fastapi.db import page_meta
+from openaq_fastapi.models.responses import OpenAQResult
+from openaq_fastapi.routers.measurements import Measurements, measurements_get
+
+
+class TestCursor:
+    def test_round_trip(self):
+        dt = datetime(2023, 3, 1, 5, tzinfo=timezone(timedelta(hours=-5)))
+        token = encode_cursor(dt, 1234)
+        assert "=" not in token
+        assert decode_cursor(token) == (dt, 1234)
+
+    @pytest.mark.parametrize(
+        "token", ["", "abc", "bm90IGpzb24", encode_cursor(datetime(2023, 1, 1), 1)]
+    )
+    def test_invalid(self, token):
+        # garbage, non json and naive datetimes are all rejected
+        with pytest.raises(ValueError):
+            decode_cursor(token)
+
+
+class TestNextCursor:
+    dt = datetime(2023, 1, 1, tzinfo=timezone.utc)
+
+    last = {"value": 1, "cursor_datetime": dt, "cursor_sensors_id": 2}
+
+    def test_full_page(self):
+        assert decode_cursor(next_cursor(self.last, 3, 3)) == (self.dt, 2)
+
+    def test_last_page(self):
+        assert next_cursor(self.last, 2, 3) is None
+        assert next_cursor(None, 0, 3) is None
+
+    def test_without_keys(self):
+        assert next_cursor({"value": 1}, 1, 1) is None
+
+    def test_only_in_cursor_meta(self):
+        meta = page_meta({"limit": 1, "page": 1}, self.last, self.last, 1)
+        assert "cursor" not in meta.dict()
+        meta = page_meta({"limit": 1, "cursor": None}, self.last, self.last, 1)
+        assert decode_cursor(meta.cursor) == (self.dt, 2)
+
+
+class PagingDB:
+    """
+    runs the measurements query over rows in memory, honouring its
+    ORDER BY and cursor where, ties left in whatever order the rows
+    happen to be in, reversed on every query as a database might
+    """
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+
+    async def fetchPage(self, sql, kwargs):
+        self.rows.reverse()
+        rows = self.rows
+        desc = "DESC" in sql
+        if "cursor_datetime" in kwargs:
+            key = (kwargs["cursor_datetime"], kwargs["cursor_sensors_id"])
+            rows = [
+                r
+                for r in rows
+                if ((r["cursor_datetime"], r["cursor_sensors_id"]) < key) == desc
+                and (r["cursor_datetime"], r["cursor_sensors_id"]) != key
+            ]
+        order = re.search(r"ORDER BY ([^\n]+)", sql).group(1)
+        if "h.sensors_id" in order:
+            rows = sorted(rows, key=lambda r: r["cursor_sensors_id"], reverse=desc)
+        rows = sorted(rows, key=lambda r: r["cursor_datetime"], reverse=desc)
+        data = rows[: kwargs["limit"]]
+        meta = page_meta(kwargs, data[0], data[-1], len(data), len(self.rows))
+        return OpenAQResult(meta=meta, results=data)
+
+
+# three sensors per hour, so every page boundary falls within a tie
+tied_rows = [
+    {
+        "cursor_datetime": datetime(2023, 1, 1, h, tzinfo=timezone.utc),
+        "cursor_sensors_id": s,
+    }
+    for h in range(3)
+    for s in (1, 2, 3)
+]
+
+
+class TestMeasurementsPaging:
+    @pytest.mark.parametrize("sort", ["desc", "asc"])
+    def test_chained_pages_with_tied_datetimes(self, sort):
+        db = PagingDB(tied_rows)
+        seen = []
+        cursor = None
+        while True:
+            m = Measurements(limit=2, page=1, cursor=cursor, sort=sort)
+            page = asyncio.run(measurements_get(db=db, m=m))
+            seen += [
+                (r["cursor_datetime"], r["cursor_sensors_id"]) for r in page.results
+            ]
+            cursor = page.meta.cursor
+            if cursor is None:
+                break
+        expected = sorted(
+            ((r["cursor_datetime"], r["cursor_sensors_id"]) for r in tied_rows),
+            reverse=sort == "desc",
+        )
+        assert seen == expected
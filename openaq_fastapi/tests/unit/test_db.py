@@ -0,0 +1,123 @@
+import asyncio
+from types import SimpleNamespace
+
+from starlette.datastructures import State
+
+from openaq_fastapi import db
+from openaq_fastapi.db import DB, keepalive, start_keepalive, warm_pool
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def fetchval(self, sql):
+        self.pool.pings += 1
+        if self.pool.fail:
+            raise OSError("connection reset")
+        return 1
+
+
+class FakeAcquire:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def __aenter__(self):
+        self.pool.open += 1
+        self.pool.peak = max(self.pool.peak, self.pool.open)
+        await asyncio.sleep(0)
+        return FakeConnection(self.pool)
+
+    async def __aexit__(self, *args):
+        self.pool.open -= 1
+
+
+class FakePool:
+    def __init__(self, max_size=10, idle=0, fail=False):
+        self.max_size = max_size
+        self.idle = idle
+        self.fail = fail
+        self.closing = False
+        self.open = self.peak = self.pings = 0
+
+    def acquire(self):
+        return FakeAcquire(self)
+
+    def get_max_size(self):
+        return self.max_size
+
+    def get_idle_size(self):
+        return self.idle
+
+    def is_closing(self):
+        return self.closing
+
+
+class TestWarmPool:
+    def test_opens_connections_at_once(self):
+        pool = FakePool()
+        asyncio.run(warm_pool(pool, 3))
+        assert pool.pings == 3
+        assert pool.peak == 3
+
+    def test_capped_at_max_size(self):
+        pool = FakePool(max_size=2)
+        asyncio.run(warm_pool(pool, 5))
+        assert pool.peak == 2
+
+    def test_failed_check_does_not_raise(self):
+        pool = FakePool(fail=True)
+        asyncio.run(warm_pool(pool, 2))
+        assert pool.pings == 2
+
+
+class TestKeepalive:
+    def test_pings_idle_until_closed(self):
+        pool = FakePool(idle=1)
+
+        async def run():
+            task = asyncio.ensure_future(keepalive(pool, 2, 0.01))
+            await asyncio.sleep(0.035)
+            pool.closing = True
+            await asyncio.wait_for(task, 1)
+
+        asyncio.run(run())
+        assert pool.pings >= 2
+        assert pool.peak == 1
+
+    def test_started_task_can_be_cancelled(self, monkeypatch):
+        monkeypatch.setattr(db.settings, "DATABASE_POOL_KEEPALIVE", 0.01)
+        pool = FakePool(idle=1)
+
+        async def run():
+            task = start_keepalive(pool)
+            await asyncio.sleep(0.015)
+            task.cancel()
+            await asyncio.sleep(0)
+            return task
+
+        assert asyncio.run(run()).cancelled()
+        monkeypatch.setattr(db.settings, "DATABASE_POOL_KEEPALIVE", 0)
+        assert start_keepalive(pool) is None
+
+
+class TestWritePool:
+    def test_created_once(self, monkeypatch):
+        created = []
+
+        async def db_write_pool(pool):
+            await asyncio.sleep(0.01)
+            created.append(object())
+            return created[-1]
+
+        monkeypatch.setattr(db, "db_write_pool", db_write_pool)
+        request = SimpleNamespace(app=SimpleNamespace(state=State()))
+
+        async def run():
+            return await asyncio.gather(
+                *[DB(request).write_pool() for _ in range(5)]
+            )
+
+        pools = asyncio.run(run())
+        assert len(created) == 1
+        assert all(pool is created[0] for pool in pools)
@@ -0,0 +1,56 @@
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+from openaq_fastapi.routers.measurements import Measurements
+from openaq_fastapi.v3.routers.locations import LocationsQueries
+from openaq_fastapi.v3.routers.measurements import LocationMeasurementsQueries
+
+app = FastAPI()
+
+
+@app.get("/v3/locations")
+async def locations(query: LocationsQueries = Depends(LocationsQueries.depends())):
+    return query.dict(exclude_unset=True)
+
+
+@app.get("/v3/locations/{locations_id}/measurements")
+async def measurements(
+    query: LocationMeasurementsQueries = Depends(LocationMeasurementsQueries.depends()),
+):
+    return {"locations_id": query.locations_id}
+
+
+@app.get("/v2/measurements")
+async def measurements_v2(query: Measurements = Depends(Measurements.depends())):
+    return {"limit": query.limit}
+
+
+client = TestClient(app)
+
+
+class TestDependencies:
+    def test_built_once(self):
+        assert LocationsQueries.depends() is LocationsQueries.depends()
+
+    def test_model_validates(self):
+        response = client.get(
+            "/v3/locations?coordinates=38.907,-77.037&radius=1000&providers_id=1,2"
+        )
+        assert response.status_code == 200
+        assert response.json()["lat"] == 38.907
+        assert response.json()["providers_id"] == [1, 2]
+
+    def test_query_error(self):
+        response = client.get("/v3/locations?limit=abc")
+        assert response.status_code == 422
+        assert response.json()["detail"][0]["loc"] == ["query", "limit"]
+
+    def test_path_error(self):
+        response = client.get("/v3/locations/abc/measurements")
+        assert response.status_code == 422
+        assert response.json()["detail"][0]["loc"] == ["path", "locations_id"]
+
+    def test_v2_error(self):
+        response = client.get("/v2/measurements?limit=abc")
+        assert response.status_code == 422
+        assert response.json()["detail"][0]["loc"] == ["query", "limit"]
@@ -0,0 +1,35 @@
+import importlib
+
+from fastapi import FastAPI
+from fastapi.staticfiles import StaticFiles
+from starlette.routing import Mount
+
+from openaq_fastapi.lazy import LazyRouters
+from openaq_fastapi.main import routers
+
+
+class TestLazyRouters:
+    def test_declared_paths_match_routers(self):
+        # the declared route table has to be kept in sync with the routers
+        for module, paths in routers.paths.items():
+            router = importlib.import_module(module).router
+            assert sorted({r.path for r in router.routes}) == sorted(paths), module
+
+    def test_load_for_path(self, tmp_path):
+        app = FastAPI()
+        app.mount("/", StaticFiles(directory=str(tmp_path)))
+        lazy = LazyRouters(
+            app,
+            [
+                ("openaq_fastapi.v3.routers.locations", ["/v3/locations/{locations_id}"]),
+                ("openaq_fastapi.v3.routers.sensors", ["/v3/sensors/{sensors_id}"]),
+            ],
+        )
+        assert lazy.match("/v3/locations/1") == ["openaq_fastapi.v3.routers.locations"]
+        lazy.load_for("/v3/locations/1")
+        assert lazy.pending == {"openaq_fastapi.v3.routers.sensors"}
+        assert "/v3/locations/{locations_id}" in [r.path for r in app.routes]
+        assert isinstance(app.routes[-1], Mount)
+        lazy.load_all()
+        assert lazy.pending == set()
+        assert isinstance(app.routes[-1], Mount)
@@ -0,0 +1,127 @@
+from datetime import timedelta
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from openaq_fastapi.middleware import (
+    CacheControlMiddleware,
+    RateLimiterMiddleWare,
+    ResponseCacheMiddleware,
+)
+
+
+class TestCacheControl:
+    middleware = CacheControlMiddleware(
+        None,
+        cachecontrol="public, max-age=900",
+        paths={
+            "/v3/locations/tiles": "public, max-age=300",
+            "/v3/locations/tiles/mobile": "public, max-age=3600",
+            "/ping/": "no-store",
+        },
+    )
+
+    def test_longest_prefix(self):
+        assert self.middleware.policy("/v3/locations/tiles/1/0/0.pbf") == "public, max-age=300"
+        assert self.middleware.policy("/v3/locations/tiles/mobile/1/0/0.pbf") == "public, max-age=3600"
+        assert self.middleware.policy("/v3/locations/tiles/mobile-paths/1/0/0.pbf") == "public, max-age=300"
+
+    def test_default(self):
+        assert self.middleware.policy("/v3/locations") == "public, max-age=900"
+        assert self.middleware.policy("/ping") == "no-store"
+        assert self.middleware.policy("/pingpong") == "public, max-age=900"
+
+
+class TestResponseCache:
+    middleware = ResponseCacheMiddleware(
+        None, cache=None, paths=["/v2/latest", "/v3/locations/"], ttl=60
+    )
+
+    def test_exact_paths(self):
+        assert self.middleware.cached_path("/v2/latest") == "/v2/latest"
+        assert self.middleware.cached_path("/v3/locations") == "/v3/locations"
+        assert self.middleware.cached_path("/v3/locations/1") is None
+        assert self.middleware.cached_path("/v3/locations/tiles/1/0/0.pbf") is None
+
+
+class FakeRedis:
+    """answers the token bucket script from a list of results"""
+
+    def __init__(self, results, keys=()):
+        self.results = list(results)
+        self.keys = None if keys is None else set(keys)
+        self.calls = []
+
+    async def evalsha(self, sha, numkeys, key, *args):
+        from redis.exceptions import NoScriptError
+
+        self.calls.append(("evalsha", key))
+        if len(self.calls) == 1:
+            raise NoScriptError("NOSCRIPT")
+        return self.results.pop(0)
+
+    async def eval(self, script, numkeys, key, *args):
+        self.calls.append(("eval", key))
+        return self.results.pop(0)
+
+    async def sismember(self, name, key):
+        self.calls.append(("sismember", key))
+        if self.keys is None:
+            raise ConnectionError("redis is down")
+        return key in self.keys
+
+
+def limited_app(redis_client):
+    app = FastAPI()
+
+    @app.get("/v3/locations")
+    async def locations():
+        return {}
+
+    app.add_middleware(
+        RateLimiterMiddleWare,
+        redis_client=redis_client,
+        rate_amount=2,
+        rate_amount_key=10,
+        rate_time=timedelta(minutes=1),
+    )
+    return TestClient(app)
+
+
+class TestRateLimiter:
+    def test_token_bucket(self):
+        redis_client = FakeRedis([[1, 1, 0], [0, 0, 30]])
+        client = limited_app(redis_client)
+        assert client.get("/v3/locations").status_code == 200
+        response = client.get("/v3/locations")
+        assert response.status_code == 429
+        assert response.headers["retry-after"] == "30"
+        # the script is loaded once, then run by its sha
+        assert [c[0] for c in redis_client.calls] == ["evalsha", "eval", "evalsha"]
+
+    def test_valid_keys_are_remembered(self):
+        redis_client = FakeRedis([[1, 9, 0]] * 2, keys=["abc"])
+        client = limited_app(redis_client)
+        for _ in range(2):
+            assert client.get("/v3/locations", headers={"x-api-key": "abc"}).status_code == 200
+        assert [c for c in redis_client.calls if c[0] == "sismember"] == [("sismember", "abc")]
+        assert redis_client.calls[-1] == ("evalsha", "ratelimit:abc")
+        response = client.get("/v3/locations", headers={"x-api-key": "other"})
+        assert response.status_code == 401
+
+    def test_unavailable_redis(self):
+        client = limited_app(FakeRedis([]))
+        # evalsha raises and then eval has nothing to return
+        assert client.get("/v3/locations").status_code == 200
+
+    def test_unavailable_redis_for_keys(self):
+        redis_client = FakeRedis([[1, 1, 0]] * 2, keys=None)
+        client = limited_app(redis_client)
+        for _ in range(2):
+            response = client.get("/v3/locations", headers={"x-api-key": "abc"})
+            assert response.status_code == 200
+        # unverified keys are limited as anonymous and not remembered
+        assert [c for c in redis_client.calls if c[0] == "sismember"] == [
+            ("sismember", "abc")
+        ] * 2
+        assert redis_client.calls[-1] == ("evalsha", "ratelimit:testclient")
@@ -1,4 +1,7 @@
+from openaq_fastapi.cursors import encode_cursor
 from openaq_fastapi.v3.models.queries import (
+    CursorQuery,
+    DateFromQuery,
     MobileQuery,
     MonitorQuery,
     OwnerQuery,
@@ -11,8 +14,10 @@ from openaq_fastapi.v3.routers.locations import (
     LocationQuery,
     LocationsQueries,
 )
+from openaq_fastapi.v3.routers.measurements import LocationMeasurementsQueries
 
 from buildpg import render
+from datetime import datetime, timezone
 import fastapi
 import pytest
 
@@ -21,6 +26,33 @@ class TestPaging:
     ...
 
 
+class TestCursorQuery:
+    def test_has_value(self):
+        dt = datetime(2023, 1, 1, tzinfo=timezone.utc)
+        cursor_query = CursorQuery(cursor=encode_cursor(dt, 42))
+        assert (
+            cursor_query.where()
+            == "(h.datetime, h.sensors_id) > (:cursor_datetime, :cursor_sensors_id)"
+        )
+        assert cursor_query.cursor_datetime == dt
+        assert cursor_query.cursor_sensors_id == 42
+
+    def test_no_value(self):
+        cursor_query = CursorQuery()
+        assert cursor_query.where() is None
+
+    def test_invalid_value(self):
+        with pytest.raises(fastapi.exceptions.HTTPException):
+            CursorQuery(cursor="not-a-cursor")
+
+    def test_not_with_page(self):
+        cursor = encode_cursor(datetime(2023, 1, 1, tzinfo=timezone.utc), 42)
+        with pytest.raises(fastapi.exceptions.HTTPException):
+            LocationMeasurementsQueries(locations_id=1, page=2, cursor=cursor)
+        query = LocationMeasurementsQueries(locations_id=1, page=1, cursor=cursor)
+        assert "cursor_sensors_id" in QueryBuilder(query).where()
+
+
 class TestMobileQuery:
     def test_has_value(self):
         mobile_query = MobileQuery(mobile=True)
@@ -156,6 +188,19 @@ class TestQueryBuilder:
         query_builder = QueryBuilder(query)
         assert query_builder.where() == expected
 
+    def test_where_method_reuses_plan(self):
+        first = QueryBuilder(QueryContainer(iso="us", monitor=True)).where()
+        second = QueryBuilder(QueryContainer(iso="ca", monitor=False)).where()
+        assert first == second
+
+    def test_where_method_datetime_awareness(self):
+        aware = QueryBuilder(DateFromQuery(date_from="2022-01-01T00:00:00Z"))
+        naive = QueryBuilder(DateFromQuery(date_from="2022-01-01T00:00:00"))
+        assert aware.where() == "WHERE datetime > :date_from"
+        assert naive.where() == (
+            "WHERE datetime > (:date_from::timestamp AT TIME ZONE timezone)"
+        )
+
     def test_fields_method_none(self):
         country_query = CountryQuery(iso="us")
         query_builder = QueryBuilder(country_query)
@@ -0,0 +1,151 @@
+import asyncio
+
+from openaq_fastapi.settings import settings
+from openaq_fastapi.snapshots import Snapshot, Snapshots, sort_key
+
+rows = [
+    {"id": 1, "name": "pm25", "units": "µg/m³"},
+    {"id": 2, "name": "o3", "units": None},
+    {"id": 3, "name": "no2", "units": "ppm"},
+]
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def fetch(self, sql):
+        self.pool.fetches += 1
+        if self.pool.fail:
+            raise OSError("connection refused")
+        return list(self.pool.rows)
+
+
+class FakeAcquire:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def __aenter__(self):
+        return FakeConnection(self.pool)
+
+    async def __aexit__(self, *args):
+        return False
+
+
+class FakePool:
+    def __init__(self, rows, fail=False):
+        self.rows = rows
+        self.fail = fail
+        self.fetches = 0
+
+    def acquire(self):
+        return FakeAcquire(self)
+
+
+class FakeDB:
+    def __init__(self, pool):
+        self._pool = pool
+
+    async def pool(self):
+        return self._pool
+
+
+def loaded(name="params"):
+    snapshot = Snapshot(name, "SELECT * FROM measurands")
+    asyncio.run(snapshot.load(FakePool(rows)))
+    return snapshot
+
+
+class TestSnapshot:
+    def test_sort_key_nulls_last(self):
+        ordered = sorted(rows, key=sort_key("units"))
+        assert [r["id"] for r in ordered] == [3, 1, 2]
+        ordered = sorted(rows, key=sort_key("units"), reverse=True)
+        assert ordered[0]["id"] == 2
+
+    def test_page(self):
+        result = loaded().page({"limit": 2, "page": 2}, order_by="name")
+        assert result.meta.found == 3
+        assert [r["name"] for r in result.results] == ["pm25"]
+
+    def test_page_where(self):
+        result = loaded().page(
+            {"limit": 100, "page": 1}, lambda r: r["id"] > 1, "id", reverse=True
+        )
+        assert result.meta.found == 2
+        assert [r["id"] for r in result.results] == [3, 2]
+
+    def test_sorts_text_in_query_order_only(self):
+        snapshot = Snapshot("params", "SELECT * FROM measurands", order="name")
+        # as the database returned them, "o3" < "no2" in no collation
+        asyncio.run(snapshot.load(FakePool([rows[1], rows[2], rows[0]])))
+        assert snapshot.sorts("id") and snapshot.sorts("name")
+        assert not snapshot.sorts("units")
+        result = snapshot.page({"limit": 2, "page": 1}, order_by="name")
+        assert [r["id"] for r in result.results] == [2, 3]
+        result = snapshot.page({"limit": 2, "page": 1}, order_by="name", reverse=True)
+        assert [r["id"] for r in result.results] == [1, 3]
+
+    def test_get(self):
+        snapshot = loaded()
+        assert snapshot.get({}, 2).results == [rows[1]]
+        missing = snapshot.get({}, 4)
+        assert missing.meta.found == 0 and missing.results == []
+
+    def test_ensure_loads_once(self):
+        pool = FakePool(rows)
+        snapshot = Snapshot("params", "SELECT 1")
+
+        async def run():
+            return await asyncio.gather(
+                *(snapshot.ensure(FakeDB(pool)) for _ in range(5))
+            )
+
+        assert asyncio.run(run()) == [True] * 5
+        assert pool.fetches == 1
+        assert snapshot.stats()["rows"] == 3
+
+    def test_ensure_falls_back(self, monkeypatch):
+        snapshot = Snapshot("params", "SELECT 1")
+        assert not asyncio.run(snapshot.ensure(FakeDB(FakePool(rows, fail=True))))
+        assert not snapshot.loaded
+        monkeypatch.setattr(settings, "API_SNAPSHOTS", False)
+        assert not asyncio.run(snapshot.ensure(FakeDB(FakePool(rows))))
+
+
+class TestSnapshots:
+    def test_listen_needs_url(self, monkeypatch):
+        monkeypatch.setattr(settings, "API_SNAPSHOT_LISTEN_URL", None)
+        monkeypatch.setattr(settings, "DATABASE_WRITE_URL", "postgres://primary/db")
+        s = Snapshots()
+        asyncio.run(s._listen())
+        assert s._listener is None
+
+    def test_notify(self):
+        s = Snapshots()
+        s.notify(None, 1, "openaq_snapshots", "v3_parameters")
+        s.notify(None, 1, "openaq_snapshots", "")
+        assert s.pending == {"v3_parameters", "*"}
+
+    def test_refresh_only_loaded(self):
+        s = Snapshots()
+        a = s.register("a", "SELECT 1")
+        b = s.register("b", "SELECT 2")
+        c = s.register("c", "SELECT 3")
+        pool = FakePool(rows)
+        asyncio.run(a.load(pool))
+        asyncio.run(b.load(pool))
+        pool.rows = rows[:1]
+        asyncio.run(s.refresh(pool, {"a", "c"}))
+        assert len(a.rows) == 1
+        assert len(b.rows) == 3
+        assert not c.loaded
+        assert s.refreshes == 1
+
+    def test_refresh_errors_keep_rows(self):
+        s = Snapshots()
+        a = s.register("a", "SELECT 1")
+        asyncio.run(a.load(FakePool(rows)))
+        asyncio.run(s.refresh(FakePool(rows, fail=True)))
+        assert len(a.rows) == 3
+        assert s.refresh_errors == 1
@@ -0,0 +1,158 @@
+import asyncio
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from openaq_fastapi.models.queries import Geo  # noqa: E402
+from openaq_fastapi.routers.locations import Locations, latest_get  # noqa: E402
+from openaq_fastapi.spatial import (  # noqa: E402
+    GridIndex,
+    LocationIndex,
+    candidates,
+    distance_order,
+    haversine,
+    locations_index,
+    meters_per_degree,
+    radius_bboxes,
+)
+from openaq_fastapi.v3.models.queries import BboxQuery, QueryBuilder, RadiusQuery  # noqa: E402
+
+
+def random_points(n=20000, seed=1):
+    rng = np.random.default_rng(seed)
+    lons = rng.uniform(-180, 180, n)
+    lats = np.degrees(np.arcsin(rng.uniform(-1, 1, n)))
+    return np.arange(1, n + 1), lons, lats
+
+
+@pytest.fixture
+def grid():
+    return GridIndex(*random_points(), cell=0.5)
+
+
+class TestGridIndex:
+    def test_haversine(self):
+        # one degree of latitude
+        d = haversine(0.0, 0.0, np.array([0.0]), np.array([1.0]))
+        assert d[0] == pytest.approx(111195, rel=1e-4)
+
+    def test_bbox_matches_brute_force(self, grid):
+        ids, lons, lats = random_points()
+        for bbox in [(-77.2, 38.7, -76.9, 39.0), (10, -60, 40, 10), (-180, -90, 180, 90)]:
+            minx, miny, maxx, maxy = bbox
+            expected = ids[(lons >= minx) & (lons <= maxx) & (lats >= miny) & (lats <= maxy)]
+            assert sorted(grid.bbox(*bbox)) == sorted(expected)
+
+    def test_radius_matches_brute_force(self, grid):
+        ids, lons, lats = random_points()
+        for lon, lat, meters in [(0, 0, 300000), (179.9, 10, 500000), (-30, 89.5, 200000)]:
+            expected = ids[haversine(lon, lat, lons, lats) <= meters]
+            assert sorted(grid.radius(lon, lat, meters)) == sorted(expected)
+
+    def test_radius_bboxes_antimeridian(self):
+        assert len(radius_bboxes(179.99, 0, 25000)) == 2
+        assert len(radius_bboxes(0, 0, 25000)) == 1
+        assert radius_bboxes(0, 89.9, 25000)[0][0] == -180
+
+    def test_empty(self):
+        grid = GridIndex([], [], [])
+        assert len(grid.bbox(-10, -10, 10, 10)) == 0
+        assert len(grid.radius(0, 0, 1000)) == 0
+
+
+class TestCandidates:
+    @pytest.fixture(autouse=True)
+    def index(self, monkeypatch):
+        index = LocationIndex("locations_index", "")
+        index.build([{"id": 1, "lon": -77.03, "lat": 38.9}, {"id": 2, "lon": 2.35, "lat": 48.85}])
+        monkeypatch.setattr(locations_index, "grid", index.grid)
+
+    def test_v3_radius(self):
+        query = RadiusQuery(coordinates="38.907,-77.037", radius=2000)
+        assert candidates(query) == [1]
+        query.spatial_ids = [1]
+        assert "id = ANY(:spatial_ids)" in QueryBuilder(query).where()
+
+    def test_v3_bbox(self):
+        assert candidates(BboxQuery(bbox="0,40,10,50")) == [2]
+
+    def test_v2_geo(self):
+        geo = Geo(coordinates="48.85,2.35")
+        assert candidates(geo) == [2]
+        geo.spatial_ids = [2]
+        assert "l.id = ANY(:spatial_ids)" in geo.where_geo()
+
+    def test_no_spatial_filter(self):
+        assert candidates(BboxQuery()) is None
+
+
+class TestNearest:
+    def test_matches_sort(self, grid):
+        ids, lons, lats = random_points()
+        order = np.argsort(haversine(10, 20, lons, lats), kind="stable")
+        assert list(grid.nearest(10, 20, 50)) == list(ids[order][:50])
+        assert list(grid.nearest(10, 20, 50, reverse=True)) == list(ids[order][::-1][:50])
+
+    def test_within_radius(self, grid):
+        ids, lons, lats = random_points()
+        distances = haversine(10, 20, lons, lats)
+        inside = distances <= 500000
+        expected = ids[inside][np.argsort(distances[inside], kind="stable")]
+        assert list(grid.nearest(10, 20, 10000, meters=500000)) == list(expected)
+        assert list(grid.nearest(10, 20, 5, meters=500000)) == list(expected[:5])
+
+    def test_distance_order(self, monkeypatch):
+        index = LocationIndex("locations_index", "")
+        index.build(
+            [
+                {"id": 1, "lon": -77.03, "lat": 38.9},
+                {"id": 2, "lon": -77.04, "lat": 38.9},
+                {"id": 3, "lon": -77.2, "lat": 38.9},
+            ]
+        )
+        monkeypatch.setattr(locations_index, "grid", index.grid)
+        query = Locations(coordinates="38.9,-77.04", radius=25000, order_by="distance")
+        query.sort = "asc"
+        assert distance_order(query) == [2, 1, 3]
+        query.limit = 1
+        query.sort = "desc"
+        assert distance_order(query) == [3]
+        query.country = ["US"]
+        assert distance_order(query) is None
+
+    def test_distance_order_near_radius(self, monkeypatch):
+        # 1 and 2 are well within 25 km, 3 is 25.1 km away, within the
+        # margin but out for the database
+        lon = -77.04
+        step = 1 / (meters_per_degree * np.cos(np.radians(38.9)))
+        lons = {1: lon + 10000 * step, 2: lon + 20000 * step, 3: lon + 25100 * step}
+        index = LocationIndex("locations_index", "")
+        index.build([{"id": i, "lon": x, "lat": 38.9} for i, x in lons.items()])
+        monkeypatch.setattr(locations_index, "grid", index.grid)
+        query = Locations(coordinates=f"38.9,{lon}", radius=25000, order_by="distance", limit=1)
+        assert query.sort == "desc"
+        ids = distance_order(query)
+        assert ids == [3, 2]
+        # what is left once the database drops 3 still starts the page
+        inside = haversine(lon, 38.9, np.array([lons[i] for i in ids]), 38.9) <= 25000
+        assert [i for i, keep in zip(ids, inside) if keep][:1] == [2]
+        query.sort = "asc"
+        assert distance_order(query) == [1, 2]
+
+    def test_latest_is_ordered_by_the_database(self, monkeypatch):
+        index = LocationIndex("locations_index", "")
+        index.build([{"id": 1, "lon": -77.03, "lat": 38.9}])
+        monkeypatch.setattr(locations_index, "grid", index.grid)
+
+        class FakeDB:
+            async def fetchPage(self, query, params):
+                self.query = query
+                self.params = params
+
+        db = FakeDB()
+        query = Locations(coordinates="38.9,-77.04", radius=25000, order_by="distance")
+        asyncio.run(latest_get(db=db, locations=query, format=None))
+        assert db.params["spatial_ids"] == [1]
+        assert "distance_ids" not in db.params
+        assert "st_distance" in db.query
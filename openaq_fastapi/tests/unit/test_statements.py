@@ -0,0 +1,98 @@
+import asyncio
+from collections import OrderedDict
+
+import asyncpg
+
+from openaq_fastapi.statements import ShapeRegistry, StatementConnection, normalize
+
+
+class TestNormalize:
+    def test_whitespace_and_comments(self):
+        a = normalize("SELECT id\n  , name -- the name\nFROM locations\n")
+        b = normalize("SELECT id , name\n\tFROM   locations")
+        assert a == b == "SELECT id , name FROM locations"
+
+    def test_literals_untouched(self):
+        sql = "SELECT 'a  --b' AS \"x  y\""
+        assert normalize(sql) == sql
+
+
+class TestShapeRegistry:
+    def test_hit_ratio(self):
+        registry = ShapeRegistry()
+        registry.record("SELECT 1", False)
+        registry.record("SELECT 1", True)
+        registry.record("SELECT 1", True)
+        registry.record("SELECT 2", False)
+        stats = registry.stats()
+        assert stats["shapes"] == 2
+        assert stats["hit_ratio"] == 0.5
+        assert stats["top"][0]["sql"] == "SELECT 1"
+        assert stats["top"][0]["calls"] == 3
+
+    def test_bounded(self):
+        registry = ShapeRegistry(max_shapes=2)
+        registry.record("SELECT 1", False)
+        registry.record("SELECT 2", False)
+        registry.record("SELECT 1", True)
+        registry.record("SELECT 3", False)
+        # the least recently called shape goes first
+        assert [s["sql"] for s in registry.shapes.values()] == ["SELECT 1", "SELECT 3"]
+
+
+class Statement:
+    def __init__(self, sql, error=None):
+        self.sql = sql
+        self.error = error
+
+    async def fetch(self, *args, timeout=None):
+        if self.error is not None:
+            raise self.error
+        return [args]
+
+
+class FakeConnection(StatementConnection):
+    __slots__ = ("prepared_sqls", "errors")
+
+    async def prepare(self, sql, timeout=None):
+        self.prepared_sqls.append(sql)
+        return Statement(sql, self.errors.pop(0) if self.errors else None)
+
+    def is_in_transaction(self):
+        return False
+
+
+def connection(errors=()):
+    con = FakeConnection.__new__(FakeConnection)
+    # never connected, reads as closed
+    con._aborted = True
+    con._prepared = OrderedDict()
+    con._max_prepared = 10
+    con.prepared_sqls = []
+    con.errors = list(errors)
+    return con
+
+
+class TestStatementConnection:
+    def test_reuses_statements(self):
+        con = connection()
+        assert asyncio.run(con.fetch_prepared("SELECT  $1", 1)) == [(1,)]
+        asyncio.run(con.fetch_prepared("SELECT $1", 2))
+        assert con.prepared_sqls == ["SELECT $1"]
+
+    def test_invalid_cached_statement(self):
+        error = asyncpg.exceptions.InvalidCachedStatementError("cached plan changed")
+        con = connection([None])
+        asyncio.run(con.fetch_prepared("SELECT $1", 1))
+        con._prepared["SELECT $1"].error = error
+        assert asyncio.run(con.fetch_prepared("SELECT $1", 2)) == [(2,)]
+        assert con.prepared_sqls == ["SELECT $1", "SELECT $1"]
+        assert asyncio.run(con.fetch_prepared("SELECT $1", 3)) == [(3,)]
+
+    def test_outdated_schema(self):
+        con = connection()
+        asyncio.run(con.fetch_prepared("SELECT 1"))
+        asyncio.run(con.fetch_prepared("SELECT 2"))
+        con._prepared["SELECT 2"].error = asyncpg.exceptions.OutdatedSchemaCacheError("x")
+        assert asyncio.run(con.fetch_prepared("SELECT 2")) == [()]
+        assert list(con._prepared) == ["SELECT 2"]
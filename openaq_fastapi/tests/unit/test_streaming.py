@@ -0,0 +1,128 @@
+import asyncio
+import csv
+import io
+from decimal import Decimal
+
+import orjson
+
+from openaq_fastapi.routers.measurements import meas_csv
+from openaq_fastapi.streaming import csv_chunks, ndjson, ndjson_page
+
+
+async def aiter(rows):
+    for row in rows:
+        yield row
+
+
+def collect(chunks):
+    async def run():
+        return [chunk async for chunk in chunks]
+
+    return asyncio.run(run())
+
+
+class TestNdjson:
+    def test_lines(self):
+        rows = [{"id": i, "value": Decimal("1.5"), "key": i} for i in range(5)]
+        chunks = collect(ndjson(aiter(rows), exclude=("key",), chunk_size=2))
+        assert len(chunks) == 3
+        lines = b"".join(chunks).splitlines()
+        assert [orjson.loads(line) for line in lines] == [
+            {"id": i, "value": 1.5} for i in range(5)
+        ]
+
+    def test_trailer(self):
+        rows = [{"id": i, "found": 10} for i in range(3)]
+        chunks = collect(
+            ndjson(
+                aiter(rows),
+                exclude=("found",),
+                trailer=lambda first, last, count: {
+                    "meta": {"found": first["found"], "last": last["id"], "n": count}
+                },
+            )
+        )
+        lines = [orjson.loads(line) for line in b"".join(chunks).splitlines()]
+        assert lines[:3] == [{"id": 0}, {"id": 1}, {"id": 2}]
+        assert lines[3] == {"meta": {"found": 10, "last": 2, "n": 3}}
+
+    def test_trailer_without_rows(self):
+        chunks = collect(
+            ndjson(aiter([]), trailer=lambda first, last, count: {"n": count})
+        )
+        assert chunks == [b'{"n":0}\n']
+
+
+class IterDB:
+    def __init__(self, rows):
+        self.rows = rows
+        self.sql = None
+
+    def iterate(self, sql, kwargs):
+        self.sql = sql
+        return aiter(self.rows)
+
+
+class TestNdjsonPage:
+    def test_without_window_count(self):
+        db = IterDB([{"id": 1}, {"id": 2}])
+        sql = """
+        SELECT id
+        , COUNT(1) OVER() as found
+        FROM locations
+        LIMIT :limit
+        OFFSET :offset
+        """
+        response = ndjson_page(db, sql, {"limit": 2, "page": 1})
+        lines = [
+            orjson.loads(line)
+            for line in b"".join(collect(response.body_iterator)).splitlines()
+        ]
+        assert "OVER" not in db.sql
+        assert lines[:2] == [{"id": 1}, {"id": 2}]
+        assert lines[2]["meta"]["found"] == ">2"
+
+
+class TestCsvChunks:
+    def test_chunks(self):
+        chunks = collect(
+            csv_chunks(aiter(range(5)), ["a", "b"], lambda r: [r, r * 2], chunk_size=2)
+        )
+        assert len(chunks) == 3
+        assert b"".join(chunks).decode().splitlines() == [
+            "a,b",
+            "0,0",
+            "1,2",
+            "2,4",
+            "3,6",
+            "4,8",
+        ]
+
+    def test_empty(self):
+        chunks = collect(csv_chunks(aiter([]), ["a"], lambda r: [r]))
+        assert b"".join(chunks) == b"a\r\n"
+
+
+class TestMeasCsv:
+    row = {
+        "locationId": 1,
+        "location": "a, b",
+        "country": "US",
+        "date": {"utc": "2023-01-01T00:00:00Z", "local": "2022-12-31T19:00:00-05:00"},
+        "parameter": "pm25",
+        "value": 3.2,
+        "unit": "µg/m³",
+        "coordinates": {"latitude": 1.5, "longitude": 2.5},
+        "sourceName": "source",
+    }
+
+    def test_include_fields(self):
+        body = b"".join(
+            collect(meas_csv(aiter([self.row]), "sourceName,bogus,attribution"))
+        )
+        header, row = list(csv.reader(io.StringIO(body.decode())))
+        assert header[-2:] == ["sourceName", "attribution"]
+        assert row[1] == "a, b"
+        assert row[4] == "2023-01-01T00:00:00Z"
+        # requested fields the query does not select are left empty
+        assert row[-2:] == ["source", ""]
@@ -0,0 +1,171 @@
+import asyncio
+import gzip
+import time
+
+from starlette.requests import Request
+
+from openaq_fastapi import tilecache
+from openaq_fastapi.tilecache import (
+    CachedTile,
+    DiskTileStore,
+    TileCache,
+    cached_tile,
+    normalize,
+    store_from_url,
+    tile_key,
+    tile_response,
+    tiles,
+    version_etag,
+)
+
+
+def request(headers=None):
+    return Request(
+        {
+            "type": "http",
+            "method": "GET",
+            "path": "/",
+            "headers": [(k.encode(), v.encode()) for k, v in (headers or {}).items()],
+            "query_string": b"",
+        }
+    )
+
+
+class Renderer:
+    def __init__(self, vt=b"tile"):
+        self.vt = vt
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return self.vt
+
+
+class TestKeys:
+    def test_normalize(self):
+        a = {"z": 1, "x": 0, "y": 0, "parameters_id": [2, 1], "active": None}
+        b = {"parameters_id": [1, 2], "y": 0, "x": 0, "z": 1}
+        assert normalize(a) == normalize(b)
+        assert tile_key("v3", a) == tile_key("v3", b)
+        assert tile_key("v3", a) != tile_key("v2", a)
+
+    def test_tiles(self):
+        assert len(list(tiles(2))) == 1 + 4 + 16
+
+
+class TestTileCache:
+    def test_fetch_renders_once(self):
+        cache = TileCache(1024 * 1024, 60)
+        render = Renderer()
+
+        async def run():
+            return await asyncio.gather(*(cache.fetch("k", render) for _ in range(5)))
+
+        results = asyncio.run(run())
+        assert render.calls == 1
+        assert gzip.decompress(results[0].body) == b"tile"
+        asyncio.run(cache.fetch("k", render))
+        assert cache.hits == 1 and cache.misses == 1
+
+    def test_empty_tile(self):
+        cache = TileCache(1024 * 1024, 60)
+        tile = asyncio.run(cache.fetch("k", Renderer(None)))
+        assert tile.body == b""
+        assert tile_response(request(), tile).status_code == 204
+
+    def test_disk_store(self, tmp_path):
+        store = DiskTileStore(str(tmp_path))
+        cache = TileCache(1024 * 1024, 60, store)
+        tile = asyncio.run(cache.fetch("openaq:tile:abc", Renderer()))
+        # a fresh process only has the shared store
+        other = TileCache(1024 * 1024, 60, store)
+        render = Renderer()
+        assert asyncio.run(other.fetch("openaq:tile:abc", render)).etag == tile.etag
+        assert render.calls == 0 and other.store_hits == 1
+
+    def test_disk_store_keeps_etag(self, tmp_path):
+        store = DiskTileStore(str(tmp_path))
+        asyncio.run(store.set("k", CachedTile.rendered(b"tile", '"v1"')))
+        assert asyncio.run(store.get("k")).etag == '"v1"'
+
+    def test_stale_version(self, tmp_path):
+        cache = TileCache(1024 * 1024, 60, DiskTileStore(str(tmp_path)))
+        render = Renderer()
+        asyncio.run(cache.fetch("k", render, '"v1"'))
+        assert asyncio.run(cache.fetch("k", render, '"v1"')).etag == '"v1"'
+        other = TileCache(1024 * 1024, 60, cache.store)
+        assert asyncio.run(other.fetch("k", render, '"v2"')).etag == '"v2"'
+        assert render.calls == 2
+
+    def test_store_ttl(self, tmp_path):
+        store = DiskTileStore(str(tmp_path))
+        asyncio.run(store.set("k", CachedTile.from_body(b"old", time.time() - 100)))
+        cache = TileCache(1024 * 1024, 60, store, store_ttl=-1)
+        render = Renderer()
+        asyncio.run(cache.fetch("k", render))
+        assert render.calls == 1
+
+    def test_store_from_url(self, tmp_path):
+        assert store_from_url(None) is None
+        assert isinstance(store_from_url(f"file://{tmp_path}"), DiskTileStore)
+        assert store_from_url("s3://bucket/tiles").prefix == "tiles"
+
+
+class TestResponse:
+    tile = CachedTile.rendered(b"tile")
+
+    def test_gzip(self):
+        response = tile_response(request({"accept-encoding": "gzip, br"}), self.tile)
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["etag"] == self.tile.etag
+
+    def test_identity(self):
+        response = tile_response(request(), self.tile)
+        assert response.body == b"tile"
+
+    def test_not_modified(self):
+        for header in (self.tile.etag, f'"other", W/{self.tile.etag}', "*"):
+            response = tile_response(request({"if-none-match": header}), self.tile)
+            assert response.status_code == 304
+        response = tile_response(request({"if-none-match": '"other"'}), self.tile)
+        assert response.status_code == 200
+
+
+class Version:
+    def __init__(self, value="2024-01-01:3:2"):
+        self.value = value
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        return self.value
+
+
+class TestVersionedTile:
+    params = {"z": 1, "x": 0, "y": 0}
+
+    def fetch(self, headers, render, version):
+        return asyncio.run(cached_tile(request(headers), "v3", self.params, render, version))
+
+    def test_not_modified_without_render(self, monkeypatch):
+        monkeypatch.setattr(tilecache, "tile_cache", TileCache(1024 * 1024, 60))
+        etag = version_etag(tile_key("v3", self.params), "2024-01-01:3:2")
+        render = Renderer()
+        response = self.fetch({"if-none-match": etag}, render, Version())
+        assert response.status_code == 304
+        assert response.headers["etag"] == etag
+        assert render.calls == 0
+
+    def test_changed_data(self, monkeypatch):
+        monkeypatch.setattr(tilecache, "tile_cache", TileCache(1024 * 1024, 60))
+        etag = version_etag(tile_key("v3", self.params), "2024-01-01:3:2")
+        render = Renderer()
+        response = self.fetch({"if-none-match": etag}, render, Version("2024-01-02:3:2"))
+        assert response.status_code == 200
+        assert response.headers["etag"] != etag
+        # served from the in-process tier until its ttl runs out
+        version = Version()
+        response = self.fetch({}, render, version)
+        assert response.status_code == 200
+        assert render.calls == 1 and version.calls == 0
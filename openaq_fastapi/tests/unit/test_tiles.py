@@ -0,0 +1,97 @@
+import asyncio
+
+from openaq_fastapi.routers.mvt import MobileTile, fetch_tile
+from openaq_fastapi.settings import settings
+from openaq_fastapi.v3.routers import tiles
+from openaq_fastapi.v3.routers.tiles import ThresholdTile, Tile, fetch_threshold_tiles, fetch_tiles
+
+
+class FakeDB:
+    async def fetchval(self, query, params):
+        self.query = query
+        self.params = params
+        return b""
+
+
+def fetch(fetcher, tile):
+    db = FakeDB()
+    asyncio.run(fetcher(tile, db))
+    return db
+
+
+class TestTiles:
+    def test_pruned_on_envelope(self):
+        db = fetch(fetch_tiles, Tile(z=10, x=292, y=391, parameters_id=["2"]))
+        assert "&& ST_Transform(bounds.envelope, 4326)" in db.query
+        assert "parameters_id = ANY (:parameters_id)" in db.query
+        assert "cluster_cell" not in db.params
+
+    def test_cached_geometry(self, monkeypatch):
+        monkeypatch.setattr(settings, "API_TILE_GEOM_CACHED", True)
+        db = fetch(fetch_tiles, Tile(z=10, x=292, y=391))
+        assert "g.geom3857 && bounds.envelope" in db.query
+
+    def test_version(self):
+        tile = Tile(z=10, x=292, y=391, parameters_id=["2"])
+        db = fetch(tiles.fetch_tile_version, tile)
+        assert "max(datetime_last)" in db.query
+        assert "ST_AsMVT" not in db.query
+        assert "parameters_id = ANY (:parameters_id)" in db.query
+        tile = ThresholdTile(z=3, x=1, y=2, period=30, threshold=5)
+        db = fetch(tiles.fetch_threshold_tile_version, tile)
+        assert "sum(exceedance)" in db.query
+        assert "threshold = :threshold AND period = :period" in db.query
+
+    def test_threshold_filters(self):
+        tile = ThresholdTile(z=3, x=1, y=2, period=30, threshold=5, owners_id=["4"])
+        db = fetch(fetch_threshold_tiles, tile)
+        assert "owners_id = ANY (:owners_id)" in db.query
+        assert db.params["owners_id"] == [4]
+
+
+class TestClusters:
+    def test_low_zoom_clusters(self):
+        db = fetch(fetch_tiles, Tile(z=settings.API_TILE_CLUSTER_MAX_ZOOM, x=0, y=0))
+        assert "ST_SnapToGrid(mvt, :cluster_cell)" in db.query
+        assert db.params["cluster_cell"] == settings.API_TILE_CLUSTER_CELL
+
+    def test_points_above_max_zoom(self, monkeypatch):
+        monkeypatch.setattr(settings, "API_TILE_CLUSTER_MAX_ZOOM", 2)
+        db = fetch(fetch_tiles, Tile(z=3, x=0, y=0))
+        assert "cluster_cell" not in db.query
+
+    def test_v2(self):
+        db = fetch(fetch_tile, MobileTile(z=2, x=0, y=0, parameter=2))
+        assert "FROM clusters f" in db.query
+        assert "GROUP BY ST_SnapToGrid(mvt, :cluster_cell), parameter, unit" in db.query
+        db = fetch(fetch_tile, MobileTile(z=12, x=0, y=0))
+        assert "FROM t f" in db.query
+
+
+class TestMobileTiles:
+    def test_tier(self, monkeypatch):
+        monkeypatch.setattr(settings, "API_MOBILE_TILE_ZOOMS", [4, 0, 8])
+        assert [tiles.mobile_tier(z) for z in (0, 3, 4, 7, 8, 20)] == [0, 0, 4, 4, 8, 8]
+
+    def test_generalized(self):
+        tile = Tile(z=9, x=150, y=190, parameters_id=["2"], providers_id=["3"])
+        db = fetch(tiles.fetch_mobile_gen_tiles, tile)
+        assert "mobile_points_generalized p" in db.query
+        assert "b.box3857 && bounds.envelope" in db.query
+        assert "p.measurands_id = ANY (:parameters_id)" in db.query
+        assert "providers_id = ANY (:providers_id)" in db.query
+        assert "measurements" not in db.query
+        assert db.params["tier"] == 8
+
+    def test_paths(self):
+        db = fetch(tiles.fetch_mobile_path_tiles, Tile(z=3, x=1, y=1))
+        assert "mobile_paths_generalized p" in db.query
+        assert "p.measurands_id" not in db.query
+        assert db.params["tier"] == 2
+
+    def test_mobile(self):
+        tile = tiles.MobileTile(z=14, x=1, y=1, parameters_id=2, is_monitor=False)
+        db = fetch(tiles.fetch_mobile_tiles, tile)
+        assert "WHERE parameters_id = :parameters_id\nAND ismonitor = :is_monitor" in db.query
+        assert "p.measurands_id = :parameters_id" in db.query
+        assert db.params["tier"] == 14